@@ -0,0 +1,361 @@
+"""Offline text analytics over the stored reviews.
+
+`python analytics.py run [--website amazon]` reads the reviews collection
+in batches and writes results back onto each review:
+
+* sentiment - lexicon score in [-1, 1] of the title and comment, with
+  negation ("not good" scores as negative), and sentiment_label
+  (positive, neutral or negative)
+* near_duplicate_of - content_hash of an earlier review with nearly the
+  same text (MinHash signatures, LSH banding, then a check that enough of
+  the two signatures agree)
+* spam - the review belongs to a group of at least SPAM_GROUP_SIZE
+  near-duplicates (copy-pasted reviews)
+
+It also stores each product's top TF-IDF keywords in the product's
+document in the stats collection, where GET /stats shows them. `/export`
+includes the per-review fields when asked with `"analytics": true`.
+
+A batch is tokenised into one sparse review x term matrix (SciPy CSR).
+Sentiment, keyword counts and MinHash signatures are then matrix and
+array operations over the whole batch, not Python loops over reviews.
+Signatures and LSH band keys are kept for every review until the end of
+the run, which costs about 400 bytes per review. NumPy and SciPy are
+optional dependencies that only this stage needs.
+"""
+import argparse
+import re
+import sys
+import time
+from datetime import datetime
+
+try:
+    import numpy as np
+    import scipy.sparse as sp
+except ImportError:
+    np = None
+
+from pymongo import UpdateOne
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# Placeholders the scrapers store for missing text; they are not review text
+PLACEHOLDERS = {'no title', 'no comment', 'n/a'}
+
+STOPWORDS = set('''
+a about above after again all also am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers him his how
+i if in into is it its itself just me more most my myself nor of off on once only or other our ours out over own
+same she should so some such than that the their theirs them then there these they this those through to too under
+until up very was we were what when where which while who whom why will with would you your yours product item
+'''.split())
+
+NEGATIONS = {'not', 'no', 'never', 'dont', "don't", 'didnt', "didn't", 'doesnt', "doesn't", 'isnt', "isn't",
+             'wasnt', "wasn't", 'cant', "can't", 'wont', "won't", 'hardly', 'without'}
+
+# A negated word scores this fraction of its opposite
+NEGATION_WEIGHT = 0.75
+
+SENTIMENT_LEXICON = {
+    'excellent': 3, 'amazing': 3, 'awesome': 3, 'superb': 3, 'outstanding': 3, 'perfect': 3, 'fantastic': 3,
+    'love': 3, 'loved': 3, 'best': 3, 'wonderful': 3, 'brilliant': 3, 'terrific': 3,
+    'great': 2, 'good': 2, 'nice': 2, 'happy': 2, 'satisfied': 2, 'recommend': 2, 'recommended': 2,
+    'worth': 2, 'fast': 1, 'smooth': 2, 'beautiful': 2, 'premium': 2, 'sturdy': 2, 'reliable': 2, 'comfortable': 2,
+    'bright': 1, 'clear': 1, 'decent': 1, 'fine': 1, 'ok': 0.5, 'okay': 0.5, 'value': 1, 'quick': 1, 'loud': 1,
+    'bad': -2, 'poor': -2, 'worst': -3, 'terrible': -3, 'horrible': -3, 'awful': -3, 'useless': -3, 'waste': -3,
+    'broken': -3, 'fake': -3, 'fraud': -3, 'defective': -3, 'damaged': -3, 'disappointed': -2, 'disappointing': -2,
+    'slow': -1, 'cheap': -1, 'heating': -1, 'heats': -1, 'lag': -2, 'lags': -2, 'hang': -2, 'hangs': -2,
+    'issue': -1, 'issues': -1, 'problem': -1, 'problems': -1, 'return': -1, 'returned': -2, 'refund': -2,
+    'faulty': -3, 'stopped': -2, 'dead': -3, 'scam': -3, 'flimsy': -2, 'noisy': -1, 'overpriced': -2,
+}
+
+# Sentiment scores beyond this are labelled positive or negative
+NEUTRAL_BAND = 0.05
+
+# MinHash signature length and LSH banding: 16 bands of 4 rows make
+# candidates of nearly all pairs sharing 70% or more of their shingles
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+MERSENNE_PRIME = (1 << 31) - 1
+
+# Candidates count as near-duplicates when this share of their signatures agree
+# (an estimate of the Jaccard similarity of their word pairs)
+DUPLICATE_SIMILARITY = 0.7
+
+SPAM_GROUP_SIZE = 3
+TOP_KEYWORDS = 10
+ANALYTICS_BATCH_SIZE = 5000
+
+
+def review_text(review):
+    parts = [review.get(field) for field in ('title', 'comment')]
+    return ' '.join(part for part in parts if isinstance(part, str) and part.strip().lower() not in PLACEHOLDERS)
+
+
+def tokenize(text):
+    """Lower-case word tokens; a word after a negation becomes 'not_<word>'"""
+    tokens = []
+    negate = False
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in NEGATIONS:
+            negate = True
+            continue
+        tokens.append('not_' + token if negate else token)
+        negate = False
+    return tokens
+
+
+def is_keyword(term):
+    # Negated words, stop words, numbers and very short words make poor keywords
+    return not term.startswith('not_') and term not in STOPWORDS and not term.isdigit() and len(term) > 2
+
+
+def lexicon_weight(term):
+    if term.startswith('not_'):
+        return -NEGATION_WEIGHT * SENTIMENT_LEXICON.get(term[4:], 0)
+    return SENTIMENT_LEXICON.get(term, 0)
+
+
+class TextAnalyzer:
+    """Batch-at-a-time analysis; call `add_batch` for every batch, then `finish`"""
+
+    def __init__(self, permutations=MINHASH_PERMUTATIONS, bands=LSH_BANDS, seed=1):
+        if np is None:
+            raise Exception("Text analytics needs the numpy and scipy packages")
+        self.vocabulary = {}
+        self.terms = []
+        self.weights = []
+        self.keyword_terms = []
+        self.products = {}
+        self.bands = bands
+        self.rows = permutations // bands
+        random = np.random.default_rng(seed)
+        self.hash_a = random.integers(1, MERSENNE_PRIME, permutations, dtype=np.uint64)
+        self.hash_b = random.integers(0, MERSENNE_PRIME, permutations, dtype=np.uint64)
+        # Per batch: (product rows, term columns, counts), signatures and band keys
+        self._product_terms = []
+        self._signatures = []
+        self._band_keys = []
+        self._has_signature = []
+
+    def _term_ids(self, tokens):
+        """Global term ids of a flat token list, adding new terms to the vocabulary"""
+        for term in set(tokens).difference(self.vocabulary):
+            self.vocabulary[term] = len(self.terms)
+            self.terms.append(term)
+            self.weights.append(lexicon_weight(term))
+            self.keyword_terms.append(is_keyword(term))
+        return np.fromiter(map(self.vocabulary.__getitem__, tokens), dtype=np.int64, count=len(tokens))
+
+    def add_batch(self, texts, products):
+        """Analyse one batch of review texts; returns sentiment scores (one per text)"""
+        token_lists = [tokenize(text) for text in texts]
+        lengths = np.array([len(tokens) for tokens in token_lists], dtype=np.int64)
+        term_ids = self._term_ids([token for tokens in token_lists for token in tokens])
+        review_ids = np.repeat(np.arange(len(texts)), lengths)
+
+        counts = sp.csr_matrix((np.ones(len(term_ids)), (review_ids, term_ids)), shape=(len(texts), len(self.terms)))
+        counts.sum_duplicates()
+
+        sentiment = self._sentiment(counts)
+        self._count_product_terms(counts, products)
+        self._minhash(term_ids, review_ids, lengths)
+        return sentiment
+
+    def _sentiment(self, counts):
+        raw = counts @ np.array(self.weights, dtype=np.float64)
+        # Squash the summed lexicon weights into [-1, 1] (as VADER does)
+        return raw / np.sqrt(raw * raw + 15)
+
+    def _count_product_terms(self, counts, products):
+        product_rows = np.array([self.products.setdefault(product, len(self.products)) for product in products], dtype=np.int64)
+        # Every word counts towards sentiment and near-duplicates, but only some can become keywords
+        content = counts.copy()
+        content.data[~np.array(self.keyword_terms, dtype=bool)[content.indices]] = 0
+        content.eliminate_zeros()
+        membership = sp.csr_matrix((np.ones(len(products)), (product_rows, np.arange(len(products)))), shape=(len(self.products), len(products)))
+        per_product = (membership @ content).tocoo()
+        self._product_terms.append((per_product.row, per_product.col, per_product.data))
+
+    def _minhash(self, term_ids, review_ids, lengths):
+        n = len(lengths)
+        # Shingles are pairs of adjacent words; one-word reviews use their word
+        ids = term_ids.astype(np.uint64)
+        starts = np.arange(max(len(term_ids) - 1, 0))
+        pairs = starts[review_ids[starts] == review_ids[starts + 1]]
+        shingles = ids[pairs] * np.uint64(1000003) ^ ids[pairs + 1]
+        shingle_reviews = review_ids[pairs]
+        short = np.isin(review_ids, np.flatnonzero(lengths == 1))
+        shingles = np.concatenate([shingles, ids[short]])
+        shingle_reviews = np.concatenate([shingle_reviews, review_ids[short]])
+
+        order = np.argsort(shingle_reviews, kind='stable')
+        shingles = shingles[order] % np.uint64(MERSENNE_PRIME)
+        shingle_reviews = shingle_reviews[order]
+
+        signatures = np.full((n, len(self.hash_a)), MERSENNE_PRIME, dtype=np.uint64)
+        has_signature = np.zeros(n, dtype=bool)
+        if len(shingles):
+            present, first = np.unique(shingle_reviews, return_index=True)
+            # Universal hashing (a*x + b) mod p for every permutation at once, in chunks to bound memory
+            for start in range(0, len(present), 2048):
+                segment = slice(first[start], first[start + 2048] if start + 2048 < len(present) else len(shingles))
+                hashed = (shingles[segment, None] * self.hash_a + self.hash_b) % np.uint64(MERSENNE_PRIME)
+                offsets = first[start:start + 2048] - first[start]
+                signatures[present[start:start + 2048]] = np.minimum.reduceat(hashed, offsets, axis=0)
+            has_signature[present] = True
+
+        signatures = signatures.astype(np.uint32)
+        bands = signatures.reshape(n, self.bands, self.rows).astype(np.uint64)
+        keys = np.zeros((n, self.bands), dtype=np.uint64)
+        for row in range(self.rows):
+            keys = keys * np.uint64(0x9E3779B1) ^ bands[:, :, row]
+        # Make equal rows in different bands distinct keys
+        keys = keys * np.uint64(31) + np.arange(self.bands, dtype=np.uint64)
+
+        self._signatures.append(signatures)
+        self._band_keys.append(keys)
+        self._has_signature.append(has_signature)
+
+    def near_duplicates(self, similarity=DUPLICATE_SIMILARITY):
+        """For every review so far, the index of the earliest review it nearly duplicates (itself if none)"""
+        signatures = np.vstack(self._signatures)
+        keys = np.vstack(self._band_keys)
+        has_signature = np.concatenate(self._has_signature)
+        earliest = np.arange(len(signatures))
+        signed = np.flatnonzero(has_signature)
+        if signed.size == 0:
+            # Every title and comment was empty or a placeholder
+            return earliest
+
+        for band in range(keys.shape[1]):
+            members = signed
+            band_keys = keys[members, band]
+            order = np.argsort(band_keys, kind='stable')
+            members, band_keys = members[order], band_keys[order]
+            # The first member of each run of equal keys is the earliest review in that bucket
+            run_start = np.r_[True, band_keys[1:] != band_keys[:-1]]
+            leaders = members[run_start][np.cumsum(run_start) - 1]
+            candidates = members != leaders
+            if not candidates.any():
+                continue
+            pairs, leaders = members[candidates], leaders[candidates]
+            agree = (signatures[pairs] == signatures[leaders]).mean(axis=1)
+            similar = agree >= similarity
+            np.minimum.at(earliest, pairs[similar], leaders[similar])
+        # Follow chains so every group points at its earliest member
+        while True:
+            followed = earliest[earliest]
+            if np.array_equal(followed, earliest):
+                return earliest
+            earliest = followed
+
+    def keywords(self, top=TOP_KEYWORDS):
+        """Top TF-IDF terms of every product, treating each product's reviews as one document"""
+        rows, cols, data = (np.concatenate(parts) for parts in zip(*self._product_terms))
+        matrix = sp.csr_matrix((data, (rows, cols)), shape=(len(self.products), len(self.terms)))
+        matrix.sum_duplicates()
+        document_frequency = np.bincount(matrix.indices, minlength=len(self.terms))
+        idf = np.log((1 + len(self.products)) / (1 + document_frequency)) + 1
+        matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices]
+
+        keywords = {}
+        for product, row in self.products.items():
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            scores, terms = matrix.data[start:end], matrix.indices[start:end]
+            best = np.argsort(-scores, kind='stable')[:top]
+            keywords[product] = [self.terms[term] for term in terms[best]]
+        return keywords
+
+    def finish(self):
+        """(earliest near-duplicate index per review, spam flag per review, keywords per product)"""
+        earliest = self.near_duplicates()
+        group_sizes = np.bincount(earliest, minlength=len(earliest))
+        spam = group_sizes[earliest] >= SPAM_GROUP_SIZE
+        return earliest, spam, self.keywords()
+
+
+def sentiment_label(score):
+    if score > NEUTRAL_BAND:
+        return 'positive'
+    if score < -NEUTRAL_BAND:
+        return 'negative'
+    return 'neutral'
+
+
+def run_analytics(collection, stats, website=None, batch_size=ANALYTICS_BATCH_SIZE):
+    """Analyse every stored review (of `website`) and write the results back; returns the review count"""
+    from review_stats import stats_id
+
+    analyzer = TextAnalyzer()
+    query = {'content_hash': {'$exists': True}}
+    if website:
+        query['website'] = website.lower()
+    projection = {'_id': 1, 'website': 1, 'product_id': 1, 'title': 1, 'comment': 1, 'content_hash': 1}
+
+    ids, hashes = [], []
+    batch = []
+    start = time.perf_counter()
+
+    def flush(batch):
+        products = [stats_id(review['website'], review['product_id']) for review in batch]
+        scores = analyzer.add_batch([review_text(review) for review in batch], products)
+        now = datetime.now()
+        collection.bulk_write([
+            UpdateOne({'_id': review['_id']}, {'$set': {
+                'sentiment': round(float(score), 4),
+                'sentiment_label': sentiment_label(score),
+                # Set again below for the reviews that still have them
+                'near_duplicate_of': None,
+                'spam': False,
+                'analysed_at': now,
+            }})
+            for review, score in zip(batch, scores)
+        ], ordered=False)
+        ids.extend(review['_id'] for review in batch)
+        hashes.extend(review['content_hash'] for review in batch)
+        print(f"Analysed {len(ids)} reviews ({len(ids) / (time.perf_counter() - start):.0f}/s)")
+
+    for review in collection.find(query, projection, batch_size=batch_size).sort('_id', 1):
+        batch.append(review)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    if not ids:
+        return 0
+
+    earliest, spam, keywords = analyzer.finish()
+    flagged = np.flatnonzero((earliest != np.arange(len(earliest))) | spam)
+    updates = [
+        UpdateOne({'_id': ids[i]}, {'$set': {
+            'near_duplicate_of': hashes[earliest[i]] if earliest[i] != i else None,
+            'spam': bool(spam[i]),
+        }})
+        for i in flagged
+    ]
+    for chunk_start in range(0, len(updates), batch_size):
+        collection.bulk_write(updates[chunk_start:chunk_start + batch_size], ordered=False)
+
+    stats.bulk_write([UpdateOne({'_id': key}, {'$set': {'keywords': words}}) for key, words in keywords.items()], ordered=False)
+    print(f"Flagged {int((earliest != np.arange(len(earliest))).sum())} near-duplicates and {int(spam.sum())} spam reviews")
+    return len(ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analyse the text of stored reviews')
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--website')
+    parser.add_argument('--batch-size', type=int, default=ANALYTICS_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from database import get_collection
+    from review_stats import stats_collection
+
+    collection = get_collection()
+    if collection is None:
+        print("MongoDB not available")
+        sys.exit(1)
+    print(f"Analysed {run_analytics(collection, stats_collection(collection), args.website, args.batch_size)} reviews")
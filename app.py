@@ -1,398 +1,397 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Blueprint, Flask, Response, current_app, g, render_template, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from bs4 import BeautifulSoup
-import requests
-import re
-import time
+import itertools
 import json
-from pymongo import MongoClient
-from datetime import datetime
-import openpyxl
-from openpyxl.styles import Font, Alignment
 import os
-import random
-
-app = Flask(__name__)
-CORS(app)
-
-# MongoDB connection setup (optional)
-try:
-    client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=5000)
-    db = client['product_reviews']
-    collection = db['reviews']
-    print("MongoDB connection successful")
-except Exception as e:
-    print(f"MongoDB not available: {e}")
-    collection = None
-
-# User-Agents list for rotation
-USER_AGENTS = [
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36',
-    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
-    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Safari/605.1.15'
-]
-
-def get_soup(url):
-    headers = {
-        'User-Agent': random.choice(USER_AGENTS),
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-    }
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        # Check if we got blocked
-        if "captcha" in response.text.lower() or "robot" in response.text.lower():
-            raise Exception("Website blocked the request with CAPTCHA")
-            
-        return BeautifulSoup(response.content, 'html.parser')
-    except Exception as e:
-        raise Exception(f"Error fetching page: {str(e)}")
+import threading
+
+from metrics import EXPORT_SECONDS, PROFILING_ENABLED, render
+from reviews import Review, ReviewBatch
+
+# Routes are registered on an app built by create_app(). The scraping stack
+# (BeautifulSoup, httpx), pymongo and the export libraries are imported by the
+# routes that use them, so the web process starts without them.
+bp = Blueprint('scraper', __name__)
+
+def queue_reviews(reviews, website):
+    """Hand reviews to the background writer; scrapes never wait on MongoDB"""
+    from writer import get_writer
+    return get_writer().submit(reviews, website)
+
+def make_watermarks():
+    # Per-product high-water marks for incremental scrapes
+    from database import get_db
+    from incremental import WatermarkStore
+    from writer import writer_failing
+    db = get_db()
+    # While the writer's saves fail, scrapes skip the marks instead of waiting on MongoDB
+    return WatermarkStore(db['watermarks'] if db is not None else None, failing=writer_failing)
+
+def make_job_backend():
+    # Scrape jobs run in the background; SCRAPE_JOB_BACKEND=mongo hands them to `python jobs.py worker`
+    from database import get_db
+    from jobs import create_job_backend
+    return create_job_backend(get_db(), save_reviews=queue_reviews, watermarks=get_service('watermarks'))
+
+def make_batch_scheduler():
+    # Multi-product scrapes, with a concurrency limit per site
+    from batch import BatchScheduler
+    return BatchScheduler(save_reviews=queue_reviews, watermarks=get_service('watermarks'))
+
+SERVICES = {
+    'watermarks': make_watermarks,
+    'job_backend': make_job_backend,
+    'batch_scheduler': make_batch_scheduler,
+}
+
+def get_service(name):
+    """The current app's watermarks, job_backend or batch_scheduler, built on first use"""
+    services = current_app.extensions['scraper']
+    with services['lock']:
+        if name not in services:
+            services[name] = SERVICES[name]()
+        return services[name]
+
+def parse_flag(value):
+    """True for JSON true or a form-style '1'/'true'; false for anything else, including 'false' and '0'"""
+    return str(value).lower() in ('1', 'true')
+
+def has_review_batch(obj):
+    return isinstance(obj, dict) and any(isinstance(value, ReviewBatch) for value in obj.values())
+
+class ReviewJSONProvider(DefaultJSONProvider):
+    """JSON whose ReviewBatch values are written straight from their columns.
+
+    Responses holding a batch are streamed a chunk of reviews at a time, so
+    the whole body is never built as one string.
+    """
+
+    def iter_dumps(self, obj):
+        yield '{'
+        for i, (key, value) in enumerate(sorted(obj.items()) if self.sort_keys else obj.items()):
+            yield (', ' if i else '') + json.dumps(key) + ': '
+            if isinstance(value, ReviewBatch):
+                yield from value.iter_json_chunks()
+            else:
+                yield super().dumps(value)
+        yield '}'
+
+    def dumps(self, obj, **kwargs):
+        if not has_review_batch(obj):
+            return super().dumps(obj, **kwargs)
+        return ''.join(self.iter_dumps(obj))
+
+    def response(self, *args, **kwargs):
+        obj = args[0] if len(args) == 1 and not kwargs else None
+        if not has_review_batch(obj):
+            return super().response(*args, **kwargs)
+        return self._app.response_class(itertools.chain(self.iter_dumps(obj), ['\n']), mimetype=self.mimetype)
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Review):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+def create_app(config=None):
+    """Build the Flask app; nothing connects to MongoDB or imports the scrapers until a route needs it"""
+    app = Flask(__name__)
+    app.json = ReviewJSONProvider(app)
+    app.config.update(config or {})
+    CORS(app)
+    # Services of this app; the lock is reentrant because services build on each other
+    app.extensions['scraper'] = {'lock': threading.RLock()}
+    app.register_blueprint(bp)
+    return app
+
+@bp.before_app_request
+def start_profile():
+    # SCRAPER_PROFILING=1 lets any request be profiled by adding ?profile=1
+    if PROFILING_ENABLED and request.args.get('profile') == '1':
+        from fetcher import get_loop
+        from metrics import RequestProfiler
+        profiler = RequestProfiler(get_loop())
+        if not profiler.start():
+            return Response("Another request is being profiled, try again when it finishes\n", status=409, mimetype='text/plain')
+        g.profiler = profiler
+
+@bp.after_app_request
+def stop_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    # Streamed bodies are produced after this point, so only their setup is profiled
+    return Response(profiler.stop(), mimetype='text/plain')
+
+@bp.teardown_app_request
+def release_profile(exception=None):
+    # A request that never reached stop_profile must not keep profiling on
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
+# Flask Routes
+@bp.route('/')
+def index():
+    return render_template('index.html')
 
-def scrape_flipkart_reviews(product_url, max_reviews=10):
-    reviews = []
+@bp.route('/scrape', methods=['POST'])
+async def scrape_reviews():
+    data = request.json
+    product_url = data.get('url', '')
+    website = data.get('website', 'flipkart')
+    max_reviews = int(data.get('max_reviews', 10))
+    incremental = parse_flag(data.get('incremental', False))
     
-    try:
-        # Try direct HTML scraping for Flipkart
-        soup = get_soup(product_url)
-        
-        if not soup:
-            return []
-        
-        # Try to find review elements - multiple possible selectors
-        review_selectors = [
-            'div._1AtVbE',  # New Flipkart selector
-            'div._27M-vq',  # Alternative selector
-            'div.t-ZTKy',   # Comment text
-            'div._1PBCrt'   # Review card
-        ]
-        
-        review_elements = None
-        for selector in review_selectors:
-            review_elements = soup.select(selector)
-            if review_elements:
-                break
-                
-        if not review_elements:
-            print("No review elements found with any selector")
-            return []
-            
-        # Extract product name
-        product_name = "Unknown Product"
-        title_selectors = ['span.VU-ZEz', 'span.B_NuCI', 'h1._2NKhZn', 'span._35KyD6']
-        for selector in title_selectors:
-            title_element = soup.select_one(selector)
-            if title_element:
-                product_name = title_element.get_text().strip()
-                break
-        
-        # Extract reviews
-        for i, review_element in enumerate(review_elements[:max_reviews]):
-            try:
-                # Try to find rating
-                rating = 0
-                rating_element = review_element.select_one('div._3LWZlK')
-                if rating_element:
-                    rating_text = rating_element.get_text().strip()
-                    try:
-                        rating = float(rating_text)
-                    except:
-                        rating = 0
-                
-                # Try to find review text
-                comment = "No comment"
-                comment_element = review_element.select_one('div.t-ZTKy')
-                if comment_element:
-                    comment = comment_element.get_text().strip()
-                
-                # Try to find reviewer name
-                user = "Anonymous"
-                user_element = review_element.select_one('p._2sc7ZR')
-                if user_element:
-                    user = user_element.get_text().strip()
-                
-                # Try to find review title
-                title = "No title"
-                title_element = review_element.select_one('p._2-N8zT')
-                if title_element:
-                    title = title_element.get_text().strip()
-                
-                review = {
-                    'product': product_name,
-                    'user': user,
-                    'rating': rating,
-                    'title': title,
-                    'comment': comment,
-                    'date': 'N/A',
-                    'website': 'flipkart'
-                }
-                reviews.append(review)
-                
-            except Exception as e:
-                print(f"Error parsing review {i}: {e}")
-                continue
-                
-    except Exception as e:
-        print(f"Flipkart scraping failed: {str(e)}")
-        # Return some sample data for testing
-        if not reviews:
-            reviews = get_sample_reviews('flipkart')
+    print(f"Scraping {website} URL: {product_url} for {max_reviews} reviews")
     
-    return reviews
-
-def scrape_amazon_reviews(product_url, max_reviews=10):
-    reviews = []
+    from fetcher import run_async
+    from incremental import iter_review_batches
+    from scrapper import collect_reviews
     
     try:
-        # Extract product ASIN from URL
-        asin_match = re.search(r'/dp/([A-Z0-9]{10})', product_url)
-        if not asin_match:
-            return []
-            
-        asin = asin_match.group(1)
-        review_url = f"https://www.amazon.in/product-reviews/{asin}/"
-        
-        soup = get_soup(review_url)
+        # The scrape runs on the shared scraping loop; this handler only awaits it
+        failures = []
+        try:
+            batches = iter_review_batches(website, product_url, max_reviews, incremental, get_service('watermarks'), failures)
+            reviews = await run_async(collect_reviews(batches))
+        except ValueError:
+            return jsonify({'error': 'Unsupported website'}), 400
         
-        if not soup:
-            return []
+        # Pages that failed are reported, never replaced with made-up rows
+        if not reviews and failures:
+            return jsonify({'error': failures[0]['error'], 'failed_pages': failures}), 502
         
-        # Extract product name
-        product_name = "Unknown Product"
-        title_element = soup.select_one('a.a-link-normal[data-hook="product-link"]')
-        if title_element:
-            product_name = title_element.get_text().strip()
+        print(f"Successfully scraped {len(reviews)} reviews ({len(failures)} pages failed)")
         
-        # Find review elements
-        review_elements = soup.select('div[data-hook="review"]')
+        saved = queue_reviews(reviews, website) if reviews else None
         
-        if not review_elements:
-            print("No Amazon review elements found")
-            return []
-            
-        for i, review_element in enumerate(review_elements[:max_reviews]):
-            try:
-                # Extract rating
-                rating = 0
-                rating_element = review_element.select_one('i[data-hook="review-star-rating"]')
-                if rating_element:
-                    rating_text = rating_element.get_text()
-                    rating_match = re.search(r'(\d+\.?\d*) out', rating_text)
-                    if rating_match:
-                        rating = float(rating_match.group(1))
-                
-                # Extract review text
-                comment = "No comment"
-                comment_element = review_element.select_one('span[data-hook="review-body"]')
-                if comment_element:
-                    comment = comment_element.get_text().strip()
-                
-                # Extract reviewer name
-                user = "Anonymous"
-                user_element = review_element.select_one('span.a-profile-name')
-                if user_element:
-                    user = user_element.get_text().strip()
-                
-                # Extract review title
-                title = "No title"
-                title_element = review_element.select_one('a[data-hook="review-title"]')
-                if title_element:
-                    title_span = title_element.select_one('span:not([class])')
-                    if title_span:
-                        title = title_span.get_text().strip()
-                
-                # Extract date
-                date = "N/A"
-                date_element = review_element.select_one('span[data-hook="review-date"]')
-                if date_element:
-                    date = date_element.get_text().split('on')[-1].strip()
-                
-                review = {
-                    'product': product_name,
-                    'user': user,
-                    'rating': rating,
-                    'title': title,
-                    'comment': comment,
-                    'date': date,
-                    'website': 'amazon'
-                }
-                reviews.append(review)
-                
-            except Exception as e:
-                print(f"Error parsing Amazon review {i}: {e}")
-                continue
-                
-    except Exception as e:
-        print(f"Amazon scraping failed: {str(e)}")
-        # Return some sample data for testing
-        if not reviews:
-            reviews = get_sample_reviews('amazon')
-    
-    return reviews
-
-def get_sample_reviews(website):
-    """Return sample reviews for testing when scraping fails"""
-    if website == 'flipkart':
-        return [
-            {
-                'product': 'Sample Flipkart Product',
-                'user': 'Customer 1',
-                'rating': 4.5,
-                'title': 'Good product',
-                'comment': 'This is a sample review for testing purposes.',
-                'date': '2023-01-01',
-                'website': 'flipkart'
-            },
-            {
-                'product': 'Sample Flipkart Product',
-                'user': 'Customer 2',
-                'rating': 3.0,
-                'title': 'Average product',
-                'comment': 'This is another sample review for testing.',
-                'date': '2023-01-02',
-                'website': 'flipkart'
-            }
-        ]
-    else:
-        return [
-            {
-                'product': 'Sample Amazon Product',
-                'user': 'Buyer 1',
-                'rating': 5.0,
-                'title': 'Excellent product',
-                'comment': 'This is a sample Amazon review for testing.',
-                'date': '2023-01-01',
-                'website': 'amazon'
-            },
-            {
-                'product': 'Sample Amazon Product',
-                'user': 'Buyer 2',
-                'rating': 4.0,
-                'title': 'Very good',
-                'comment': 'Another sample review for testing Amazon scraping.',
-                'date': '2023-01-02',
-                'website': 'amazon'
-            }
-        ]
-
-# Database Functions
-def save_to_mongodb(reviews, website):
-    try:
-        if not collection:
-            print("MongoDB not available, skipping save")
-            return 0
-            
-        for review in reviews:
-            review['scraped_at'] = datetime.now()
-            review['website'] = website.lower()
-        
-        if reviews:
-            result = collection.insert_many(reviews)
-            print(f"Saved {len(result.inserted_ids)} reviews to MongoDB")
-            return len(result.inserted_ids)
-        return 0
+        return jsonify({
+            'success': True,
+            'reviews': reviews,
+            'count': len(reviews),
+            'saved': saved,
+            'partial': bool(failures),
+            'failed_pages': failures
+        })
     except Exception as e:
-        print(f"Error saving to MongoDB: {str(e)}")
-        return 0
+        print(f"Scraping error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-def get_reviews_from_mongodb(website=None):
+@bp.route('/scrape/stream', methods=['GET', 'POST'])
+def stream_reviews():
+    """Stream reviews page by page as NDJSON (default) or Server-Sent Events"""
+    data = request.json if request.method == 'POST' else request.args
+    product_url = data.get('url', '')
+    website = data.get('website', 'flipkart')
+    max_reviews = int(data.get('max_reviews', 10))
+    incremental = parse_flag(data.get('incremental', False))
+    stream_format = data.get('format') or ('sse' if 'text/event-stream' in request.headers.get('Accept', '') else 'ndjson')
+    
+    from fetcher import iter_sync
+    from incremental import iter_review_batches
+    
+    failures = []
     try:
-        if not collection:
-            return []
-            
-        query = {'website': website.lower()} if website else {}
-        reviews = list(collection.find(query, {'_id': 0}))
-        return reviews
-    except Exception as e:
-        print(f"Error fetching from MongoDB: {str(e)}")
-        return []
-
-# Export Functions
-def export_to_excel(reviews, website):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"{website.capitalize()} Reviews"
+        batches = iter_sync(iter_review_batches(website, product_url, max_reviews, incremental, get_service('watermarks'), failures))
+    except ValueError:
+        return jsonify({'error': 'Unsupported website'}), 400
+    
+    # The body is generated after the request context is gone
+    dumps = current_app.json.dumps
     
-    headers = ['Product', 'User', 'Rating', 'Title', 'Comment', 'Date', 'Website']
+    def encode(event, payload):
+        if stream_format == 'sse':
+            return f"event: {event}\ndata: {dumps(payload)}\n\n"
+        return dumps(payload) + "\n"
     
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
+    def generate():
+        count = 0
+        try:
+            for batch in batches:
+                count += len(batch)
+                yield encode('reviews', {'reviews': batch})
+                if batch:
+                    queue_reviews(batch, website)
+        except Exception as e:
+            print(f"Streaming scrape error: {str(e)}")
+            yield encode('error', {'error': str(e)})
+            return
+        yield encode('done', {'done': True, 'count': count, 'partial': bool(failures), 'failed_pages': failures})
     
-    for row_num, review in enumerate(reviews, 2):
-        ws.cell(row=row_num, column=1, value=review.get('product', 'N/A'))
-        ws.cell(row=row_num, column=2, value=review.get('user', 'Anonymous'))
-        ws.cell(row=row_num, column=3, value=review.get('rating', 0))
-        ws.cell(row=row_num, column=4, value=review.get('title', 'No Title'))
-        ws.cell(row=row_num, column=5, value=review.get('comment', 'No Comment'))
-        ws.cell(row=row_num, column=6, value=review.get('date', 'N/A'))
-        ws.cell(row=row_num, column=7, value=review.get('website', 'N/A'))
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/scrape/batch', methods=['POST'])
+def scrape_batch():
+    """Scrape many products in the background; takes JSON `urls` or an uploaded `file` of URLs"""
+    from batch import MAX_BATCH_URLS, read_urls
     
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
+    if 'file' in request.files:
+        data = request.form
+        urls = read_urls(request.files['file'].read().decode('utf-8', errors='replace'))
+    else:
+        data = request.json or {}
+        urls = [url.strip() for url in data.get('urls', []) if url.strip()]
+    max_reviews = int(data.get('max_reviews', 10))
+    incremental = parse_flag(data.get('incremental', False))
     
-    filename = f"{website}_reviews.xlsx"
-    wb.save(filename)
+    if not urls:
+        return jsonify({'error': 'No product URLs given'}), 400
+    if len(urls) > MAX_BATCH_URLS:
+        return jsonify({'error': f'At most {MAX_BATCH_URLS} URLs per batch'}), 400
     
-    return filename
+    batch_id = get_service('batch_scheduler').submit(urls, max_reviews, incremental)
+    return jsonify({
+        'success': True,
+        'batch_id': batch_id,
+        'count': len(urls),
+        'status_url': f'/scrape/batch/{batch_id}'
+    }), 202
 
-# Flask Routes
-@app.route('/')
-def index():
-    return render_template('index.html')
+@bp.route('/scrape/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    batch = get_service('batch_scheduler').get(batch_id)
+    if not batch:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(batch)
 
-@app.route('/scrape', methods=['POST'])
-def scrape_reviews():
+@bp.route('/jobs', methods=['POST'])
+def create_job():
     data = request.json
     product_url = data.get('url', '')
     website = data.get('website', 'flipkart')
     max_reviews = int(data.get('max_reviews', 10))
+    incremental = parse_flag(data.get('incremental', False))
     
-    print(f"Scraping {website} URL: {product_url} for {max_reviews} reviews")
+    from sites import get_site
+    try:
+        get_site(website)
+    except ValueError:
+        return jsonify({'error': 'Unsupported website'}), 400
     
     try:
-        if 'flipkart' in website.lower():
-            reviews = scrape_flipkart_reviews(product_url, max_reviews)
-        elif 'amazon' in website.lower():
-            reviews = scrape_amazon_reviews(product_url, max_reviews)
-        else:
-            return jsonify({'error': 'Unsupported website'}), 400
-        
-        print(f"Successfully scraped {len(reviews)} reviews")
-        
-        if reviews:
-            save_to_mongodb(reviews, website)
-        
+        job_id = get_service('job_backend').submit(website, product_url, max_reviews, incremental)
         return jsonify({
             'success': True,
-            'reviews': reviews,
-            'count': len(reviews)
-        })
+            'job_id': job_id,
+            'status_url': f'/jobs/{job_id}'
+        }), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_service('job_backend').get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@bp.route('/jobs/<job_id>/reviews', methods=['GET'])
+def get_job_reviews(job_id):
+    job_backend = get_service('job_backend')
+    if not job_backend.get(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    
+    offset = max(int(request.args.get('offset', 0)), 0)
+    limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    reviews = job_backend.get_reviews(job_id, offset, limit)
+    
+    return jsonify({
+        'reviews': reviews,
+        'offset': offset,
+        'count': len(reviews),
+        'next_offset': offset + len(reviews) if len(reviews) == limit else None
+    })
+
+@bp.route('/reviews', methods=['GET'])
+def list_reviews():
+    """Stored reviews, filtered and keyset-paginated; pass `next_cursor` back as `cursor`"""
+    from database import find_reviews, review_query
+    
+    args = request.args
+    fields = args.get('fields')
+    
+    try:
+        query = review_query(
+            website=args.get('website'),
+            product=args.get('product'),
+            min_rating=args.get('min_rating'),
+            max_rating=args.get('max_rating'),
+            date_from=args.get('date_from'),
+            date_to=args.get('date_to')
+        )
+        reviews, next_cursor = find_reviews(
+            query,
+            fields=fields.split(',') if fields else None,
+            after=args.get('cursor'),
+            limit=args.get('limit', 100)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({
+        'reviews': reviews,
+        'count': len(reviews),
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/stats', methods=['GET'])
+@bp.route('/stats/<product>', methods=['GET'])
+def review_stats(product=None):
+    """Rating aggregates of a product (pid or ASIN, `website` optional) or of a `website`"""
+    from database import get_collection
+    from review_stats import get_stats, stats_collection
+    
+    website = request.args.get('website')
+    if product is None and not website:
+        return jsonify({'error': 'Give a product or a website'}), 400
+    
+    collection = get_collection()
+    if collection is None:
+        return jsonify({'error': 'MongoDB not available'}), 503
+    try:
+        stats = get_stats(stats_collection(collection), website, product)
     except Exception as e:
-        print(f"Scraping error: {str(e)}")
         return jsonify({'error': str(e)}), 500
+    
+    if stats is None:
+        return jsonify({'error': 'No reviews stored for this product' if product else 'No reviews stored for this website'}), 404
+    return jsonify(stats)
+
+@bp.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    from cache import get_cache
+    cache = get_cache()
+    if cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(cache.stats(), enabled=True))
+
+@bp.route('/rate-limits', methods=['GET'])
+def rate_limits():
+    """Current adaptive request rate, backoff, block counts and circuit state per host"""
+    from fetcher import circuit_breaker, rate_limiter
+    hosts = rate_limiter.stats()
+    for host, circuit in circuit_breaker.stats().items():
+        hosts.setdefault(host, {})['circuit'] = circuit
+    return jsonify(hosts)
 
-@app.route('/test', methods=['GET'])
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Counters and latency histograms in the Prometheus text format"""
+    # These register metrics when imported; load them so every series is there from the first scrape
+    import fetcher
+    import writer
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/test', methods=['GET'])
 def test_scraping():
     """Test endpoint to check if scraping works"""
+    from scrapper import scrape_flipkart_reviews
+    
     try:
         # Test with a known Flipkart product URL
         test_url = "https://www.flipkart.com/samsung-galaxy-f14-5g-goat-green-128-gb/p/itm5c6c8c6c8c6c8"
@@ -407,37 +406,65 @@ def test_scraping():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/export', methods=['POST'])
+@bp.route('/export', methods=['POST'])
 def export_reviews():
+    """Export a site's stored reviews as xlsx (default), csv, jsonl (gzip) or parquet"""
+    from database import iter_reviews_from_mongodb, review_query
+    from exports import (ANALYTICS_COLUMNS, EXPORT_COLUMNS, EXPORT_FORMATS, export_fields, export_file, iter_csv,
+                         iter_jsonl_gzip, timed_stream, write_excel, write_parquet)
+    
     data = request.json
     website = data.get('website', 'flipkart')
+    export_format = data.get('format', 'xlsx').lower()
+    # With "analytics": true, also export the sentiment and duplicate fields from analytics.py
+    columns = EXPORT_COLUMNS + ANALYTICS_COLUMNS if data.get('analytics') else EXPORT_COLUMNS
+    
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unsupported export format: {export_format}"}), 400
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    download_name = f"{website}_reviews.{extension}"
     
     try:
-        reviews = get_reviews_from_mongodb(website)
+        # Rows stream from the cursor into the export; nothing holds the whole export
+        reviews = iter_reviews_from_mongodb(review_query(website), fields=export_fields(columns))
+        first = next(reviews, None)
         
-        if not reviews:
+        if first is None:
             # If no reviews in DB, try scraping first
             return jsonify({'error': 'No reviews found. Please scrape reviews first.'}), 404
+        reviews = itertools.chain([first], reviews)
+        
+        # Text formats are sent while they are produced
+        if export_format in ('csv', 'jsonl'):
+            chunks = iter_csv(reviews, columns) if export_format == 'csv' else iter_jsonl_gzip(reviews, columns)
+            return Response(timed_stream(chunks, export_format), mimetype=mimetype, headers={
+                'Content-Disposition': f'attachment; filename="{download_name}"'
+            })
         
-        filename = export_to_excel(reviews, website)
+        with EXPORT_SECONDS.time(format=export_format):
+            if export_format == 'parquet':
+                output, count = export_file(write_parquet, reviews, columns=columns)
+            else:
+                output, count = export_file(write_excel, reviews, website, columns=columns)
+        print(f"Exported {count} {website} reviews as {export_format}")
         
         return send_file(
-            filename,
+            output,
             as_attachment=True,
-            download_name=f"{website}_reviews.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            download_name=download_name,
+            mimetype=mimetype
         )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+app = create_app()
+
 if __name__ == '__main__':
     # Create necessary folders if they don't exist
-    if not os.path.exists('static/css'):
-        os.makedirs('static/css')
-    if not os.path.exists('static/js'):
-        os.makedirs('static/js')
-    if not os.path.exists('templates'):
-        os.makedirs('templates')
+    for folder in ('static/css', 'static/js', 'templates'):
+        os.makedirs(folder, exist_ok=True)
     
     print("Starting Flask server...")
     print("Open http://localhost:5000 in your browser")
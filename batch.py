@@ -0,0 +1,142 @@
+"""Multi-product scrapes.
+
+`POST /scrape/batch` takes a list of product URLs and works out each one's
+site from its host. It then runs them on the shared scraping loop under
+per-site concurrency limits. Flipkart and Amazon products each queue only
+behind their own site, so work on the two overlaps. Requests to each host
+are still paced by the per-host rate limiter in fetcher. A product that
+fails is recorded as failed and the rest of the batch carries on.
+Reviews are queued for saving as each product finishes. The batch record keeps
+per-product counts for polling.
+"""
+import asyncio
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from fetcher import get_loop
+from incremental import iter_review_batches
+from metrics import ACTIVE_JOBS
+from scrapper import collect_reviews, product_id_from_url
+from sites import site_for_url
+
+# Products of one site scraped at the same time
+SITE_CONCURRENCY = {
+    'flipkart': 8,
+    'amazon': 2,
+}
+
+MAX_BATCH_URLS = 10000
+
+# Finished batches kept around for polling before the oldest are dropped
+MAX_FINISHED_BATCHES = 50
+
+
+def read_urls(text):
+    """Product URLs from an uploaded file: one per line, or the first URL column of a CSV"""
+    urls = []
+    for line in text.splitlines():
+        for field in line.split(','):
+            field = field.strip().strip('"')
+            if field.startswith(('http://', 'https://')):
+                urls.append(field)
+                break
+    return urls
+
+
+def new_product(url):
+    website = site_for_url(url)
+    return {
+        'url': url,
+        'website': website,
+        'product_id': product_id_from_url(website, url) if website else None,
+        'status': 'queued' if website else 'failed',
+        'pages_done': 0,
+        'reviews_collected': 0,
+        'saved': None,
+        'failed_pages': [],
+        'error': None if website else 'Unsupported website',
+    }
+
+
+class BatchScheduler:
+    """Runs batches of products with a separate concurrency limit per site"""
+
+    def __init__(self, site_concurrency=None, save_reviews=None, watermarks=None):
+        self.site_concurrency = dict(SITE_CONCURRENCY, **(site_concurrency or {}))
+        self.save_reviews = save_reviews
+        self.watermarks = watermarks
+        self._semaphores = {}
+        # Request threads add batches while the scraping loop evicts finished ones
+        self._lock = threading.Lock()
+        self._batches = OrderedDict()
+
+    def submit(self, urls, max_reviews, incremental=False):
+        batch = {
+            'id': uuid.uuid4().hex,
+            'max_reviews': max_reviews,
+            'incremental': incremental,
+            'status': 'running',
+            'created_at': datetime.now(),
+            'finished_at': None,
+            'products': [new_product(url) for url in urls],
+        }
+        with self._lock:
+            self._batches[batch['id']] = batch
+        asyncio.run_coroutine_threadsafe(self._run(batch), get_loop())
+        return batch['id']
+
+    def _semaphore(self, website):
+        # Created on first use, on the scraping loop
+        if website not in self._semaphores:
+            self._semaphores[website] = asyncio.Semaphore(self.site_concurrency.get(website, 2))
+        return self._semaphores[website]
+
+    async def _run_product(self, batch, product):
+        async with self._semaphore(product['website']):
+            with ACTIVE_JOBS.track(kind='batch_product'):
+                product['status'] = 'running'
+
+                def progress(pages_done, reviews_collected):
+                    product.update({'pages_done': pages_done, 'reviews_collected': reviews_collected})
+
+                try:
+                    batches = iter_review_batches(product['website'], product['url'], batch['max_reviews'], batch['incremental'], self.watermarks, product['failed_pages'])
+                    reviews = await collect_reviews(batches, progress)
+                    if not reviews and product['failed_pages']:
+                        raise Exception(product['failed_pages'][0]['error'])
+                    if reviews and self.save_reviews:
+                        product['saved'] = await asyncio.to_thread(self.save_reviews, reviews, product['website'])
+                    product.update({'status': 'done', 'reviews_collected': len(reviews)})
+                except Exception as e:
+                    print(f"Batch {batch['id']}: {product['url']} failed: {str(e)}")
+                    product.update({'status': 'failed', 'error': str(e)})
+
+    async def _run(self, batch):
+        queued = [product for product in batch['products'] if product['status'] == 'queued']
+        await asyncio.gather(*(self._run_product(batch, product) for product in queued))
+        batch.update({'status': 'done', 'finished_at': datetime.now()})
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            finished = [batch_id for batch_id, batch in self._batches.items() if batch['finished_at']]
+            for batch_id in finished[:max(len(finished) - MAX_FINISHED_BATCHES, 0)]:
+                del self._batches[batch_id]
+
+    def get(self, batch_id):
+        """Batch status with per-product results and totals by status"""
+        batch = self._batches.get(batch_id)
+        if not batch:
+            return None
+
+        counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+        for product in batch['products']:
+            counts[product['status']] += 1
+        return dict(
+            batch,
+            products=[dict(product) for product in batch['products']],
+            counts=counts,
+            reviews_collected=sum(product['reviews_collected'] for product in batch['products']),
+        )
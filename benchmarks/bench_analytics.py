@@ -0,0 +1,101 @@
+"""Reviews per second of the text analytics stage, vectorised vs. per row.
+
+"vectorised" is analytics.TextAnalyzer over batches of synthetic reviews,
+timed separately for the per-batch work (tokenising, sentiment, keyword
+counts, MinHash) and for the end of the run (LSH near-duplicates and
+TF-IDF). "per-row" does the same sentiment, keyword counts and MinHash one
+review at a time in plain Python, on a smaller sample because it is slow.
+Every tenth review is a lightly edited copy of an earlier one; the report
+shows how many of those copies were found.
+
+Run from the repository root:
+
+    python benchmarks/bench_analytics.py [--reviews 200000] [--batch-size 5000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics
+
+WORDS = '''
+battery screen camera sound display charging delivery packaging quality price speaker design performance
+phone laptop headphones build weight colour size software update heating fingerprint bass volume
+lasts days hours bright outdoors works fine after month using daily bought gift easily
+'''.split()
+OPINIONS = list(analytics.SENTIMENT_LEXICON) + ['not good', 'not worth', 'never again', 'not bad']
+
+
+def synthetic_reviews(count, products=500, seed=0):
+    """(text, product) pairs; every tenth review copies an earlier one with one word changed"""
+    rng = random.Random(seed)
+    reviews = []
+    for i in range(count):
+        product = f'amazon:B0MOCK{i % products:04d}'
+        if i % 10 == 9 and i > 100:
+            words = reviews[rng.randrange(i - 100, i)][0].split()
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+            reviews.append((' '.join(words), product))
+            continue
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 40))]
+        for _ in range(rng.randint(1, 3)):
+            words.insert(rng.randrange(len(words)), rng.choice(OPINIONS))
+        reviews.append((' '.join(words), product))
+    return reviews
+
+
+def per_row(reviews, permutations=analytics.MINHASH_PERMUTATIONS):
+    """Sentiment, keyword counts and MinHash one review at a time"""
+    rng = random.Random(1)
+    hash_a = [rng.randrange(1, analytics.MERSENNE_PRIME) for _ in range(permutations)]
+    hash_b = [rng.randrange(0, analytics.MERSENNE_PRIME) for _ in range(permutations)]
+    keyword_counts = {}
+    for text, product in reviews:
+        tokens = analytics.tokenize(text)
+        score = sum(analytics.lexicon_weight(token) for token in tokens)
+        score / (score * score + 15) ** 0.5
+        keyword_counts.setdefault(product, Counter()).update(token for token in tokens if analytics.is_keyword(token))
+        shingles = {hash(tuple(tokens[i:i + 3])) % analytics.MERSENNE_PRIME for i in range(len(tokens) - 2)}
+        [min((a * x + b) % analytics.MERSENNE_PRIME for x in shingles) for a, b in zip(hash_a, hash_b)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reviews', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=analytics.ANALYTICS_BATCH_SIZE)
+    parser.add_argument('--per-row-reviews', type=int, default=5000)
+    args = parser.parse_args()
+
+    reviews = synthetic_reviews(args.reviews)
+    analyzer = analytics.TextAnalyzer()
+    start = time.perf_counter()
+    for offset in range(0, len(reviews), args.batch_size):
+        batch = reviews[offset:offset + args.batch_size]
+        analyzer.add_batch([text for text, _ in batch], [product for _, product in batch])
+    batches = time.perf_counter() - start
+    start = time.perf_counter()
+    earliest, spam, keywords = analyzer.finish()
+    finish = time.perf_counter() - start
+
+    copies = [i for i in range(len(reviews)) if i % 10 == 9 and i > 100]
+    found = sum(1 for i in copies if earliest[i] != i)
+    print(f'{args.reviews} reviews, {len(keywords)} products, {len(analyzer.terms)} terms')
+    print(f'{"vectorised batches":<20} {args.reviews / batches:10.0f} reviews/s  {batches:7.2f} s')
+    print(f'{"vectorised finish":<20} {args.reviews / finish:10.0f} reviews/s  {finish:7.2f} s')
+    print(f'{"vectorised total":<20} {args.reviews / (batches + finish):10.0f} reviews/s')
+    print(f'near-duplicates: {found}/{len(copies)} planted copies found, {int(spam.sum())} reviews flagged as spam')
+
+    sample = reviews[:args.per_row_reviews]
+    start = time.perf_counter()
+    per_row(sample)
+    elapsed = time.perf_counter() - start
+    print(f'{"per-row":<20} {len(sample) / elapsed:10.0f} reviews/s  {elapsed:7.2f} s ({len(sample)} reviews, no near-duplicate search)')
+
+
+if __name__ == '__main__':
+    main()
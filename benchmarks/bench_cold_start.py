@@ -0,0 +1,99 @@
+"""Cold-start time of the web and worker processes, checked against a budget.
+
+Each target runs `--runs` times in a fresh interpreter and is reported as
+the median milliseconds of its startup code, measured inside the process
+(interpreter startup itself is the same for every target and left out):
+
+* web_import - `import app`, what gunicorn or `flask run` does on boot
+* web_first_request - importing the app and serving GET /
+* worker_boot - `python jobs.py worker` up to its first poll for jobs,
+  without connecting to MongoDB
+* parse_worker - the imports of a spawned parse worker process
+
+It also lists which of the heavy optional modules each target loaded. Exits
+with status 1 when a target's median is over its budget; `--budget-scale`
+loosens or tightens every budget for slower or faster machines.
+
+Run from the repository root:
+
+    python benchmarks/bench_cold_start.py [--runs 10] [--budget-scale 1.5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds, median over the runs
+BUDGETS = {
+    'web_import': 300,
+    'web_first_request': 350,
+    'worker_boot': 500,
+    'parse_worker': 250,
+}
+
+TARGETS = {
+    'web_import': 'import app',
+    'web_first_request': 'import app\nassert app.app.test_client().get("/").status_code == 200',
+    'worker_boot': '''
+import jobs
+from database import get_db
+from incremental import WatermarkStore
+from writer import get_writer
+db = get_db()
+jobs.MongoJobBackend(db, save_reviews=get_writer().submit, watermarks=WatermarkStore(db['watermarks']))
+''',
+    'parse_worker': 'import parsers\nimport sites',
+}
+
+HEAVY_MODULES = ('pymongo', 'bs4', 'lxml', 'httpx', 'openpyxl', 'pyarrow', 'numpy', 'scipy')
+
+RUNNER = '''
+import json, sys, time
+start = time.perf_counter()
+exec(compile(sys.argv[1], 'target', 'exec'))
+elapsed = time.perf_counter() - start
+print(json.dumps({'ms': elapsed * 1000, 'loaded': [name for name in sys.argv[2:] if name in sys.modules]}))
+'''
+
+
+def run_target(code):
+    result = subprocess.run(
+        [sys.executable, '-c', RUNNER, code, *HEAVY_MODULES],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+        # Keep the runs independent of the local cache and any spill file
+        env=dict(os.environ, SCRAPER_CACHE='0', SCRAPER_SPILL_PATH=os.devnull + '.spill'),
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--only', action='append', choices=list(TARGETS))
+    parser.add_argument('--budget-scale', type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f'{"target":<20} {"median ms":>10} {"max ms":>8} {"budget":>8}  heavy modules loaded')
+    over = []
+    for name, code in TARGETS.items():
+        if args.only and name not in args.only:
+            continue
+        runs = [run_target(code) for _ in range(args.runs)]
+        median = statistics.median(run['ms'] for run in runs)
+        budget = BUDGETS[name] * args.budget_scale
+        print(f"{name:<20} {median:10.0f} {max(run['ms'] for run in runs):8.0f} {budget:8.0f}  {', '.join(runs[-1]['loaded']) or '-'}")
+        if median > budget:
+            over.append(f'{name}: {median:.0f} ms, budget {budget:.0f} ms')
+
+    for line in over:
+        print(f'OVER BUDGET {line}')
+    if over:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
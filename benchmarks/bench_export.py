@@ -0,0 +1,99 @@
+"""Rows per second and peak RSS of the xlsx export, streaming vs. in-memory.
+
+"baseline" is the previous export: a regular openpyxl workbook filled cell by
+cell from a list of all reviews, with column widths found by re-scanning
+every cell. "streaming" is exports.write_excel fed from a generator, the way
+/export feeds it from a MongoDB cursor. Each run happens in a fresh process
+so that peak RSS belongs to that run alone (Unix only, via `resource`).
+
+Run from the repository root:
+
+    python benchmarks/bench_export.py [--rows 200000]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+from openpyxl.styles import Alignment, Font
+
+import exports
+
+
+def fake_reviews(count):
+    for i in range(count):
+        yield {
+            'product': f'Mock Product {i % 50}',
+            'user': f'Customer {i}',
+            'rating': float(i % 5 + 1),
+            'title': 'Worth every penny' if i % 2 else 'Not as described',
+            'comment': 'Battery lasts two days and the screen is bright enough outdoors. ' * (1 + i % 3),
+            'date': f'{i % 28 + 1} March 2023',
+            'website': 'amazon',
+        }
+
+
+def baseline_export(reviews, website, filename):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = f"{website.capitalize()} Reviews"
+
+    for col_num, (header, _, _) in enumerate(exports.EXPORT_COLUMNS, 1):
+        cell = ws.cell(row=1, column=col_num)
+        cell.value = header
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+
+    for row_num, review in enumerate(reviews, 2):
+        for col_num, (_, field, default) in enumerate(exports.EXPORT_COLUMNS, 1):
+            ws.cell(row=row_num, column=col_num, value=review.get(field, default))
+
+    for column in ws.columns:
+        max_length = max(len(str(cell.value)) for cell in column)
+        ws.column_dimensions[column[0].column_letter].width = min(max_length + 2, 50)
+
+    wb.save(filename)
+    return len(reviews)
+
+
+def run(mode, rows):
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'export.xlsx')
+        start = time.perf_counter()
+        if mode == 'baseline':
+            count = baseline_export(list(fake_reviews(rows)), 'amazon', filename)
+        else:
+            count = exports.write_excel(fake_reviews(rows), 'amazon', filename)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(filename)
+
+    assert count == rows, count
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    print(f'{mode:<10} {rows / elapsed:10.0f} rows/s  {elapsed:7.2f} s  peak RSS {peak_mb:7.1f} MB  file {size / 1e6:.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--mode', choices=['baseline', 'streaming'])
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.rows)
+        return
+
+    print(f'{args.rows} reviews')
+    for mode in ('baseline', 'streaming'):
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode, '--rows', str(args.rows)], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Pages per second of the Flipkart review fetch at different concurrency levels.
+
+Run from the repository root:
+
+    python benchmarks/bench_flipkart_fetch.py
+"""
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Every run requests the same URLs; measure the network path, not the response cache
+os.environ.setdefault('SCRAPER_CACHE', '0')
+
+import fetcher
+import scrapper
+from sites import SITES
+from mock_server import start_mock_server
+
+LATENCY = 0.05
+PAGES = 40
+
+
+def main():
+    server, base_url = start_mock_server(latency=LATENCY, total_pages=PAGES)
+    SITES['flipkart'].base_url = f'{base_url}/api/3/product/reviews'
+    # The benchmark measures the fetch engine, not the politeness budget
+    fetcher.rate_limiter.set_rate(urlsplit(base_url).netloc, float('inf'))
+
+    max_reviews = PAGES * SITES['flipkart'].api.page_size
+    product_url = 'https://www.flipkart.com/mock/p/itm?pid=MOCKPRODUCT'
+
+    print(f'{PAGES} pages, {LATENCY * 1000:.0f} ms simulated latency per page')
+    for concurrency in (1, 4, 16):
+        start = time.perf_counter()
+        reviews = scrapper.scrape_flipkart_reviews(product_url, max_reviews, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        assert len(reviews) == max_reviews, len(reviews)
+        assert reviews[0]['user'] == 'Customer 0' and reviews[-1]['user'] == f'Customer {max_reviews - 1}'
+        print(f'concurrency={concurrency:<3} {PAGES / elapsed:8.1f} pages/s  ({elapsed:.2f} s)')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
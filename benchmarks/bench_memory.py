@@ -0,0 +1,119 @@
+"""Memory of a large scrape held as review dicts vs. a ReviewBatch.
+
+Both modes build the reviews of one product the way a scrape does. Each
+Flipkart API page is decoded from JSON and its reviews extracted, then
+collected into one result:
+
+* "dicts" - one dict per review, collected into a list, as before
+  ReviewBatch
+* "batch" - the API extractor's columns, collected into a ReviewBatch
+  (reviews.py): one list per field, with product and site names shared
+
+Each mode then serialises the result the way the scrape response does:
+"dicts" builds the whole body with json.dumps, and "batch" streams it in
+chunks of reviews, as the app's JSON provider does.
+Every mode runs in a fresh process, so that peak RSS belongs to that run
+alone (Unix only, via `resource`). Memory held is measured with
+tracemalloc, which also slows the runs; the timings are only meant to be
+compared with each other.
+
+Run from the repository root:
+
+    python benchmarks/bench_memory.py [--reviews 100000]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_server import flipkart_page
+from reviews import ReviewBatch
+from sites import SITES, get_keys, get_path
+
+PAGE_SIZE = 10
+
+
+def pages(count):
+    # Encoded up front: the bodies stand in for responses, which are not kept
+    total = -(-count // PAGE_SIZE)
+    return [json.dumps(flipkart_page('MOCKPRODUCT', page, PAGE_SIZE, total)).encode() for page in range(1, total + 1)]
+
+
+def review_dicts(api, data):
+    # How an API page became reviews before ReviewBatch: a dict per review
+    items = (get_path(data, api.items) or [])[:PAGE_SIZE]
+    return [{name: get_keys(item, keys, default) for name, keys, default in api.fields} for item in items]
+
+
+def collect_dicts(bodies, api):
+    reviews = []
+    for body in bodies:
+        reviews.extend(dict(review, product_id='MOCKPRODUCT', website='flipkart') for review in review_dicts(api, json.loads(body)))
+    return reviews
+
+
+def collect_batch(bodies, api):
+    reviews = ReviewBatch()
+    for body in bodies:
+        reviews.extend(ReviewBatch.from_columns(api.columns(json.loads(body), PAGE_SIZE), product_id='MOCKPRODUCT', website='flipkart'))
+    return reviews
+
+
+def run(mode, count):
+    api = SITES['flipkart'].api
+    bodies = pages(count)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    reviews = collect_dicts(bodies, api) if mode == 'dicts' else collect_batch(bodies, api)
+    collect_seconds = time.perf_counter() - start
+    held, _ = tracemalloc.get_traced_memory()
+
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    if mode == 'dicts':
+        body = json.dumps({'count': len(reviews), 'reviews': reviews})
+        size = len(body)
+    else:
+        # Each piece goes to the client and is dropped
+        size = len('{"count": %d, "reviews": ' % len(reviews)) + 1
+        for piece in reviews.iter_json_chunks():
+            size += len(piece)
+    json_seconds = time.perf_counter() - start
+    _, json_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if mode == 'batch':
+        body = '{"count": %d, "reviews": %s}' % (len(reviews), ''.join(reviews.iter_json_chunks()))
+    assert len(reviews) == count and len(body) == size and len(json.loads(body)['reviews']) == count
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    print(f'{mode:<6} held {held / 1e6:7.1f} MB ({held / count:5.0f} B/review)  '
+          f'collect {collect_seconds:5.2f} s  JSON peak {(json_peak - held) / 1e6:6.1f} MB in {json_seconds:5.2f} s  '
+          f'peak RSS {peak_mb:7.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reviews', type=int, default=100000)
+    parser.add_argument('--mode', choices=['dicts', 'batch'])
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.reviews)
+        return
+
+    print(f'{args.reviews} reviews')
+    for mode in ('dicts', 'batch'):
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode, '--reviews', str(args.reviews)], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Reviews parsed per second over the saved fixture pages, per parser path.
+
+"baseline" is the previous path: a full BeautifulSoup('html.parser') tree
+queried with find_all/find per review. The other rows use parsers.py.
+
+Run from the repository root:
+
+    python benchmarks/bench_parse.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+
+import parsers
+import sites
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+DURATION = 2.0
+
+
+def baseline_amazon(content, max_reviews=10):
+    soup = BeautifulSoup(content, 'html.parser')
+    reviews = []
+    for review_element in soup.find_all('div', {'data-hook': 'review'})[:max_reviews]:
+        user_element = review_element.find('span', class_='a-profile-name')
+        rating_element = review_element.find('i', {'data-hook': 'review-star-rating'})
+        title_element = review_element.find('a', {'data-hook': 'review-title'})
+        comment_element = review_element.find('span', {'data-hook': 'review-body'})
+        date_element = review_element.find('span', {'data-hook': 'review-date'})
+        reviews.append({
+            'product': soup.title.text.replace('Amazon.in:Customer reviews:', '').strip() if soup.title else 'N/A',
+            'user': user_element.text.strip() if user_element else 'Anonymous',
+            'rating': float(rating_element.text.split()[0]) if rating_element else 0,
+            'title': title_element.text.strip() if title_element else 'No Title',
+            'comment': comment_element.text.strip() if comment_element else 'No Comment',
+            'date': date_element.text.split('on')[-1].strip() if date_element else 'N/A',
+            'website': 'amazon'
+        })
+    soup.find('li', class_='a-last')
+    return reviews
+
+
+def baseline_flipkart(content, max_reviews=10):
+    soup = BeautifulSoup(content, 'html.parser')
+    review_elements = None
+    for selector in ['div._1AtVbE', 'div._27M-vq', 'div.t-ZTKy', 'div._1PBCrt']:
+        review_elements = soup.select(selector)
+        if review_elements:
+            break
+    for selector in ['span.VU-ZEz', 'span.B_NuCI', 'h1._2NKhZn', 'span._35KyD6']:
+        if soup.select_one(selector):
+            break
+    reviews = []
+    for review_element in review_elements[:max_reviews]:
+        reviews.append([review_element.select_one(css) for css in ('div._3LWZlK', 'div.t-ZTKy', 'p._2sc7ZR', 'p._2-N8zT')])
+    return reviews
+
+
+def measure(parse, content):
+    parsed = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        parsed += len(parse(content))
+    return parsed / (time.perf_counter() - start)
+
+
+def main():
+    amazon = open(os.path.join(FIXTURES, 'amazon_reviews.html'), 'rb').read()
+    flipkart = open(os.path.join(FIXTURES, 'flipkart_product.html'), 'rb').read()
+
+    backends = ['lxml', 'html.parser']
+    if parsers.HTMLParser is not None:
+        backends.insert(0, 'selectolax')
+
+    cases = [
+        ('amazon', amazon, baseline_amazon, lambda backend: lambda c: sites.parse_listing(c, 'amazon', 'listing', 10, backend)[1]),
+        ('flipkart', flipkart, baseline_flipkart, lambda backend: lambda c: sites.parse_listing(c, 'flipkart', 'product_page', 10, backend)[1]),
+    ]
+    for site, content, baseline, parse_with in cases:
+        print(f'{site} ({len(content) // 1024} KB page)')
+        base_rate = measure(baseline, content)
+        print(f'  {"baseline":<12} {base_rate:10.0f} reviews/s')
+        for backend in backends:
+            rate = measure(parse_with(backend), content)
+            print(f'  {backend:<12} {rate:10.0f} reviews/s  ({rate / base_rate:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Reviews parsed per second by the process-pool parse stage, by worker count.
+
+Feeds copies of the saved Amazon fixture page to sites.parse_listing in a
+ProcessPoolExecutor, the same way the scrapers hand pages to the parse stage.
+
+Run from the repository root:
+
+    python benchmarks/bench_parse_pool.py [--backend lxml] [--pages 400]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sites
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def worker_counts():
+    counts, n = [], 1
+    while n < (os.cpu_count() or 1):
+        counts.append(n)
+        n *= 2
+    counts.append(os.cpu_count() or 1)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', default='lxml')
+    parser.add_argument('--pages', type=int, default=400)
+    args = parser.parse_args()
+
+    content = open(os.path.join(FIXTURES, 'amazon_reviews.html'), 'rb').read()
+    pages = [content] * args.pages
+    context = multiprocessing.get_context('spawn')
+
+    print(f'{args.pages} Amazon pages, {args.backend} backend, {os.cpu_count()} cores')
+    for workers in worker_counts():
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            # Warm the workers up so process start-up is not measured
+            list(pool.map(sites.parse_listing, pages[:workers], ['amazon'] * workers, ['listing'] * workers, [10] * workers, [args.backend] * workers))
+
+            start = time.perf_counter()
+            n = len(pages)
+            results = pool.map(sites.parse_listing, pages, ['amazon'] * n, ['listing'] * n, [10] * n, [args.backend] * n, chunksize=4)
+            parsed = sum(len(rows) for _, rows, _ in results)
+            elapsed = time.perf_counter() - start
+        print(f'workers={workers:<3} {parsed / elapsed:10.0f} reviews/s')
+
+
+if __name__ == '__main__':
+    main()
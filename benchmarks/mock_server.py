@@ -0,0 +1,128 @@
+"""Local stand-in for the review sites, used by the benchmarks.
+
+Serves the Flipkart reviews API shape on /api/3/product/reviews, the saved
+Amazon review page on /product-reviews/<asin>/ and the saved Flipkart
+product page on /flipkart/<anything>, so fetch throughput can be measured
+without touching the real sites. Every request waits `latency` seconds. A
+seeded share of requests fail: `error_rate` of them with a 503 and
+`captcha_rate` of them with a CAPTCHA page, to exercise retries and backoff.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def flipkart_page(product_id, page, limit, total_pages):
+    data = []
+    for i in range(limit):
+        n = (page - 1) * limit + i
+        data.append({
+            'product': {'product_name': f'Mock Product {product_id}'},
+            'author': {'name': f'Customer {n}'},
+            'rating': n % 5 + 1,
+            'title': f'Review title {n}',
+            'text': f'Mock review body number {n} for product {product_id}.',
+            'created': f'2023-01-{n % 28 + 1:02d}',
+        })
+    return {'RESPONSE': {'data': data, 'next_page': page < total_pages}}
+
+
+CAPTCHA_PAGE = b'<html><body><form action="/errors/validateCaptcha">Enter the characters you see below</form></body></html>'
+
+
+class MockSiteServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Concurrent benchmarks open many connections at once
+    request_queue_size = 128
+
+    def fault(self):
+        """None, 'error' or 'captcha' for the next request"""
+        with self.random_lock:
+            roll = self.random.random()
+        if roll < self.error_rate:
+            return 'error'
+        if roll < self.error_rate + self.captcha_rate:
+            return 'captcha'
+        return None
+
+
+class MockSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        time.sleep(self.server.latency)
+
+        fault = self.server.fault()
+        if fault == 'error':
+            self._send(503, b'Service Unavailable', 'text/plain')
+        elif fault == 'captcha':
+            self._send(200, CAPTCHA_PAGE, 'text/html; charset=utf-8')
+        elif parts.path == '/api/3/product/reviews':
+            page = int(query.get('page', ['1'])[0])
+            limit = int(query.get('limit', ['10'])[0])
+            product_id = query.get('productId', ['MOCK'])[0]
+            body = json.dumps(flipkart_page(product_id, page, limit, self.server.total_pages)).encode()
+            self._send(200, body, 'application/json')
+        elif parts.path.startswith('/product-reviews/'):
+            page = int(query.get('pageNumber', ['1'])[0])
+            body = self.server.amazon_page
+            if page >= self.server.total_pages:
+                body = body.replace(b'<li class="a-last">', b'<li class="a-last a-disabled">')
+            self._send(200, body, 'text/html; charset=utf-8')
+        elif parts.path.startswith('/flipkart/'):
+            self._send(200, self.server.flipkart_page, 'text/html; charset=utf-8')
+        else:
+            self._send(404, b'{}', 'application/json')
+
+    def _send(self, status, body, content_type):
+        # Support conditional requests so the response cache can be exercised
+        etag = '"%s"' % hashlib.md5(body).hexdigest()[:16]
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 200:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled a speculative page request
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(latency=0.05, total_pages=100, error_rate=0.0, captcha_rate=0.0, seed=0):
+    """Start the mock server on a free local port; returns (server, base_url)"""
+    server = MockSiteServer(('127.0.0.1', 0), MockSiteHandler)
+    server.latency = latency
+    server.total_pages = total_pages
+    server.error_rate = error_rate
+    server.captcha_rate = captcha_rate
+    server.random = random.Random(seed)
+    server.random_lock = threading.Lock()
+    with open(os.path.join(FIXTURES, 'amazon_reviews.html'), 'rb') as f:
+        server.amazon_page = f.read()
+    with open(os.path.join(FIXTURES, 'flipkart_product.html'), 'rb') as f:
+        server.flipkart_page = f.read()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f'http://{host}:{port}'
@@ -0,0 +1,270 @@
+"""Offline benchmark and regression suite: fetch, parse, persist and export.
+
+Every scenario runs against the mock server and the saved fixtures, never the
+real sites. Each one runs `--rounds` times and is reported as reviews per
+second over all rounds, with p50/p99 of the time one round took. Fetch
+scenarios also report how many pages failed. Use `--error-rate` and
+`--captcha-rate` to have the mock server inject 503s and CAPTCHA pages.
+
+`--save FILE` writes the results as JSON. `--compare FILE` checks them
+against a saved run and exits with status 1 when a scenario's reviews/s
+drops, or its p99 rises, by more than `--tolerance`. The persist and
+end-to-end scenarios need the MongoDB from database.py and are skipped
+without it; they write to a scratch `benchmark_reviews` collection (and
+its stats) that is dropped afterwards.
+
+Run from the repository root:
+
+    python benchmarks/run_suite.py [--only parse] [--rounds 20] [--compare baseline.json]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Every round requests the same URLs; measure the network path, not the response cache
+os.environ.setdefault('SCRAPER_CACHE', '0')
+
+import exports
+import fetcher
+import scrapper
+import sites
+from review_stats import stats_collection
+from mock_server import FIXTURES, start_mock_server
+
+FLIPKART_PAGES = 20
+AMAZON_PAGES = 5
+PARSE_PAGES = 20
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+def mongo_collection():
+    """Scratch collection on the configured MongoDB, or None when it is not reachable"""
+    import database
+    client = database.get_client()
+    if client is None:
+        return None
+    try:
+        client.admin.command('ping')
+    except Exception as e:
+        print(f'MongoDB not reachable, skipping persist scenarios: {e}')
+        return None
+    return database.get_collection('benchmark_reviews')
+
+
+def fake_reviews(round_number, count=500):
+    # New users every round, so each round inserts instead of skipping known reviews
+    return [{
+        'product': 'Mock Product',
+        'product_id': 'B0MOCK0001',
+        'user': f'Customer {round_number}-{i}',
+        'rating': float(i % 5 + 1),
+        'title': 'Worth every penny',
+        'comment': 'Battery lasts two days and the screen is bright enough outdoors.',
+        'date': f'{i % 28 + 1} March 2023',
+        'website': 'amazon',
+    } for i in range(count)]
+
+
+class Suite:
+    def __init__(self, base_url, collection):
+        self.base_url = base_url
+        self.collection = collection
+        self.failed_pages = {}
+        self.amazon = fixture('amazon_reviews.html')
+        self.flipkart = fixture('flipkart_product.html')
+        self.flipkart_api = fixture('flipkart_reviews.json')
+        self.export_reviews = fake_reviews(0, 5000)
+
+    def scrape(self, name, website, product_url, max_reviews, concurrency=4):
+        failures = []
+        batches = scrapper.iter_reviews(website, product_url, max_reviews, concurrency=concurrency, failures=failures)
+        reviews = fetcher.run_sync(scrapper.collect_reviews(batches))
+        self.failed_pages[name] = self.failed_pages.get(name, 0) + len(failures)
+        return reviews
+
+    # Each scenario does one round of work and returns the number of reviews it handled
+
+    def fetch_flipkart_api(self, round_number):
+        page_size = sites.SITES['flipkart'].api.page_size
+        product_url = 'https://www.flipkart.com/mock/p/itm?pid=MOCKPRODUCT'
+        return len(self.scrape('fetch_flipkart_api', 'flipkart', product_url, FLIPKART_PAGES * page_size, concurrency=8))
+
+    def fetch_amazon(self, round_number):
+        product_url = 'https://www.amazon.in/mock/dp/B0MOCK0001'
+        return len(self.scrape('fetch_amazon', 'amazon', product_url, AMAZON_PAGES * 10))
+
+    def fetch_flipkart_page(self, round_number):
+        return len(self.scrape('fetch_flipkart_page', 'flipkart', f'{self.base_url}/flipkart/mock/p/itm', 10))
+
+    def parse_amazon(self, round_number):
+        return sum(len(sites.parse_listing(self.amazon, 'amazon', 'listing', 10)[1]) for _ in range(PARSE_PAGES))
+
+    def parse_flipkart_page(self, round_number):
+        return sum(len(sites.parse_listing(self.flipkart, 'flipkart', 'product_page', 10)[1]) for _ in range(PARSE_PAGES))
+
+    def parse_flipkart_api(self, round_number):
+        api = sites.SITES['flipkart'].api
+        return sum(len(api.columns(json.loads(self.flipkart_api), api.page_size)['user']) for _ in range(PARSE_PAGES))
+
+    def persist(self, round_number):
+        from database import save_to_mongodb
+        reviews = fake_reviews(round_number)
+        save_to_mongodb(reviews, 'amazon', self.collection)
+        return len(reviews)
+
+    def export_xlsx(self, round_number):
+        output, count = exports.export_file(exports.write_excel, iter(self.export_reviews), 'amazon')
+        output.close()
+        return count
+
+    def export_csv(self, round_number):
+        for _ in exports.iter_csv(iter(self.export_reviews)):
+            pass
+        return len(self.export_reviews)
+
+    def export_jsonl(self, round_number):
+        for _ in exports.iter_jsonl_gzip(iter(self.export_reviews)):
+            pass
+        return len(self.export_reviews)
+
+    def export_parquet(self, round_number):
+        output, count = exports.export_file(exports.write_parquet, iter(self.export_reviews))
+        output.close()
+        return count
+
+    def end_to_end(self, round_number):
+        """Scrape a product, save it and export it, the way /scrape then /export would"""
+        from database import save_to_mongodb
+        page_size = sites.SITES['flipkart'].api.page_size
+        product_url = f'https://www.flipkart.com/mock/p/itm?pid=MOCKE2E{round_number}'
+        reviews = self.scrape('end_to_end', 'flipkart', product_url, FLIPKART_PAGES * page_size, concurrency=8)
+        save_to_mongodb(reviews, 'flipkart', self.collection)
+        with tempfile.TemporaryFile() as output:
+            exports.write_excel(iter(reviews), 'flipkart', output)
+        return len(reviews)
+
+    def scenarios(self):
+        """(group, name, function) for every scenario that can run here"""
+        available = [
+            ('fetch', 'fetch_flipkart_api', self.fetch_flipkart_api),
+            ('fetch', 'fetch_amazon', self.fetch_amazon),
+            ('fetch', 'fetch_flipkart_page', self.fetch_flipkart_page),
+            ('parse', 'parse_amazon', self.parse_amazon),
+            ('parse', 'parse_flipkart_page', self.parse_flipkart_page),
+            ('parse', 'parse_flipkart_api', self.parse_flipkart_api),
+            ('export', 'export_xlsx', self.export_xlsx),
+            ('export', 'export_csv', self.export_csv),
+            ('export', 'export_jsonl', self.export_jsonl),
+        ]
+        if exports.pa is not None:
+            available.append(('export', 'export_parquet', self.export_parquet))
+        if self.collection is not None:
+            available.append(('persist', 'persist', self.persist))
+            available.append(('end_to_end', 'end_to_end', self.end_to_end))
+        return available
+
+
+def run_scenario(function, rounds):
+    timings = []
+    reviews = 0
+    for round_number in range(rounds):
+        start = time.perf_counter()
+        reviews += function(round_number)
+        timings.append(time.perf_counter() - start)
+    return {
+        'reviews_per_sec': reviews / sum(timings),
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'rounds': rounds,
+    }
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result['reviews_per_sec'] < before['reviews_per_sec'] * (1 - tolerance):
+            found.append(f"{name}: {result['reviews_per_sec']:.0f} reviews/s, was {before['reviews_per_sec']:.0f}")
+        if result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            found.append(f"{name}: p99 {result['p99_ms']:.1f} ms, was {before['p99_ms']:.1f}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', action='append', help='scenario group or name to run (repeatable)')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='mock server delay per request, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--captcha-rate', type=float, default=0.0)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of a previous run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(
+        latency=args.latency,
+        total_pages=FLIPKART_PAGES,
+        error_rate=args.error_rate,
+        captcha_rate=args.captcha_rate,
+    )
+    for name in ('flipkart', 'amazon'):
+        sites.SITES[name].base_url = f'{base_url}{urlsplit(sites.SITES[name].base_url).path}'
+    # The suite measures the scraping pipeline, not the politeness budget
+    fetcher.rate_limiter.set_rate(urlsplit(base_url).netloc, float('inf'))
+
+    wants_db = not args.only or {'persist', 'end_to_end'} & set(args.only)
+    suite = Suite(base_url, mongo_collection() if wants_db else None)
+
+    print(f'{args.rounds} rounds, {args.latency * 1000:.0f} ms latency, '
+          f'{args.error_rate:.0%} errors, {args.captcha_rate:.0%} CAPTCHAs')
+    print(f'{"scenario":<22} {"reviews/s":>12} {"p50 ms":>9} {"p99 ms":>9} {"failed pages":>13}')
+    results = {}
+    for group, name, function in suite.scenarios():
+        if args.only and group not in args.only and name not in args.only:
+            continue
+        # One untimed round warms up connections, parse workers and imports
+        function(-1)
+        suite.failed_pages.pop(name, None)
+        result = run_scenario(function, args.rounds)
+        result['failed_pages'] = suite.failed_pages.get(name, 0)
+        results[name] = result
+        print(f"{name:<22} {result['reviews_per_sec']:12.0f} {result['p50_ms']:9.1f} {result['p99_ms']:9.1f} {result['failed_pages']:13}")
+
+    server.shutdown()
+    if suite.collection is not None:
+        suite.collection.drop()
+        stats_collection(suite.collection).drop()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
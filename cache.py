@@ -0,0 +1,254 @@
+"""HTTP response cache that sits under the fetch layer.
+
+Responses are kept in an in-memory LRU capped by total body size, backed by
+an SQLite store on disk keyed by normalised URL. Each site has its own TTL;
+fresh entries are served without a request, and stale ones are revalidated
+with If-None-Match / If-Modified-Since so that a 304 costs neither the
+download nor, for pages still in memory, the parse.
+
+Disk writes are queued to a writer thread, so storing a response never
+blocks the event loop. The writer also sweeps out entries older than
+DISK_MAX_AGE every PRUNE_INTERVAL seconds. fetch() looks entries up with
+get_async, which serves memory hits directly and reads the disk store on a
+worker thread.
+
+Environment: SCRAPER_CACHE=0 disables it, SCRAPER_CACHE_DIR sets the disk
+location and SCRAPER_CACHE_MAX_MB caps the in-memory part.
+"""
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+CACHE_ENABLED = os.environ.get('SCRAPER_CACHE', '1') != '0'
+CACHE_DIR = os.environ.get('SCRAPER_CACHE_DIR', os.path.join('.cache', 'http'))
+CACHE_MAX_BYTES = int(float(os.environ.get('SCRAPER_CACHE_MAX_MB', 64)) * 1024 * 1024)
+
+# Seconds a response stays fresh, per host
+SITE_TTLS = {
+    'www.flipkart.com': 15 * 60,
+    'www.amazon.in': 60 * 60,
+}
+DEFAULT_TTL = 10 * 60
+
+# Stale entries are kept on disk this long so they can still be revalidated
+DISK_MAX_AGE = 7 * 24 * 60 * 60
+
+# Seconds between sweeps of entries older than DISK_MAX_AGE
+PRUNE_INTERVAL = 60 * 60
+
+
+def normalize_url(url):
+    """Canonical cache key: lower-case scheme and host, sorted query, no fragment"""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+
+class CachedResponse:
+    """A response body plus the validators needed to revalidate it"""
+
+    def __init__(self, url, content, headers, stored_at=None, status_code=200):
+        self.url = url
+        self.content = content
+        self.headers = headers
+        self.status_code = status_code
+        self.stored_at = stored_at or time.time()
+        # Parse results for this exact body, so a 304 can skip the parse too
+        self.parsed = {}
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def is_fresh(self, ttl):
+        return time.time() - self.stored_at < ttl
+
+    def conditional_headers(self):
+        headers = {}
+        if self.headers.get('etag'):
+            headers['If-None-Match'] = self.headers['etag']
+        if self.headers.get('last-modified'):
+            headers['If-Modified-Since'] = self.headers['last-modified']
+        return headers
+
+
+class ResponseCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, ttls=None, default_ttl=DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttls = dict(SITE_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        # Disk reads share one connection; a separate lock keeps them from holding up memory lookups
+        self._read_lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stores': 0, 'evictions': 0, 'disk_hits': 0}
+
+        self._db = None
+        self._path = None
+        # (sql, params) statements for the writer thread
+        self._writes = queue.Queue()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._path = os.path.join(directory, 'responses.sqlite')
+            self._db = self._connect()
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(url TEXT PRIMARY KEY, content BLOB, headers TEXT, stored_at REAL)'
+            )
+            self._db.commit()
+            threading.Thread(target=self._write_loop, name='response-cache-writer', daemon=True).start()
+
+    def _connect(self):
+        db = sqlite3.connect(self._path, check_same_thread=False)
+        # It is only a cache: trade durability for cheap writes, and let reads run alongside them
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=OFF')
+        return db
+
+    def record(self, counter):
+        self.counters[counter] += 1
+
+    def ttl_for(self, url):
+        return self.ttls.get(urlsplit(url).netloc.lower(), self.default_ttl)
+
+    def get(self, url):
+        """Return the cached entry for `url` (fresh or stale), or None"""
+        key = normalize_url(url)
+        entry = self._get_memory(key)
+        if entry is None and self._db is not None:
+            entry = self._get_disk(url, key)
+        return entry
+
+    async def get_async(self, url):
+        """get() for the event loop: a memory miss is read from disk on a worker thread"""
+        key = normalize_url(url)
+        entry = self._get_memory(key)
+        if entry is None and self._db is not None:
+            entry = await asyncio.to_thread(self._get_disk, url, key)
+        return entry
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            return entry
+
+    def _get_disk(self, url, key):
+        with self._read_lock:
+            row = self._db.execute('SELECT content, headers, stored_at FROM responses WHERE url = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        entry = CachedResponse(url, row[0], json.loads(row[1]), row[2])
+        self.counters['disk_hits'] += 1
+        self._remember(key, entry)
+        return entry
+
+    def put(self, url, content, headers):
+        """Store a fresh 200 response and return it as a CachedResponse"""
+        key = normalize_url(url)
+        kept = {name: headers[name] for name in ('etag', 'last-modified', 'content-type') if name in headers}
+        entry = CachedResponse(url, content, kept)
+        self.counters['stores'] += 1
+        self._remember(key, entry)
+        self._write(key, entry)
+        return entry
+
+    def refresh(self, url, entry):
+        """Mark a revalidated (304) entry fresh again"""
+        entry.stored_at = time.time()
+        self.counters['revalidated'] += 1
+        if self._db is not None:
+            self._writes.put(('UPDATE responses SET stored_at = ? WHERE url = ?', (entry.stored_at, normalize_url(url))))
+        return entry
+
+    def _remember(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old.size
+            self._memory[key] = entry
+            self._memory_bytes += entry.size
+
+            while self._memory_bytes > self.max_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.size
+                self.counters['evictions'] += 1
+
+    def _write(self, key, entry):
+        if self._db is None:
+            return
+        self._writes.put((
+            'INSERT OR REPLACE INTO responses (url, content, headers, stored_at) VALUES (?, ?, ?, ?)',
+            (key, entry.content, json.dumps(entry.headers), entry.stored_at)
+        ))
+
+    def _write_loop(self):
+        """Apply queued writes, a burst per transaction, on this thread's own connection"""
+        db = self._connect()
+        next_prune = 0
+        while True:
+            writes = []
+            try:
+                writes.append(self._writes.get(timeout=max(next_prune - time.time(), 0)))
+                while True:
+                    writes.append(self._writes.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                for sql, params in writes:
+                    db.execute(sql, params)
+                if time.time() >= next_prune:
+                    db.execute('DELETE FROM responses WHERE stored_at < ?', (time.time() - DISK_MAX_AGE,))
+                    next_prune = time.time() + PRUNE_INTERVAL
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing the response cache: {str(e)}")
+            for _ in writes:
+                self._writes.task_done()
+
+    def flush(self):
+        """Wait until every queued disk write is stored"""
+        self._writes.join()
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['misses'] + self.counters['revalidated']
+        return dict(
+            self.counters,
+            entries=len(self._memory),
+            memory_bytes=self._memory_bytes,
+            max_bytes=self.max_bytes,
+            hit_rate=(self.counters['hits'] + self.counters['revalidated']) / lookups if lookups else 0.0,
+        )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide response cache, or None when caching is disabled"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+    return _cache
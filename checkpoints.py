@@ -0,0 +1,162 @@
+"""Resumable scrapes.
+
+After every page, a full (non-incremental) scrape writes a checkpoint to a
+local SQLite file. The checkpoint holds the page to resume from, the
+reviews collected so far (stored page by page) and the host's adaptive
+request rate. If the process dies mid-scrape, scraping the same product
+again picks up from the last committed page. It first returns the saved
+reviews and then fetches only the pages after them. A scrape that
+finishes without failed pages removes its checkpoint. One that skipped
+pages resumes from the first page that failed.
+
+All SQLite work of a store runs on its own writer thread, in the order it
+was submitted, so checkpointing a page never blocks the event loop.
+
+Environment: SCRAPER_CHECKPOINTS=0 disables checkpoints and
+SCRAPER_CHECKPOINT_DIR sets where the SQLite file lives.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+from fetcher import rate_limiter
+from reviews import ReviewBatch, reviews_json
+from scrapper import iter_reviews, product_id_from_url, site_host, site_name
+
+CHECKPOINTS_ENABLED = os.environ.get('SCRAPER_CHECKPOINTS', '1') != '0'
+CHECKPOINT_DIR = os.environ.get('SCRAPER_CHECKPOINT_DIR', '.cache')
+
+# Checkpoints of scrapes nobody resumed are dropped after this long
+CHECKPOINT_MAX_AGE = 7 * 24 * 60 * 60
+
+
+class CheckpointStore:
+    """Per-product scrape checkpoints in SQLite, keyed like 'flipkart:<pid>'"""
+
+    def __init__(self, directory=CHECKPOINT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # One thread, so commits of a scrape land in order and before its clear
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint-writer')
+        self._db = sqlite3.connect(os.path.join(directory, 'checkpoints.sqlite'), check_same_thread=False)
+        # Checkpoints must survive the process dying, so unlike the cache keep synchronous writes
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoints '
+            '(key TEXT PRIMARY KEY, next_page INTEGER, rate REAL, updated_at REAL)'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoint_pages '
+            '(key TEXT, page INTEGER, reviews TEXT, PRIMARY KEY (key, page))'
+        )
+        expired = time.time() - CHECKPOINT_MAX_AGE
+        self._db.execute('DELETE FROM checkpoint_pages WHERE key IN (SELECT key FROM checkpoints WHERE updated_at < ?)', (expired,))
+        self._db.execute('DELETE FROM checkpoints WHERE updated_at < ?', (expired,))
+        self._db.commit()
+
+    def load(self, key):
+        """Return (next_page, reviews so far, rate) for `key`, or None if there is no checkpoint"""
+        with self._lock:
+            row = self._db.execute('SELECT next_page, rate FROM checkpoints WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            # Pages at or after next_page were scraped past a failed page and will be fetched again
+            self._db.execute('DELETE FROM checkpoint_pages WHERE key = ? AND page >= ?', (key, row[0]))
+            self._db.commit()
+            pages = self._db.execute('SELECT reviews FROM checkpoint_pages WHERE key = ? ORDER BY page', (key,)).fetchall()
+
+        reviews = ReviewBatch()
+        for (page_reviews,) in pages:
+            reviews.extend(json.loads(page_reviews))
+        return row[0], reviews, row[1]
+
+    def commit(self, key, page, reviews, next_page, rate=None):
+        """Record one scraped page and where the scrape would resume"""
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO checkpoint_pages (key, page, reviews) VALUES (?, ?, ?)',
+                (key, page, reviews_json(reviews))
+            )
+            self._db.execute(
+                'INSERT OR REPLACE INTO checkpoints (key, next_page, rate, updated_at) VALUES (?, ?, ?, ?)',
+                (key, next_page, rate, time.time())
+            )
+            self._db.commit()
+
+    def clear(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM checkpoint_pages WHERE key = ?', (key,))
+            self._db.execute('DELETE FROM checkpoints WHERE key = ?', (key,))
+            self._db.commit()
+
+    def submit(self, method, *args):
+        """Run a store method on the writer thread, after everything submitted before it; returns a Future"""
+        return self._writer.submit(method, *args)
+
+
+def report_error(future):
+    if future.exception() is not None:
+        print(f"Error writing checkpoint: {str(future.exception())}")
+
+
+async def iter_checkpointed_reviews(website, product_url, max_reviews, store, failures=None):
+    """Like scrapper.iter_reviews, but resumes from and records a checkpoint"""
+    failures = [] if failures is None else failures
+    product_id = product_id_from_url(website, product_url)
+    if product_id is None:
+        # Without a stable product ID there is nothing to key the checkpoint on
+        async with aclosing(iter_reviews(website, product_url, max_reviews, failures=failures)) as batches:
+            async for batch in batches:
+                yield batch
+        return
+
+    key = f"{site_name(website)}:{product_id}"
+    host = site_host(website)
+    start_page, saved = 1, []
+    checkpoint = await asyncio.wrap_future(store.submit(store.load, key))
+    if checkpoint:
+        start_page, saved, rate = checkpoint
+        saved = saved[:max_reviews]
+        print(f"Resuming {key} at page {start_page} with {len(saved)} reviews from its checkpoint")
+        rate_limiter.restore(host, rate)
+        if saved:
+            yield saved
+
+    failed_before = len(failures)
+
+    def on_page(page, batch):
+        # After a failed page, resume from it rather than from the newest page
+        new_failures = failures[failed_before:]
+        next_page = new_failures[0]['page'] if new_failures else page + 1
+        # Called from the page generator on the event loop; the write happens on the writer thread
+        store.submit(store.commit, key, page, batch, next_page, rate_limiter.current_rate(host)).add_done_callback(report_error)
+
+    if len(saved) < max_reviews:
+        batches = iter_reviews(website, product_url, max_reviews - len(saved), failures=failures, start_page=start_page, on_page=on_page)
+        async with aclosing(batches):
+            async for batch in batches:
+                yield batch
+
+    if len(failures) == failed_before:
+        await asyncio.wrap_future(store.submit(store.clear, key))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoints():
+    """Return the process-wide checkpoint store, or None when checkpoints are disabled"""
+    global _store
+    if not CHECKPOINTS_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = CheckpointStore()
+    return _store
@@ -0,0 +1,77 @@
+"""Per-host circuit breaker for the fetch layer.
+
+After FAILURE_THRESHOLD consecutive failed requests to a host (connection
+errors, timeouts, 5xx), its circuit opens: requests to it fail immediately
+for RESET_TIMEOUT seconds, so scrapes stop spending retries on a site that
+is down. After that one trial request is let through (half-open). A
+success closes the circuit again and a failure re-opens it.
+"""
+import time
+
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class HostCircuit:
+    def __init__(self):
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = None
+
+
+class CircuitBreaker:
+    """Tracks request failures per host and fails fast while a host is down (shared loop only)"""
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits = {}
+
+    def circuit(self, host):
+        if host not in self._circuits:
+            self._circuits[host] = HostCircuit()
+        return self._circuits[host]
+
+    def check(self, host):
+        """Raise CircuitOpenError unless a request to `host` may go out now"""
+        circuit = self.circuit(host)
+        now = time.monotonic()
+        if circuit.state == 'open':
+            remaining = circuit.opened_at + self.reset_timeout - now
+            if remaining > 0:
+                raise CircuitOpenError(f"Circuit open for {host}, retrying in {remaining:.0f}s")
+            circuit.state = 'half-open'
+            circuit.trial_started = None
+
+        if circuit.state == 'half-open':
+            # One trial request at a time; a trial that never reported back is given up on
+            if circuit.trial_started is not None and now - circuit.trial_started < self.reset_timeout:
+                raise CircuitOpenError(f"Circuit half-open for {host}, waiting for a trial request")
+            circuit.trial_started = now
+
+    def succeeded(self, host):
+        circuit = self.circuit(host)
+        circuit.state = 'closed'
+        circuit.failures = 0
+        circuit.trial_started = None
+
+    def failed(self, host):
+        circuit = self.circuit(host)
+        circuit.failures += 1
+        if circuit.state == 'half-open' or circuit.failures >= self.failure_threshold:
+            if circuit.state != 'open':
+                print(f"Circuit opened for {host} after {circuit.failures} failures")
+            circuit.state = 'open'
+            circuit.opened_at = time.monotonic()
+            circuit.trial_started = None
+
+    def stats(self):
+        return {
+            host: {'state': circuit.state, 'consecutive_failures': circuit.failures}
+            for host, circuit in list(self._circuits.items())
+        }
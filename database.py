@@ -1,32 +1,353 @@
-from pymongo import MongoClient
+"""MongoDB storage of scraped reviews.
+
+The client is created on first use, not at import, so processes and
+routes that never touch MongoDB do not pay for pymongo or a connection.
+Each process (including every forked worker) gets its own client, whose
+connection pool is shared by all of its threads. The connection is
+configured from the environment:
+
+* SCRAPER_MONGO_URI (default mongodb://localhost:27017/) and
+  SCRAPER_MONGO_DB (default product_reviews)
+* SCRAPER_MONGO_POOL_SIZE / SCRAPER_MONGO_MIN_POOL_SIZE - connections
+  per server
+* SCRAPER_MONGO_SERVER_TIMEOUT_MS, SCRAPER_MONGO_CONNECT_TIMEOUT_MS,
+  SCRAPER_MONGO_SOCKET_TIMEOUT_MS and SCRAPER_MONGO_POOL_TIMEOUT_MS
+  (the wait for a free pooled connection)
+"""
+import base64
+import json
+import os
+import threading
 from datetime import datetime
 
-# MongoDB connection setup
-client = MongoClient('mongodb://localhost:27017/')
-db = client['product_reviews']
-collection = db['reviews']
+from metrics import DB_WRITE_SECONDS, DB_WRITTEN_REVIEWS
+from review_stats import ensure_stats_indexes, stats_collection, update_stats
+
+MONGO_URI = os.environ.get('SCRAPER_MONGO_URI', 'mongodb://localhost:27017/')
+MONGO_DB = os.environ.get('SCRAPER_MONGO_DB', 'product_reviews')
+MONGO_POOL_SIZE = int(os.environ.get('SCRAPER_MONGO_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('SCRAPER_MONGO_MIN_POOL_SIZE', 0))
+
+# Milliseconds
+MONGO_SERVER_TIMEOUT_MS = int(os.environ.get('SCRAPER_MONGO_SERVER_TIMEOUT_MS', 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('SCRAPER_MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('SCRAPER_MONGO_SOCKET_TIMEOUT_MS', 30000))
+MONGO_POOL_TIMEOUT_MS = int(os.environ.get('SCRAPER_MONGO_POOL_TIMEOUT_MS', 10000))
+
+# Reviews are upserted in batches of at most this many operations
+SAVE_BATCH_SIZE = 500
+
+# Fields refreshed when a stored review is scraped again; the rest identify it
+MUTABLE_FIELDS = ('product', 'rating')
+
+# Fields a stored-review query may project
+REVIEW_FIELDS = ('product', 'product_id', 'user', 'rating', 'title', 'comment', 'date', 'website', 'scraped_at',
+                 'sentiment', 'sentiment_label', 'near_duplicate_of', 'spam')
+
+# Largest page a stored-review query returns
+MAX_PAGE_SIZE = 1000
+
+# Indexes that stored-review pages are read in the order of; each is followed by _id
+PAGE_INDEXES = {
+    'product_date_id': [('product_id', 1), ('review_date', 1)],
+    'website_rating_id': [('website', 1), ('rating', 1)],
+    'website_date_id': [('website', 1), ('review_date', 1)],
+}
+
+_client = None
+_client_pid = None
+_client_failed = False
+_client_lock = threading.Lock()
+
+# Full names (db.collection) of the collections whose indexes exist
+_indexed = set()
+
+def get_client():
+    """This process's MongoClient, created on first use; None when MongoDB is not configured usably"""
+    global _client, _client_pid, _client_failed
+    with _client_lock:
+        # A client must not be shared across fork; a forked worker creates its own
+        if _client is not None and _client_pid == os.getpid():
+            return _client
+        if _client_failed:
+            return None
+        try:
+            from pymongo import MongoClient
+            # Connecting happens in the background; the first operation waits up to the server timeout
+            _client = MongoClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=MONGO_SERVER_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                waitQueueTimeoutMS=MONGO_POOL_TIMEOUT_MS,
+            )
+            _client_pid = os.getpid()
+            print(f"MongoDB client created (pool of {MONGO_POOL_SIZE})")
+        except Exception as e:
+            print(f"MongoDB not available: {e}")
+            _client = None
+            _client_failed = True
+        return _client
+
+def get_db():
+    client = get_client()
+    return client[MONGO_DB] if client is not None else None
+
+def get_collection(name='reviews'):
+    db = get_db()
+    return db[name] if db is not None else None
+
+def review_key(review, website):
+    """Stable identity of a review: site, product ID (or name) and content hash"""
+    # incremental imports the scraping stack, which saving reviews does not otherwise need
+    from incremental import content_hash
+
+    return {
+        'website': website.lower(),
+        'product_id': review.get('product_id') or review.get('product', 'N/A'),
+        'content_hash': content_hash(review),
+    }
+
+def ensure_indexes(collection):
+    """Create the review indexes once per collection"""
+    # Collection objects are built per call, so they are told apart by name
+    if collection.full_name in _indexed:
+        return
+    # Unique index behind the upserts; rows saved before it existed are left alone
+    collection.create_index(
+        [('website', 1), ('product_id', 1), ('content_hash', 1)],
+        unique=True,
+        name='review_identity',
+        partialFilterExpression={'content_hash': {'$exists': True}}
+    )
+    # Product timelines and site-wide rating and date filters. Each ends in _id, so
+    # find_reviews can page through a filter in index order (see page_order)
+    for name, keys in PAGE_INDEXES.items():
+        collection.create_index(keys + [('_id', 1)], name=name)
+    ensure_stats_indexes(stats_collection(collection))
+    _indexed.add(collection.full_name)
+
+def stored_ratings(collection, entries):
+    """Current rating of each of `entries` already stored, by (website, product_id, content_hash)"""
+    hashes = {}
+    for entry in entries:
+        hashes.setdefault((entry['website'], entry['product_id']), []).append(entry['content_hash'])
+    ratings = {}
+    for (website, product_id), product_hashes in hashes.items():
+        query = {'website': website, 'product_id': product_id, 'content_hash': {'$in': product_hashes}}
+        for doc in collection.find(query, {'_id': 0, 'content_hash': 1, 'rating': 1}):
+            ratings[(website, product_id, doc['content_hash'])] = doc.get('rating')
+    return ratings
+
+def save_to_mongodb(reviews, website, collection=None, raise_errors=False):
+    """Upsert reviews so that saving the same scrape twice stores nothing new.
+
+    Returns counts of reviews inserted, updated (rating or product name
+    changed) and skipped (already stored unchanged, or repeated in `reviews`).
+    Errors are printed and the save abandoned, or raised with `raise_errors`.
+    Reviews a bulk write rejected for reasons other than a duplicate key are
+    also raised with `raise_errors`, once every batch has been tried; saving
+    them again stores only what is still missing.
+    """
+    from incremental import parse_review_date
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError
+
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    write_errors = []
+    collection = collection if collection is not None else get_collection()
+    if collection is None:
+        if raise_errors:
+            raise Exception("MongoDB not available")
+        print("MongoDB not available, skipping save")
+        return counts
+
+    operations = []
+    # What the stats need to know about each operation's review
+    entries = []
+    seen = set()
+    for review in reviews:
+        key = review_key(review, website)
+        identity = tuple(key.values())
+        if identity in seen:
+            counts['skipped'] += 1
+            continue
+        seen.add(identity)
+
+        fields = {name: review.get(name) for name in MUTABLE_FIELDS}
+        first_seen = {name: review.get(name) for name in ('user', 'title', 'comment', 'date')}
+        # The site date strings do not sort; range queries use this parsed copy
+        first_seen['review_date'] = parse_review_date(review.get('date'))
+        first_seen['scraped_at'] = datetime.now()
+        operations.append(UpdateOne(key, {'$set': fields, '$setOnInsert': first_seen}, upsert=True))
+        entries.append(dict(key, product=fields['product'], rating=fields['rating'], review_date=first_seen['review_date']))
 
-def save_to_mongodb(reviews, website):
     try:
-        # Add timestamp and website info to each review
-        for review in reviews:
-            review['scraped_at'] = datetime.now()
-            review['website'] = website.lower()
-        
-        # Insert into MongoDB
-        if reviews:
-            result = collection.insert_many(reviews)
-            return len(result.inserted_ids)
-        return 0
+        ensure_indexes(collection)
+        for start in range(0, len(operations), SAVE_BATCH_SIZE):
+            batch = operations[start:start + SAVE_BATCH_SIZE]
+            batch_entries = entries[start:start + SAVE_BATCH_SIZE]
+            # Read before writing, so stats can move a re-rated review between stars
+            previous = stored_ratings(collection, batch_entries)
+            try:
+                with DB_WRITE_SECONDS.time():
+                    result = collection.bulk_write(batch, ordered=False).bulk_api_result
+            except BulkWriteError as e:
+                result = e.details
+                # A concurrent save inserting the same review loses the race on the unique index
+                duplicates = sum(1 for error in result['writeErrors'] if error.get('code') == 11000)
+                counts['skipped'] += duplicates
+                write_errors.extend(error for error in result['writeErrors'] if error.get('code') != 11000)
+
+            counts['inserted'] += result['nUpserted']
+            counts['updated'] += result['nModified']
+            counts['skipped'] += result['nMatched'] - result['nModified']
+
+            upserted = {item['index'] for item in result.get('upserted', [])}
+            failed = {error['index'] for error in result.get('writeErrors', [])}
+            added = []
+            rerated = []
+            for i, entry in enumerate(batch_entries):
+                identity = (entry['website'], entry['product_id'], entry['content_hash'])
+                if i in upserted:
+                    added.append(entry)
+                elif i not in failed and identity in previous and previous[identity] != entry['rating']:
+                    rerated.append((entry, previous[identity]))
+            update_stats(stats_collection(collection), added, rerated)
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error saving to MongoDB: {str(e)}")
-        return 0
+        return counts
+
+    for name, count in counts.items():
+        DB_WRITTEN_REVIEWS.inc(count, result=name)
+    print(f"Saved reviews to MongoDB: {counts['inserted']} inserted, {counts['updated']} updated, {counts['skipped']} skipped")
+    if write_errors:
+        message = f"Error saving to MongoDB: {len(write_errors)} reviews not stored: {write_errors[0].get('errmsg')}"
+        if raise_errors:
+            raise Exception(message)
+        print(message)
+    return counts
+
+def review_query(website=None, product=None, min_rating=None, max_rating=None, date_from=None, date_to=None):
+    """MongoDB filter for stored reviews; `product` is a Flipkart pid or Amazon ASIN"""
+    query = {}
+    if website:
+        query['website'] = website.lower()
+    if product:
+        query['product_id'] = product
+    if min_rating is not None or max_rating is not None:
+        query['rating'] = {}
+        if min_rating is not None:
+            query['rating']['$gte'] = float(min_rating)
+        if max_rating is not None:
+            query['rating']['$lte'] = float(max_rating)
+    if date_from or date_to:
+        query['review_date'] = {}
+        if date_from:
+            query['review_date']['$gte'] = datetime.fromisoformat(date_from)
+        if date_to:
+            query['review_date']['$lte'] = datetime.fromisoformat(date_to)
+    return query
+
+def review_projection(fields=None):
+    """Projection for `fields` (all public fields by default); raises ValueError on unknown ones"""
+    fields = fields or REVIEW_FIELDS
+    unknown = [field for field in fields if field not in REVIEW_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown review fields: {', '.join(unknown)}")
+    return {field: 1 for field in fields}
+
+def page_order(query):
+    """(field, index) that pages of `query` are sorted by, ahead of `_id`.
+
+    A product's reviews are read by date, a site's by rating, or by date
+    when only dates are filtered. Other queries follow `_id` alone.
+    """
+    if 'product_id' in query:
+        return 'review_date', 'product_date_id'
+    if 'website' in query:
+        if 'review_date' in query and 'rating' not in query:
+            return 'review_date', 'website_date_id'
+        return 'rating', 'website_rating_id'
+    return None, '_id_'
+
+def encode_cursor(field, value, last_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    token = json.dumps([field, value, str(last_id)])
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+def cursor_filter(cursor, field):
+    """Filter for the reviews after `cursor`, in the order of `field` then `_id`"""
+    from bson import ObjectId
+    try:
+        cursor_field, value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        last_id = ObjectId(last_id)
+        if cursor_field != field:
+            raise ValueError
+        if field == 'review_date' and value is not None:
+            value = datetime.fromisoformat(value)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+    if field is None:
+        return {'_id': {'$gt': last_id}}
+    # Missing values sort first, ahead of every rating and date
+    after_value = {field: {'$ne': None}} if value is None else {field: {'$gt': value}}
+    return {'$or': [{field: value, '_id': {'$gt': last_id}}, after_value]}
+
+def find_reviews(query=None, fields=None, after=None, limit=100, collection=None):
+    """One page of stored reviews, in the order of the index that serves `query`.
+
+    Pages are keyset-paginated on that index (see page_order), with `_id`
+    breaking ties: pass the returned cursor as `after` to get the next page,
+    so a deep page costs the same as the first one. Returns
+    (reviews, next_cursor), with next_cursor None on the last page.
+    """
+    collection = collection if collection is not None else get_collection()
+    if collection is None:
+        return [], None
+    ensure_indexes(collection)
+
+    query = dict(query or {})
+    field, index = page_order(query)
+    if after:
+        query = {'$and': [query, cursor_filter(after, field)]}
+    limit = min(max(int(limit), 1), MAX_PAGE_SIZE)
+
+    projection = review_projection(fields)
+    hidden = field is not None and field not in projection
+    if field:
+        projection[field] = 1
+    sort = [(field, 1), ('_id', 1)] if field else [('_id', 1)]
+
+    cursor = collection.find(query, projection).sort(sort).hint(index).limit(limit)
+    reviews = []
+    last_value = last_id = None
+    for doc in cursor:
+        last_id = doc.pop('_id')
+        last_value = (doc.pop(field, None) if hidden else doc.get(field)) if field else None
+        reviews.append(doc)
+
+    next_cursor = encode_cursor(field, last_value, last_id) if len(reviews) == limit else None
+    return reviews, next_cursor
+
+def iter_reviews_from_mongodb(query=None, fields=None, batch_size=MAX_PAGE_SIZE, collection=None):
+    """Stream every stored review matching `query` without holding them all in memory"""
+    collection = collection if collection is not None else get_collection()
+    if collection is None:
+        return
+
+    projection = dict(review_projection(fields), _id=0)
+    yield from collection.find(query or {}, projection, batch_size=batch_size)
 
-def get_reviews_from_mongodb(website=None):
+def get_reviews_from_mongodb(website=None, collection=None):
     try:
-        query = {'website': website.lower()} if website else {}
-        reviews = list(collection.find(query, {'_id': 0}))
-        return reviews
+        return list(iter_reviews_from_mongodb(review_query(website), collection=collection))
     except Exception as e:
         print(f"Error fetching from MongoDB: {str(e)}")
-        return []
\ No newline at end of file
+        return []
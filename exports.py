@@ -0,0 +1,230 @@
+"""Review exports streamed straight from a MongoDB cursor.
+
+Rows are written as they are read, so an export of a million reviews runs in
+bounded memory whatever the format:
+
+* xlsx - openpyxl write-only workbook
+* csv - streamed in chunks
+* jsonl.gz - one JSON object per line, gzip-compressed as it streams
+* parquet - row groups written batch by batch with pyarrow (optional
+  dependency), `website` and `product` dictionary-encoded
+
+Every writer takes `columns`; pass EXPORT_COLUMNS + ANALYTICS_COLUMNS to
+add the results of `python analytics.py run`.
+
+xlsx and parquet go to anonymous temporary files, so concurrent exports
+cannot overwrite each other; csv and jsonl.gz are sent as they are produced.
+"""
+import csv
+import io
+import itertools
+import json
+import tempfile
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font
+from openpyxl.utils import get_column_letter
+
+from metrics import EXPORT_ROWS, EXPORT_SECONDS
+from reviews import ReviewBatch
+
+# (header, review field, default) for every exported column
+EXPORT_COLUMNS = [
+    ('Product', 'product', 'N/A'),
+    ('User', 'user', 'Anonymous'),
+    ('Rating', 'rating', 0),
+    ('Title', 'title', 'No Title'),
+    ('Comment', 'comment', 'No Comment'),
+    ('Date', 'date', 'N/A'),
+    ('Website', 'website', 'N/A'),
+]
+EXPORT_FIELDS = [field for _, field, _ in EXPORT_COLUMNS]
+
+# Written by analytics.py; empty until it has run over a review
+ANALYTICS_COLUMNS = [
+    ('Sentiment', 'sentiment', None),
+    ('Sentiment Label', 'sentiment_label', None),
+    ('Near Duplicate Of', 'near_duplicate_of', None),
+    ('Spam', 'spam', None),
+]
+
+# Column widths are sized from this many leading rows instead of the whole export
+WIDTH_SAMPLE_ROWS = 1000
+MAX_COLUMN_WIDTH = 50
+
+# Rows per streamed chunk and per Parquet row group
+CHUNK_ROWS = 1000
+PARQUET_ROW_GROUP_ROWS = 64 * 1024
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# format -> (file extension, mimetype)
+EXPORT_FORMATS = {
+    'xlsx': ('xlsx', XLSX_MIMETYPE),
+    'csv': ('csv', 'text/csv'),
+    'jsonl': ('jsonl.gz', 'application/gzip'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def export_fields(columns):
+    return [field for _, field, _ in columns]
+
+
+def export_rows(reviews, columns=EXPORT_COLUMNS):
+    if isinstance(reviews, ReviewBatch):
+        # Straight from the columns, without a Review object per row
+        yield from reviews.rows([(field, default) for _, field, default in columns])
+        return
+    for review in reviews:
+        yield [review.get(field, default) for _, field, default in columns]
+
+
+def chunked(iterable, size=CHUNK_ROWS):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_excel(reviews, website, output, columns=EXPORT_COLUMNS):
+    """Write `reviews` as xlsx to `output` (a path or binary file); returns the row count"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(f"{website.capitalize()} Reviews")
+    rows = export_rows(reviews, columns)
+
+    # Write-only sheets need their column widths before the first row
+    sample = list(itertools.islice(rows, WIDTH_SAMPLE_ROWS))
+    widths = [len(header) for header, _, _ in columns]
+    for row in sample:
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], len(str(value)))
+    for i, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(i)].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+    header = []
+    for title, _, _ in columns:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+        header.append(cell)
+    ws.append(header)
+
+    count = 0
+    for row in itertools.chain(sample, rows):
+        ws.append(row)
+        count += 1
+
+    wb.save(output)
+    EXPORT_ROWS.inc(count, format='xlsx')
+    return count
+
+
+def iter_csv(reviews, columns=EXPORT_COLUMNS):
+    """CSV text of `reviews`, a header line first, yielded in chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for header, _, _ in columns])
+    for chunk in chunked(export_rows(reviews, columns)):
+        writer.writerows(chunk)
+        EXPORT_ROWS.inc(len(chunk), format='csv')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_jsonl_gzip(reviews, columns=EXPORT_COLUMNS):
+    """Gzip-compressed JSON Lines of `reviews`, yielded in chunks"""
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunked(reviews):
+        lines = ''.join(json.dumps({field: review.get(field, default) for _, field, default in columns}, default=str) + '\n' for review in chunk)
+        data = compressor.compress(lines.encode('utf-8'))
+        EXPORT_ROWS.inc(len(chunk), format='jsonl')
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Parquet type of every exported field, and how values are converted to it
+def parquet_types():
+    return {
+        'product': pa.dictionary(pa.int32(), pa.string()),
+        'user': pa.string(),
+        'rating': pa.float64(),
+        'title': pa.string(),
+        'comment': pa.string(),
+        # Flipkart sends epoch milliseconds and Amazon a display string
+        'date': pa.string(),
+        'website': pa.dictionary(pa.int32(), pa.string()),
+        'sentiment': pa.float64(),
+        'sentiment_label': pa.dictionary(pa.int32(), pa.string()),
+        'near_duplicate_of': pa.string(),
+        'spam': pa.bool_(),
+    }
+
+
+PARQUET_CONVERTERS = {
+    'rating': lambda value: float(value or 0),
+    'date': str,
+}
+
+
+def parquet_schema(columns=EXPORT_COLUMNS):
+    types = parquet_types()
+    return pa.schema([(field, types[field]) for field in export_fields(columns)])
+
+
+def write_parquet(reviews, output, columns=EXPORT_COLUMNS):
+    """Write `reviews` as Parquet to `output` (a path or binary file); returns the row count"""
+    if pa is None:
+        raise ValueError("Parquet export needs the pyarrow package")
+
+    schema = parquet_schema(columns)
+    dictionary_fields = [field.name for field in schema if pa.types.is_dictionary(field.type)]
+    count = 0
+    with pq.ParquetWriter(output, schema, compression='zstd', use_dictionary=dictionary_fields) as writer:
+        for chunk in chunked(export_rows(reviews, columns), PARQUET_ROW_GROUP_ROWS):
+            arrays = []
+            for field, column in zip(schema, zip(*chunk)):
+                convert = PARQUET_CONVERTERS.get(field.name)
+                if convert:
+                    column = [convert(value) for value in column]
+                if pa.types.is_dictionary(field.type):
+                    arrays.append(pa.array(column, type=pa.string()).dictionary_encode())
+                else:
+                    arrays.append(pa.array(column, type=field.type))
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            count += len(chunk)
+    EXPORT_ROWS.inc(count, format='parquet')
+    return count
+
+
+def timed_stream(chunks, export_format):
+    """Pass a streamed export through, timing it from the first chunk to the last"""
+    with EXPORT_SECONDS.time(format=export_format):
+        yield from chunks
+
+
+def export_file(write, reviews, *args, **kwargs):
+    """Run `write` into an anonymous temporary file; returns (file rewound to the start, row count)"""
+    output = tempfile.TemporaryFile()
+    try:
+        count = write(reviews, *args, output, **kwargs)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output, count
@@ -0,0 +1,273 @@
+import asyncio
+import random
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+
+from cache import CachedResponse, get_cache
+from circuit import CircuitBreaker
+from metrics import FETCH_RESPONSES, FETCH_SECONDS, Counter, Gauge
+from ratelimit import THROTTLE_STATUSES, AdaptiveRateLimiter, parse_retry_after
+
+# Size of the keep-alive connection pool shared by every scrape in the process
+POOL_SIZE = 32
+MAX_CONNECTIONS = 100
+
+# Starting requests per second for each host; the limiter adapts from there
+HOST_RATES = {
+    'www.flipkart.com': 4.0,
+    'www.amazon.in': 0.5,
+}
+DEFAULT_RATE = 2.0
+
+# Connecting fails fast; reading a slow page is given longer
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 15.0
+DEFAULT_TIMEOUT = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+# Retries per request after the first attempt, and the base of their exponential backoff
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+# User-Agents list for rotation
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Safari/605.1.15'
+]
+
+
+def browser_headers():
+    return {
+        'User-Agent': random.choice(USER_AGENTS),
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Accept-Encoding': 'gzip, deflate',
+        'Upgrade-Insecure-Requests': '1',
+    }
+
+
+# All scraping runs on one event loop in a background thread, so any number of
+# concurrent scrapes share one connection pool instead of needing a thread each
+_loop = None
+_client = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """Return the shared scraping event loop, starting it on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='scrape-loop', daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def run_sync(coro):
+    """Run a coroutine on the shared loop and block until it finishes"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+def iter_sync(agen):
+    """Iterate an async generator from blocking code, stepping it on the shared loop"""
+    loop = get_loop()
+
+    async def step():
+        return await agen.__anext__()
+
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(step(), loop).result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
+
+async def run_async(coro):
+    """Await a coroutine on the shared loop from any other event loop"""
+    loop = get_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+def get_client():
+    """Return the keep-alive client shared by all scrapers (shared loop only)"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=POOL_SIZE),
+            follow_redirects=True,
+        )
+    return _client
+
+
+rate_limiter = AdaptiveRateLimiter(HOST_RATES, DEFAULT_RATE)
+circuit_breaker = CircuitBreaker()
+
+
+def cache_counters():
+    cache = get_cache()
+    if cache is None:
+        return {}
+    return {(event,): count for event, count in cache.stats().items() if event in cache.counters}
+
+
+def host_rates():
+    return {(host,): stats['rate'] for host, stats in rate_limiter.stats().items() if stats['rate'] is not None}
+
+
+def open_circuits():
+    return {(host,): int(stats['state'] != 'closed') for host, stats in circuit_breaker.stats().items()}
+
+
+Counter('scraper_cache_events_total', 'Response cache lookups and stores, per event', ['event'], function=cache_counters)
+Gauge('scraper_host_rate', 'Current adaptive request rate per host, in requests per second', ['host'], function=host_rates)
+Gauge('scraper_circuit_open', '1 while the circuit breaker for a host is open or half-open', ['host'], function=open_circuits)
+
+
+# Markers of a bot-check page, lower-cased. Words such as "robot" alone also
+# turn up in real reviews and meta tags, so only whole markers count
+BLOCK_MARKERS = (
+    b'/errors/validatecaptcha',
+    b'<title>robot check</title>',
+    b'enter the characters you see below',
+    b'api-services-support@amazon.com',
+)
+
+# Bot-check pages are small; a body larger than this is a real page
+BLOCK_PAGE_MAX_BYTES = 32 * 1024
+
+
+def looks_blocked(content):
+    """True for a bot-check (CAPTCHA) page served instead of the requested one"""
+    if len(content) > BLOCK_PAGE_MAX_BYTES or b'data-hook="review"' in content:
+        return False
+    lowered = content.lower()
+    return any(marker in lowered for marker in BLOCK_MARKERS)
+
+
+def retry_delay(attempt):
+    """Exponential backoff with jitter before retry number `attempt` (0-based)"""
+    return RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.0)
+
+
+async def fetch(url, headers=None, timeout=None, detect_block=False, use_cache=True, retries=MAX_RETRIES):
+    """GET a URL through the response cache and shared client.
+
+    Fresh cached responses are returned without a request; stale ones are
+    revalidated with conditional headers. Network requests respect the
+    per-host rate budget, which adapts to how the host responds, and the
+    host's circuit breaker. Connection errors, timeouts, 429/5xx responses
+    and (with `detect_block`) CAPTCHA pages are retried up to `retries`
+    times with backoff before the last error is raised. Returns a
+    cache.CachedResponse.
+    """
+    cache = get_cache() if use_cache else None
+    entry = await cache.get_async(url) if cache else None
+    if entry is not None and entry.is_fresh(cache.ttl_for(url)):
+        cache.record('hits')
+        return entry
+
+    request_headers = dict(headers or browser_headers())
+    if entry is not None:
+        request_headers.update(entry.conditional_headers())
+
+    host = urlsplit(url).netloc
+    for attempt in range(retries + 1):
+        circuit_breaker.check(host)
+        await rate_limiter.acquire(host)
+        try:
+            with FETCH_SECONDS.time(host=host):
+                response = await get_client().get(url, headers=request_headers, timeout=timeout or DEFAULT_TIMEOUT)
+        except httpx.TransportError as e:
+            FETCH_RESPONSES.inc(host=host, outcome='transport_error')
+            circuit_breaker.failed(host)
+            error = Exception(f"{type(e).__name__} fetching {url}")
+        else:
+            status = response.status_code
+            if status in THROTTLE_STATUSES:
+                FETCH_RESPONSES.inc(host=host, outcome='throttled')
+                rate_limiter.blocked(host, parse_retry_after(response.headers.get('retry-after')))
+                if status == 503:
+                    circuit_breaker.failed(host)
+                error = Exception(f"HTTP {status} for {url}")
+            elif status >= 500:
+                FETCH_RESPONSES.inc(host=host, outcome='server_error')
+                circuit_breaker.failed(host)
+                error = Exception(f"HTTP {status} for {url}")
+            elif status < 400 and detect_block and looks_blocked(response.content):
+                FETCH_RESPONSES.inc(host=host, outcome='captcha')
+                rate_limiter.blocked(host, captcha=True)
+                error = Exception("Website blocked the request with CAPTCHA")
+            else:
+                # Success, or a client error that will not go away on retry
+                FETCH_RESPONSES.inc(host=host, outcome='client_error' if status >= 400 else 'ok')
+                if status < 400:
+                    rate_limiter.succeeded(host)
+                circuit_breaker.succeeded(host)
+                break
+
+        if attempt == retries:
+            raise error
+        print(f"Retrying {url} ({attempt + 1}/{retries}): {str(error)}")
+        await asyncio.sleep(retry_delay(attempt))
+
+    if response.status_code == 304 and entry is not None:
+        return cache.refresh(url, entry)
+
+    response.raise_for_status()
+
+    if cache is None:
+        return CachedResponse(url, response.content, dict(response.headers), status_code=response.status_code)
+    cache.record('misses')
+    return cache.put(url, response.content, response.headers)
+
+
+async def fetch_pages(page_url, max_pages=None, concurrency=4, headers=None, timeout=None, return_exceptions=False, start_page=1):
+    """Fetch pages start_page, start_page + 1, ... with up to `concurrency` requests in flight.
+
+    `page_url(page)` builds the URL for a page number. Responses are yielded
+    as `(page, response)` in page order; stop iterating (and close the
+    generator) to stop paging, and any pages still in flight are cancelled.
+    With `return_exceptions`, a page that fails is yielded as `(page, error)`
+    instead of ending the generator.
+    """
+    concurrency = max(1, concurrency)
+    pending = deque()
+    next_page = start_page
+
+    def submit():
+        nonlocal next_page
+        if max_pages is not None and next_page > max_pages:
+            return
+        task = asyncio.ensure_future(fetch(page_url(next_page), headers, timeout))
+        pending.append((next_page, task))
+        next_page += 1
+
+    try:
+        for _ in range(concurrency):
+            submit()
+
+        while pending:
+            page, task = pending.popleft()
+            try:
+                response = await task
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                response = e
+            yield page, response
+            submit()
+    finally:
+        for _, task in pending:
+            task.cancel()
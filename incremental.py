@@ -0,0 +1,181 @@
+"""Incremental scraping against a per-product high-water mark.
+
+For every product we remember the newest review date seen and content
+hashes of the most recent reviews. An incremental scrape fetches newest
+first and stops paging as soon as it reaches a review it already knows, so a
+daily refresh of a tracked product costs one or two page fetches.
+"""
+import asyncio
+import hashlib
+import re
+from contextlib import aclosing
+from datetime import datetime
+
+from checkpoints import get_checkpoints, iter_checkpointed_reviews
+from reviews import ReviewBatch
+from scrapper import iter_reviews, product_id_from_url, site_name
+
+# Hashes of this many most recent reviews are kept per product, so the
+# high-water mark survives the newest review being edited or removed
+WATERMARK_HASHES = 50
+
+# Seconds a watermark read or write may take before the scrape goes on without it
+WATERMARK_TIMEOUT = 0.5
+
+DATE_FORMATS = ['%d %B %Y', '%d %b %Y', '%d %b, %Y', '%b, %Y', '%B, %Y', '%Y-%m-%d']
+
+
+def content_hash(review):
+    """Stable fingerprint of a review's user, title, comment and date"""
+    key = '\x1f'.join(str(review.get(field, '')) for field in ('user', 'title', 'comment', 'date'))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def parse_review_date(value):
+    """Best-effort datetime for the site date formats; None when unknown"""
+    if isinstance(value, (int, float)):
+        # Flipkart sends epoch milliseconds
+        return datetime.fromtimestamp(value / 1000 if value > 1e11 else value)
+    if not isinstance(value, str) or value in ('', 'N/A'):
+        return None
+
+    value = re.sub(r'(\d)(st|nd|rd|th)\b', r'\1', value.strip())
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+class WatermarkStore:
+    """High-water marks in MongoDB (`watermarks` collection), or in memory without it.
+
+    Scrapes must not wait on an unhealthy database. Every MongoDB call is
+    capped at `timeout` seconds, and none is made while `failing()` says
+    MongoDB is down (the app passes writer.writer_failing).
+    """
+
+    def __init__(self, collection=None, timeout=WATERMARK_TIMEOUT, failing=None):
+        self.collection = collection
+        self.timeout = timeout
+        self.failing = failing
+        self._memory = {}
+
+    def _unavailable(self):
+        return self.failing is not None and self.failing()
+
+    def get(self, key):
+        """The mark for `key`, or None if there is none; raises when it cannot be read"""
+        if self.collection is None:
+            return self._memory.get(key)
+        if self._unavailable():
+            raise Exception("MongoDB is failing")
+        import pymongo
+        with pymongo.timeout(self.timeout):
+            return self.collection.find_one({'_id': key})
+
+    def advance(self, key, new_reviews, previous=None):
+        """Record `new_reviews` (newest first) on top of the previous mark"""
+        if not new_reviews:
+            return
+
+        hashes = [content_hash(review) for review in new_reviews]
+        hashes += (previous or {}).get('hashes', [])
+        dates = [parse_review_date(review.get('date')) for review in new_reviews]
+        dates = [date for date in dates + [(previous or {}).get('newest_date')] if date]
+
+        mark = {
+            '_id': key,
+            'hashes': hashes[:WATERMARK_HASHES],
+            'newest_date': max(dates) if dates else None,
+            'updated_at': datetime.now(),
+        }
+        if self.collection is None:
+            self._memory[key] = mark
+            return
+        # A mark that is not saved stays behind, so the next run fetches these reviews again
+        if self._unavailable():
+            print(f"Not saving watermark {key}: MongoDB is failing")
+            return
+        import pymongo
+        try:
+            with pymongo.timeout(self.timeout):
+                self.collection.replace_one({'_id': key}, mark, upsert=True)
+        except Exception as e:
+            print(f"Error saving watermark {key}: {str(e)}")
+
+
+def is_known(review, mark):
+    """True once paging has reached reviews the previous scrape already saw"""
+    if content_hash(review) in mark['hashes']:
+        return True
+    date = parse_review_date(review.get('date'))
+    return bool(date and mark.get('newest_date') and date < mark['newest_date'])
+
+
+async def iter_incremental_reviews(website, product_url, max_reviews, store, failures=None):
+    """Like scrapper.iter_reviews, but only yields reviews newer than the stored mark"""
+    failures = [] if failures is None else failures
+    product_id = product_id_from_url(website, product_url)
+    if product_id is None:
+        # Without a stable product ID there is nothing to key the mark on
+        async with aclosing(iter_reviews(website, product_url, max_reviews, failures=failures)) as batches:
+            async for batch in batches:
+                yield batch
+        return
+
+    key = f"{site_name(website)}:{product_id}"
+    try:
+        mark = await asyncio.to_thread(store.get, key)
+        readable = True
+    except Exception as e:
+        # Scrape newest first without a mark, and leave the stored one alone
+        print(f"Watermark {key} unavailable, scraping without it: {str(e)}")
+        mark, readable = None, False
+    new_reviews = ReviewBatch()
+    failed_before = len(failures)
+    reached_known = False
+
+    # Newest first, one page at a time: usually only the first page or two are new
+    batches = iter_reviews(website, product_url, max_reviews, newest_first=True, concurrency=1, failures=failures)
+    async with aclosing(batches):
+        async for batch in batches:
+            fresh = batch
+            if mark:
+                known = next((i for i, review in enumerate(batch) if is_known(review, mark)), len(batch))
+                fresh = batch[:known]
+
+            new_reviews.extend(fresh)
+            if fresh:
+                yield fresh
+            if len(fresh) < len(batch):
+                reached_known = True
+                break
+
+    # Reviews on pages that failed were never seen; keep the old mark so the next run picks them up
+    if len(failures) > failed_before or not readable:
+        return
+    # Stopping at max_reviews before a known review leaves a gap of unfetched reviews
+    # below the last one yielded. The old mark stays, so the next run pages down to it again.
+    # A first scrape has no mark to keep; it starts tracking from the reviews it got
+    if mark and not reached_known and len(new_reviews) >= max_reviews:
+        print(f"Incremental scrape of {key} stopped at {max_reviews} reviews before reaching the last scrape; keeping its mark")
+        return
+    await asyncio.to_thread(store.advance, key, new_reviews, mark)
+
+
+def iter_review_batches(website, product_url, max_reviews=10, incremental=False, store=None, failures=None):
+    """Page generator for a scrape: incremental when asked and a store is available,
+    otherwise a full scrape that resumes from its checkpoint"""
+    site_name(website)
+    if incremental and store is not None:
+        return iter_incremental_reviews(website, product_url, max_reviews, store, failures)
+    checkpoints = get_checkpoints()
+    if checkpoints is not None:
+        return iter_checkpointed_reviews(website, product_url, max_reviews, checkpoints, failures)
+    return iter_reviews(website, product_url, max_reviews, failures=failures)
@@ -0,0 +1,276 @@
+"""Background scrape jobs.
+
+`POST /jobs` hands a scrape to a job backend and returns immediately; the
+backend runs it on a bounded pool and records progress and results that the
+web tier polls. Two backends are available:
+
+* InProcessJobBackend - jobs run on the shared scraping loop of the web
+  process and are kept in memory (the default).
+* MongoJobBackend - jobs are queued in MongoDB and picked up by separate
+  worker processes started with `python jobs.py worker`, so scraping can be
+  scaled out independently of the web tier. A worker holds a lease on each
+  job it runs and renews it while the job runs; if the worker dies, another
+  worker takes the job over once the lease runs out.
+
+Select the backend with SCRAPE_JOB_BACKEND=memory|mongo.
+"""
+import asyncio
+import os
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from fetcher import get_loop, run_sync
+from incremental import WatermarkStore, iter_review_batches
+from metrics import ACTIVE_JOBS
+from scrapper import collect_reviews
+
+JOB_WORKERS = int(os.environ.get('SCRAPE_JOB_WORKERS', 4))
+
+# Seconds a worker's claim on a MongoDB job lasts without being renewed
+JOB_LEASE_SECONDS = int(os.environ.get('SCRAPE_JOB_LEASE', 60))
+
+# Finished in-memory jobs kept around for polling before the oldest are dropped
+MAX_FINISHED_JOBS = 200
+
+
+def new_job(website, url, max_reviews, incremental=False):
+    return {
+        'id': uuid.uuid4().hex,
+        'website': website,
+        'url': url,
+        'max_reviews': max_reviews,
+        'incremental': incremental,
+        'status': 'queued',
+        'pages_done': 0,
+        'reviews_collected': 0,
+        'failed_pages': [],
+        'error': None,
+        'created_at': datetime.now(),
+        'started_at': None,
+        'finished_at': None,
+    }
+
+
+def job_status(job):
+    """Public view of a job record, with an ETA derived from the scrape rate so far"""
+    status = {key: job.get(key) for key in (
+        'id', 'website', 'url', 'max_reviews', 'incremental', 'status', 'pages_done',
+        'reviews_collected', 'failed_pages', 'error', 'created_at', 'started_at', 'finished_at'
+    )}
+
+    eta = None
+    if job['status'] == 'running' and job['started_at'] and job['reviews_collected']:
+        elapsed = (datetime.now() - job['started_at']).total_seconds()
+        rate = job['reviews_collected'] / max(elapsed, 1e-6)
+        eta = max(job['max_reviews'] - job['reviews_collected'], 0) / rate
+    elif job['status'] == 'done':
+        eta = 0
+    status['eta_seconds'] = eta
+    return status
+
+
+async def run_job(job, update, save_reviews=None, watermarks=None):
+    """Run one scrape job; `update(fields)` records progress on the job"""
+    update({'status': 'running', 'started_at': datetime.now()})
+
+    def progress(pages_done, reviews_collected):
+        update({'pages_done': pages_done, 'reviews_collected': reviews_collected})
+
+    failures = []
+    try:
+        batches = iter_review_batches(job['website'], job['url'], job['max_reviews'], job.get('incremental'), watermarks, failures)
+        with ACTIVE_JOBS.track(kind='job'):
+            reviews = await collect_reviews(batches, progress)
+        # Pages that failed are skipped; the job finishes with what the other pages gave
+        if failures:
+            update({'failed_pages': failures})
+        if not reviews and failures:
+            raise Exception(failures[0]['error'])
+        if reviews and save_reviews:
+            await asyncio.to_thread(save_reviews, reviews, job['website'])
+    except Exception as e:
+        print(f"Job {job['id']} failed: {str(e)}")
+        update({'status': 'failed', 'error': str(e), 'finished_at': datetime.now()})
+        return []
+
+    return reviews
+
+
+class InProcessJobBackend:
+    """Runs jobs on the shared scraping loop, at most `max_workers` at a time"""
+
+    def __init__(self, max_workers=JOB_WORKERS, save_reviews=None, watermarks=None):
+        self.max_workers = max_workers
+        self.save_reviews = save_reviews
+        self.watermarks = watermarks
+        # Request threads add jobs while the scraping loop evicts finished ones
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._results = {}
+        self._semaphore = None
+
+    def submit(self, website, url, max_reviews, incremental=False):
+        job = new_job(website, url, max_reviews, incremental)
+        with self._lock:
+            self._jobs[job['id']] = job
+        asyncio.run_coroutine_threadsafe(self._run(job), get_loop())
+        return job['id']
+
+    async def _run(self, job):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        async with self._semaphore:
+            reviews = await run_job(job, job.update, self.save_reviews, self.watermarks)
+            if job['status'] != 'failed':
+                self._results[job['id']] = reviews
+                job.update({'status': 'done', 'reviews_collected': len(reviews), 'finished_at': datetime.now()})
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job['finished_at']]
+            for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+                del self._jobs[job_id]
+                self._results.pop(job_id, None)
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return job_status(job) if job else None
+
+    def get_reviews(self, job_id, offset=0, limit=100):
+        return self._results.get(job_id, [])[offset:offset + limit]
+
+
+class MongoJobBackend:
+    """Queues jobs in MongoDB for worker processes running `python jobs.py worker`"""
+
+    def __init__(self, db, max_workers=JOB_WORKERS, save_reviews=None, watermarks=None, lease_seconds=JOB_LEASE_SECONDS):
+        self.jobs = db['jobs']
+        self.job_reviews = db['job_reviews']
+        self.max_workers = max_workers
+        self.save_reviews = save_reviews
+        self.watermarks = watermarks
+        self.lease_seconds = lease_seconds
+
+    def submit(self, website, url, max_reviews, incremental=False):
+        job = new_job(website, url, max_reviews, incremental)
+        job['_id'] = job['id']
+        self.jobs.insert_one(job)
+        return job['id']
+
+    def get(self, job_id):
+        job = self.jobs.find_one({'_id': job_id})
+        return job_status(job) if job else None
+
+    def get_reviews(self, job_id, offset=0, limit=100):
+        # Reviews are numbered from 0, so the offset is also the seq to continue from
+        query = {'job_id': job_id, 'seq': {'$gte': offset}}
+        cursor = self.job_reviews.find(query, {'_id': 0, 'review': 1}).sort('seq', 1).limit(limit)
+        return [doc['review'] for doc in cursor]
+
+    def claim(self):
+        """Atomically take the oldest queued job, or a running one whose lease ran out; None if there is none"""
+        now = datetime.now()
+        lease = uuid.uuid4().hex
+        job = self.jobs.find_one_and_update(
+            {'$or': [{'status': 'queued'}, {'status': 'running', 'lease_until': {'$lt': now}}]},
+            # A job taken over starts again from the first page
+            {'$set': {'status': 'running', 'started_at': now, 'lease': lease,
+                      'lease_until': now + timedelta(seconds=self.lease_seconds),
+                      'pages_done': 0, 'reviews_collected': 0, 'failed_pages': []}},
+            sort=[('created_at', 1)],
+        )
+        if job:
+            job['lease'] = lease
+        return job
+
+    def _renew(self, job):
+        """Extend the lease on a job; False once another worker has taken it over"""
+        lease_until = datetime.now() + timedelta(seconds=self.lease_seconds)
+        result = self.jobs.update_one({'_id': job['_id'], 'lease': job['lease']}, {'$set': {'lease_until': lease_until}})
+        return result.matched_count > 0
+
+    async def _heartbeat(self, job):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await asyncio.to_thread(self._renew, job):
+                    print(f"Job {job['_id']} was taken over by another worker")
+                    return
+            except Exception as e:
+                print(f"Error renewing lease on job {job['_id']}: {str(e)}")
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        # Writes only land while this worker still holds the lease
+        owned = {'_id': job['_id'], 'lease': job['lease']}
+
+        def update(fields):
+            job.update(fields)
+            # Progress writes must not block the scraping loop
+            loop.run_in_executor(None, self.jobs.update_one, owned, {'$set': fields})
+
+        heartbeat = asyncio.ensure_future(self._heartbeat(job))
+        try:
+            reviews = await run_job(job, update, self.save_reviews, self.watermarks)
+            if job['status'] == 'failed' or not await asyncio.to_thread(self._renew, job):
+                return
+            # A job taken over from a dead worker may have some of its reviews stored already
+            await asyncio.to_thread(self.job_reviews.delete_many, {'job_id': job['_id']})
+            if reviews:
+                docs = ({'job_id': job['_id'], 'seq': seq, 'review': review} for seq, review in enumerate(reviews.iter_dicts()))
+                await asyncio.to_thread(self.job_reviews.insert_many, docs)
+
+            fields = {'status': 'done', 'reviews_collected': len(reviews), 'finished_at': datetime.now()}
+            await asyncio.to_thread(self.jobs.update_one, owned, {'$set': fields})
+        finally:
+            heartbeat.cancel()
+
+    async def work(self, poll_interval=1.0):
+        """Claim and run queued jobs forever, up to `max_workers` at a time"""
+        self.job_reviews.create_index([('job_id', 1), ('seq', 1)])
+        # Serves claim(): the oldest job of a status first
+        self.jobs.create_index([('status', 1), ('created_at', 1)])
+        running = set()
+        while True:
+            job = None
+            if len(running) < self.max_workers:
+                job = await asyncio.to_thread(self.claim)
+            if job:
+                print(f"Worker picked up job {job['_id']}")
+                task = asyncio.ensure_future(self._run(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            else:
+                await asyncio.sleep(poll_interval)
+
+
+def create_job_backend(db=None, save_reviews=None, watermarks=None):
+    """Build the backend chosen by SCRAPE_JOB_BACKEND (memory by default)"""
+    kind = os.environ.get('SCRAPE_JOB_BACKEND', 'memory').lower()
+    if kind == 'mongo':
+        if db is None:
+            raise Exception("SCRAPE_JOB_BACKEND=mongo needs a MongoDB connection")
+        return MongoJobBackend(db, save_reviews=save_reviews, watermarks=watermarks)
+    return InProcessJobBackend(save_reviews=save_reviews, watermarks=watermarks)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] != ['worker']:
+        print("Usage: python jobs.py worker")
+        sys.exit(1)
+
+    from database import get_db
+    from writer import get_writer, writer_failing
+
+    db = get_db()
+    if db is None:
+        print("MongoDB not available")
+        sys.exit(1)
+    backend = MongoJobBackend(db, save_reviews=get_writer().submit, watermarks=WatermarkStore(db['watermarks'], failing=writer_failing))
+    print(f"Scrape worker started with {backend.max_workers} slots")
+    run_sync(backend.work())
@@ -0,0 +1,226 @@
+"""Process metrics in the Prometheus text format, and per-request profiling.
+
+Counters, gauges and histograms are kept in memory and rendered by
+`GET /metrics`. The scrape and export paths time their stages with
+`histogram.time(**labels)`. Values that other modules already track, such
+as cache counters and per-host rates, are read when /metrics is rendered
+instead of being copied on every update.
+
+With SCRAPER_PROFILING=1, a request with `?profile=1` is run under cProfile.
+The response is replaced by the top functions by cumulative time. Scrapes
+run on the shared scraping loop, so that thread is profiled for the length
+of the request as well as the request thread. One request is profiled at a
+time; others asking for a profile get 409 until it finishes.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILING_ENABLED = os.environ.get('SCRAPER_PROFILING', '0') == '1'
+
+# Seconds; covers a cached parse up to a slow page fetch with retries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = []
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        # function() -> {label values tuple: value}, read at render time
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, key, (), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, key, extra, value in self.samples():
+            lines.append(f'{name}{format_labels(self.label_names, key, extra)} {format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count something as in progress for the duration of a with block"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [count per bucket..., sum]
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long a with block took, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f'{self.name}_bucket', key, (('le', format_value(bound)),), cumulative
+            yield f'{self.name}_sum', key, (), state[-1]
+            yield f'{self.name}_count', key, (), cumulative
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in _metrics) + '\n'
+
+
+FETCH_SECONDS = Histogram('scraper_fetch_seconds', 'Time of one HTTP request to a site, per host', ['host'])
+FETCH_RESPONSES = Counter('scraper_fetch_responses_total', 'Site responses and transport errors, per host and outcome', ['host', 'outcome'])
+PARSE_SECONDS = Histogram('scraper_parse_seconds', 'Time to parse one fetched page, including the wait for a parse worker', ['site'])
+SCRAPE_SECONDS = Histogram('scraper_scrape_seconds', 'Time of a whole product scrape, from the first request to the last page', ['site'], buckets=DEFAULT_BUCKETS + (60, 120, 300, 600))
+SCRAPED_REVIEWS = Counter('scraper_reviews_scraped_total', 'Reviews scraped, per site', ['site'])
+FAILED_PAGES = Counter('scraper_failed_pages_total', 'Review pages skipped after their fetch or parse failed, per site', ['site'])
+DB_WRITE_SECONDS = Histogram('scraper_db_write_seconds', 'Time of one MongoDB bulk write of saved reviews')
+DB_WRITTEN_REVIEWS = Counter('scraper_db_reviews_total', 'Reviews passed to MongoDB saves, per result', ['result'])
+EXPORT_SECONDS = Histogram('scraper_export_seconds', 'Time to produce a whole export, per format', ['format'], buckets=DEFAULT_BUCKETS + (60, 120, 300))
+EXPORT_ROWS = Counter('scraper_export_rows_total', 'Rows written to exports, per format', ['format'])
+ACTIVE_JOBS = Gauge('scraper_active_jobs', 'Background scrapes running now, per kind (job or batch product)', ['kind'])
+
+
+# From 3.12 cProfile sees every thread, and only one profiler may be active at a time
+PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+_profile_lock = threading.Lock()
+
+
+class RequestProfiler:
+    """cProfile of the current thread and the shared scraping loop thread"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.profile = cProfile.Profile()
+        # Before 3.12 profiling is per thread, so the loop thread needs its own profiler
+        self.loop_profile = None if PROFILES_ALL_THREADS else cProfile.Profile()
+
+    def _on_loop(self, function):
+        async def call():
+            function()
+        asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+    def _disable(self):
+        self.profile.disable()
+        if self.loop_profile is not None:
+            self._on_loop(self.loop_profile.disable)
+
+    def start(self):
+        """Start profiling; returns False while another request is being profiled"""
+        if not _profile_lock.acquire(blocking=False):
+            return False
+        try:
+            if self.loop_profile is not None:
+                self._on_loop(self.loop_profile.enable)
+            self.profile.enable()
+        except BaseException:
+            try:
+                self._disable()
+            finally:
+                _profile_lock.release()
+            raise
+        return True
+
+    def stop(self, limit=50):
+        """Stop profiling; returns the top `limit` functions by cumulative time as text"""
+        try:
+            self._disable()
+        finally:
+            _profile_lock.release()
+        output = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=output)
+        if self.loop_profile is not None:
+            try:
+                stats.add(self.loop_profile)
+            except TypeError:
+                # Nothing ran on the scraping loop during the request
+                pass
+        stats.sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
@@ -0,0 +1,124 @@
+"""HTML parser layer used by the site scrapers.
+
+Pages are parsed with selectolax when it is installed, otherwise with
+BeautifulSoup on the lxml tree builder. With BeautifulSoup a strainer limits
+tree building to the review containers the scrapers actually read. CSS
+selectors are compiled once, at import time, through `Selector`.
+
+Parsing is CPU-bound, so the scrapers run it in a process pool (the parse
+stage) while the event loop keeps fetching. Workers receive raw page bytes
+and return compact row tuples.
+
+Set SCRAPER_HTML_PARSER=selectolax|lxml|html.parser to force a backend and
+SCRAPER_PARSE_WORKERS to size the pool (0 parses inline on the event loop).
+"""
+import asyncio
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import soupsieve
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+DEFAULT_BACKEND = os.environ.get('SCRAPER_HTML_PARSER') or ('selectolax' if HTMLParser else 'lxml')
+
+PARSE_WORKERS = int(os.environ.get('SCRAPER_PARSE_WORKERS', os.cpu_count() or 1))
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+class AnyOf(SoupStrainer):
+    """Keeps a tag, with everything inside it, when any of `strainers` matches it"""
+
+    def __init__(self, *strainers):
+        super().__init__()
+        self.strainers = strainers
+
+    @property
+    def includes_everything(self):
+        return False
+
+    @property
+    def excludes_everything(self):
+        return False
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return any(strainer.allow_tag_creation(nsprefix, name, attrs) for strainer in self.strainers)
+
+    def allow_string_creation(self, string):
+        return False
+
+
+def class_strainer(*classes, name=None):
+    """Strainer matching tags that carry any of `classes` (raw class attributes are unsplit)"""
+    pattern = re.compile(r'(^|\s)(%s)(\s|$)' % '|'.join(re.escape(c) for c in classes))
+    return SoupStrainer(name, class_=pattern)
+
+
+def parse_html(content, strainer=None, backend=None):
+    """Parse page bytes; `strainer` limits what BeautifulSoup builds (selectolax ignores it)"""
+    backend = backend or DEFAULT_BACKEND
+    if backend == 'selectolax' and HTMLParser is not None:
+        return HTMLParser(content)
+    if backend == 'selectolax':
+        backend = 'lxml'
+    return BeautifulSoup(content, backend, parse_only=strainer)
+
+
+class Selector:
+    """A CSS selector compiled once and usable on either parser's nodes"""
+
+    def __init__(self, css):
+        self.css = css
+        self._compiled = soupsieve.compile(css)
+
+    def select(self, node):
+        if isinstance(node, Tag):
+            return self._compiled.select(node)
+        return node.css(self.css)
+
+    def first(self, node):
+        if isinstance(node, Tag):
+            return self._compiled.select_one(node)
+        return node.css_first(self.css)
+
+
+def text(node):
+    if isinstance(node, Tag):
+        return node.get_text()
+    return node.text()
+
+
+def attr(node, name, default=None):
+    if isinstance(node, Tag):
+        value = node.get(name, default)
+        return ' '.join(value) if isinstance(value, list) else value
+    return node.attributes.get(name, default)
+
+
+def get_parse_pool():
+    """Return the shared parse worker pool, starting it on first use"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn, because the scraping process already runs an event loop thread
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _parse_pool
+
+
+async def run_parser(parse, *args):
+    """Run a module-level parse function in the parse stage without blocking the event loop"""
+    if PARSE_WORKERS <= 0:
+        return parse(*args)
+    return await asyncio.get_running_loop().run_in_executor(get_parse_pool(), parse, *args)
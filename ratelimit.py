@@ -0,0 +1,156 @@
+"""Adaptive per-host rate limiting.
+
+Each host gets a token bucket whose refill rate adapts with AIMD: every
+successful response nudges the rate up by a fixed step (additive increase),
+and every 429/503 or CAPTCHA page halves it (multiplicative decrease). A
+throttled host also gets a backoff window with jitter, or whatever its
+Retry-After header asks for if that is longer. During that window no
+request is sent to the host. Throughput therefore settles close to what each
+site tolerates, rather than a fixed pace that is too slow when the site is
+healthy and too fast when it is pushing back.
+"""
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+# A host's rate moves between base * MIN_RATE_FACTOR and base * MAX_RATE_FACTOR
+MIN_RATE_FACTOR = 0.05
+MAX_RATE_FACTOR = 4.0
+
+# Additive increase per success, as a fraction of the base rate; multiplicative decrease per block
+INCREASE_STEP = 0.05
+DECREASE_FACTOR = 0.5
+
+# Seconds of burst a bucket can save up
+BURST_SECONDS = 1.0
+
+# Backoff after consecutive blocks doubles from BASE_BACKOFF up to MAX_BACKOFF
+BASE_BACKOFF = 2.0
+MAX_BACKOFF = 300.0
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HostBucket:
+    def __init__(self, rate):
+        self.base_rate = rate
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.strikes = 0
+        self.counters = {'requests': 0, 'successes': 0, 'throttled': 0, 'captchas': 0}
+
+    @property
+    def unlimited(self):
+        return not self.rate or self.rate == float('inf')
+
+    def refill(self, now):
+        capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class AdaptiveRateLimiter:
+    """Token bucket per host with AIMD rate adaptation and backoff on blocks (shared loop only)"""
+
+    def __init__(self, rates=None, default_rate=2.0):
+        self.rates = dict(rates or {})
+        self.default_rate = default_rate
+        self._buckets = {}
+
+    def bucket(self, host):
+        if host not in self._buckets:
+            self._buckets[host] = HostBucket(self.rates.get(host, self.default_rate))
+        return self._buckets[host]
+
+    def set_rate(self, host, rate):
+        """Set the base rate of a host (inf disables limiting for it)"""
+        self.rates[host] = rate
+        self._buckets[host] = HostBucket(rate)
+
+    async def acquire(self, host):
+        """Wait until a request to `host` fits its budget and no backoff is in force"""
+        bucket = self.bucket(host)
+        bucket.counters['requests'] += 1
+        if bucket.unlimited:
+            return
+
+        # Take a token now, going into debt if there is none; the debt is the wait
+        now = time.monotonic()
+        bucket.refill(now)
+        bucket.tokens -= 1.0
+        wait = max(bucket.blocked_until - now, 0.0, -bucket.tokens / bucket.rate)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def succeeded(self, host):
+        bucket = self.bucket(host)
+        bucket.counters['successes'] += 1
+        bucket.strikes = 0
+        if not bucket.unlimited:
+            bucket.rate = min(bucket.rate + bucket.base_rate * INCREASE_STEP, bucket.base_rate * MAX_RATE_FACTOR)
+
+    def blocked(self, host, retry_after=None, captcha=False):
+        """Record a 429/503 or CAPTCHA from `host`: halve its rate and back off"""
+        bucket = self.bucket(host)
+        bucket.counters['captchas' if captcha else 'throttled'] += 1
+        if bucket.unlimited:
+            return
+
+        now = time.monotonic()
+        if now < bucket.blocked_until:
+            # Requests that were already in flight when the host pushed back: one decrease is enough
+            if retry_after is not None:
+                bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+            return
+
+        bucket.refill(now)
+        bucket.rate = max(bucket.rate * DECREASE_FACTOR, bucket.base_rate * MIN_RATE_FACTOR)
+        bucket.tokens = min(bucket.tokens, 0.0)
+        bucket.strikes += 1
+
+        # Jitter keeps concurrent scrapes of the host from all retrying at the same moment
+        backoff = min(BASE_BACKOFF * 2 ** (bucket.strikes - 1), MAX_BACKOFF) * random.uniform(0.5, 1.0)
+        if retry_after is not None:
+            backoff = max(backoff, retry_after)
+        bucket.blocked_until = now + backoff
+
+    def current_rate(self, host):
+        bucket = self.bucket(host)
+        return None if bucket.unlimited else bucket.rate
+
+    def restore(self, host, rate):
+        """Start a host at a rate learned by an earlier process, unless it has live state already"""
+        bucket = self.bucket(host)
+        if bucket.unlimited or bucket.counters['requests'] or not rate:
+            return
+        bucket.rate = min(max(rate, bucket.base_rate * MIN_RATE_FACTOR), bucket.base_rate * MAX_RATE_FACTOR)
+
+    def stats(self):
+        """Current rate, backoff and block counts per host"""
+        now = time.monotonic()
+        return {
+            host: dict(
+                bucket.counters,
+                rate=None if bucket.unlimited else round(bucket.rate, 3),
+                base_rate=None if bucket.unlimited else bucket.base_rate,
+                backoff_seconds=round(max(bucket.blocked_until - now, 0.0), 1),
+            )
+            for host, bucket in list(self._buckets.items())
+        }
@@ -0,0 +1,183 @@
+"""Rating aggregates kept up to date as reviews are saved.
+
+Every save adds its new reviews to one stats document per product and one
+per site, with `$inc` updates. Each document holds:
+
+* the review count
+* the count and sum of rated reviews
+* a 1-5 star histogram
+* per-day counts and rating sums
+
+A review whose rating changes moves between stars. Reading a product's
+stats is then one lookup by `_id`, however many reviews it has.
+
+Stats are derived data: a save whose stats update fails still stores the
+reviews, and `python review_stats.py rebuild` recomputes every aggregate
+from the reviews collection.
+"""
+import sys
+from datetime import datetime
+
+STARS = ('1', '2', '3', '4', '5')
+
+
+def stats_collection(reviews_collection):
+    """The stats collection that goes with a reviews collection"""
+    return reviews_collection.database[f'{reviews_collection.name}_stats']
+
+
+def stats_id(website, product_id=None):
+    return f'{website}:{product_id}' if product_id is not None else website
+
+
+def star(rating):
+    """'1'..'5' for a rating, or None for a missing (0) or unreadable one"""
+    try:
+        rating = float(rating)
+    except (TypeError, ValueError):
+        return None
+    if rating <= 0:
+        return None
+    return str(min(max(int(rating + 0.5), 1), 5))
+
+
+def day(review_date):
+    return review_date.strftime('%Y-%m-%d') if isinstance(review_date, datetime) else None
+
+
+def add_inc(inc, field, amount):
+    inc[field] = inc.get(field, 0) + amount
+
+
+def stat_updates(added, rerated):
+    """$inc and $set per stats document for new reviews and reviews whose rating changed.
+
+    Reviews are dicts with website, product_id, product, rating and
+    review_date; `rerated` holds (review, previous rating) pairs.
+    """
+    updates = {}
+
+    def update(review):
+        for key in (stats_id(review['website'], review['product_id']), stats_id(review['website'])):
+            if key not in updates:
+                updates[key] = {'$inc': {}, '$set': {'updated_at': datetime.now()}}
+                if ':' in key:
+                    updates[key]['$set'].update(scope='product', website=review['website'], product_id=review['product_id'], product=review.get('product'))
+                else:
+                    updates[key]['$set'].update(scope='site', website=review['website'])
+            yield updates[key]['$inc']
+
+    for review in added:
+        stars = star(review.get('rating'))
+        date = day(review.get('review_date'))
+        for inc in update(review):
+            add_inc(inc, 'count', 1)
+            if date:
+                add_inc(inc, f'days.{date}.count', 1)
+            if stars:
+                add_inc(inc, 'rated', 1)
+                add_inc(inc, 'rating_sum', float(review['rating']))
+                add_inc(inc, f'stars.{stars}', 1)
+                if date:
+                    add_inc(inc, f'days.{date}.rated', 1)
+                    add_inc(inc, f'days.{date}.rating_sum', float(review['rating']))
+
+    for review, previous in rerated:
+        old, new = star(previous), star(review.get('rating'))
+        date = day(review.get('review_date'))
+        for inc in update(review):
+            for stars, rating, sign in ((old, previous, -1), (new, review.get('rating'), 1)):
+                if not stars:
+                    continue
+                add_inc(inc, 'rated', sign)
+                add_inc(inc, 'rating_sum', sign * float(rating))
+                add_inc(inc, f'stars.{stars}', sign)
+                if date:
+                    add_inc(inc, f'days.{date}.rated', sign)
+                    add_inc(inc, f'days.{date}.rating_sum', sign * float(rating))
+
+    return updates
+
+
+def update_stats(collection, added, rerated=()):
+    """Apply saved reviews to the stats collection; failures are printed, never raised"""
+    from pymongo import UpdateOne
+
+    updates = stat_updates(added, rerated)
+    if not updates:
+        return
+    operations = [UpdateOne({'_id': key}, update, upsert=True) for key, update in updates.items()]
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except Exception as e:
+        print(f"Error updating review stats (run `python review_stats.py rebuild` to repair): {str(e)}")
+
+
+def format_stats(doc):
+    """Public view of a stats document"""
+    rated = doc.get('rated', 0)
+    days = []
+    for date, bucket in sorted(doc.get('days', {}).items()):
+        days.append({
+            'date': date,
+            'count': bucket.get('count', 0),
+            'average_rating': bucket['rating_sum'] / bucket['rated'] if bucket.get('rated') else None,
+        })
+    stats = {
+        'website': doc.get('website'),
+        'count': doc.get('count', 0),
+        'rated': rated,
+        'average_rating': doc.get('rating_sum', 0) / rated if rated else None,
+        'stars': {stars: doc.get('stars', {}).get(stars, 0) for stars in STARS},
+        'daily': days,
+        'updated_at': doc.get('updated_at'),
+    }
+    if doc.get('scope') == 'product':
+        stats.update(product_id=doc.get('product_id'), product=doc.get('product'))
+        # Set by `python analytics.py run`
+        if 'keywords' in doc:
+            stats['keywords'] = doc['keywords']
+    return stats
+
+
+def get_stats(collection, website=None, product_id=None):
+    """Stats of one product (site optional) or of a whole site; None when nothing is stored"""
+    if product_id is None:
+        doc = collection.find_one({'_id': website.lower()})
+    elif website:
+        doc = collection.find_one({'_id': stats_id(website.lower(), product_id)})
+    else:
+        doc = collection.find_one({'scope': 'product', 'product_id': product_id})
+    return format_stats(doc) if doc else None
+
+
+def ensure_stats_indexes(collection):
+    # Product lookups without a site
+    collection.create_index([('product_id', 1)], name='product_id', partialFilterExpression={'scope': 'product'})
+
+
+def rebuild_stats(reviews_collection):
+    """Recompute every aggregate from the stored reviews; returns the number of stats documents"""
+    collection = stats_collection(reviews_collection)
+    collection.delete_many({})
+    batch = []
+    projection = {'_id': 0, 'website': 1, 'product_id': 1, 'product': 1, 'rating': 1, 'review_date': 1}
+    for review in reviews_collection.find({'content_hash': {'$exists': True}}, projection, batch_size=1000):
+        batch.append(review)
+        if len(batch) >= 1000:
+            update_stats(collection, batch)
+            batch = []
+    if batch:
+        update_stats(collection, batch)
+    ensure_stats_indexes(collection)
+    return collection.count_documents({})
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] != ['rebuild']:
+        print("Usage: python review_stats.py rebuild")
+        sys.exit(1)
+
+    from database import get_collection
+
+    print(f"Rebuilt {rebuild_stats(get_collection())} stats documents")
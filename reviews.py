@@ -0,0 +1,186 @@
+"""Compact in-memory reviews.
+
+A scrape used to hold every review as an eight-key dict, so a 100k-review
+job was mostly dict overhead. It now holds a ReviewBatch, which stores
+each field as one list (a column). Product names, product IDs and site
+names repeat on every row, so a batch keeps a single copy of each
+distinct value and the rows point at it. Iterating a batch or indexing it
+gives Review records. These are slotted and answer `get()` and `[]` like
+the dicts they replace, so the database, stats and export code accepts
+either.
+
+Consumers that can read columns do so without building per-review
+objects:
+
+* parsers and the API extractor hand over columns, not per-review dicts
+* collect_reviews extends a batch column by column
+* the background writer queues and splits whole batches
+* exports read rows straight from the columns
+* JSON text is written directly from the columns, encoding each shared
+  product and site string once, and JSON responses stream it in chunks
+
+Reviews are never mutated after they are scraped. Saving builds its own
+MongoDB documents from them.
+"""
+import itertools
+import json
+from dataclasses import dataclass
+from typing import Optional
+
+REVIEW_FIELDS = ('product', 'product_id', 'user', 'rating', 'title', 'comment', 'date', 'website')
+
+# Columns with few distinct values, stored once per batch
+SHARED_FIELDS = ('product', 'product_id', 'website')
+
+# Reviews per piece of a streamed JSON array
+JSON_CHUNK_REVIEWS = 1000
+
+_encode = json.JSONEncoder(default=str).encode
+
+
+@dataclass(slots=True)
+class Review:
+    product: Optional[str] = None
+    product_id: Optional[str] = None
+    user: Optional[str] = None
+    rating: Optional[float] = None
+    title: Optional[str] = None
+    comment: Optional[str] = None
+    date: Optional[str] = None
+    website: Optional[str] = None
+
+    def get(self, field, default=None):
+        # Like the scraped dicts, every review field is present, even when None
+        return getattr(self, field) if field in REVIEW_FIELDS else default
+
+    def __getitem__(self, field):
+        if field not in REVIEW_FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def keys(self):
+        return REVIEW_FIELDS
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in REVIEW_FIELDS}
+
+
+class ReviewBatch:
+    """Reviews stored column by column, with one copy of each shared value"""
+
+    __slots__ = ('columns', '_shared')
+
+    def __init__(self, reviews=()):
+        self.columns = {field: [] for field in REVIEW_FIELDS}
+        self._shared = {}
+        self.extend(reviews)
+
+    @classmethod
+    def from_columns(cls, columns, **constants):
+        """A batch from a list of values per field, with the other fields set from `constants`"""
+        batch = cls()
+        length = max(map(len, columns.values()), default=0)
+        for field, values in columns.items():
+            batch._extend_column(field, values)
+        for field, value in constants.items():
+            batch.columns[field].extend([batch._share(value)] * length)
+        batch._pad()
+        return batch
+
+    @classmethod
+    def from_rows(cls, rows, fields, **constants):
+        """A batch from tuples of `fields` (as the parsers return them), with the other fields set from `constants`"""
+        return cls.from_columns(dict(zip(fields, zip(*rows))), **constants)
+
+    def _share(self, value):
+        if value is None:
+            return None
+        return self._shared.setdefault(value, value)
+
+    def _extend_column(self, field, values):
+        if field in SHARED_FIELDS:
+            values = map(self._share, values)
+        self.columns[field].extend(values)
+
+    def _pad(self):
+        # Fields missing from what was added are None
+        length = max(len(column) for column in self.columns.values())
+        for column in self.columns.values():
+            column.extend([None] * (length - len(column)))
+
+    def __len__(self):
+        return len(self.columns['product'])
+
+    def extend(self, reviews):
+        """Append another batch column by column, or any review dicts or Reviews one by one"""
+        if isinstance(reviews, ReviewBatch):
+            for field in REVIEW_FIELDS:
+                self._extend_column(field, reviews.columns[field])
+            return
+        for review in reviews:
+            for field in REVIEW_FIELDS:
+                value = review.get(field)
+                self.columns[field].append(self._share(value) if field in SHARED_FIELDS else value)
+
+    def append(self, review):
+        self.extend([review])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            batch = ReviewBatch()
+            for field in REVIEW_FIELDS:
+                batch._extend_column(field, self.columns[field][index])
+            return batch
+        return Review(*(self.columns[field][index] for field in REVIEW_FIELDS))
+
+    def __iter__(self):
+        for values in zip(*(self.columns[field] for field in REVIEW_FIELDS)):
+            yield Review(*values)
+
+    def __repr__(self):
+        return f'<ReviewBatch of {len(self)} reviews>'
+
+    def rows(self, columns):
+        """Lists of the (field, default) `columns` of every review; the default stands in for fields reviews lack"""
+        return map(list, zip(*(self.columns.get(field) or itertools.repeat(default, len(self)) for field, default in columns)))
+
+    def iter_dicts(self):
+        for values in zip(*(self.columns[field] for field in REVIEW_FIELDS)):
+            yield dict(zip(REVIEW_FIELDS, values))
+
+    def iter_json(self):
+        """JSON object text of each review, built from the columns"""
+        encoded = {}
+
+        def shared(value):
+            if value not in encoded:
+                encoded[value] = _encode(value)
+            return encoded[value]
+
+        keys = [_encode(field) + ': ' for field in REVIEW_FIELDS]
+        encoders = [shared if field in SHARED_FIELDS else _encode for field in REVIEW_FIELDS]
+        for values in zip(*(self.columns[field] for field in REVIEW_FIELDS)):
+            yield '{' + ', '.join(key + encode(value) for key, encode, value in zip(keys, encoders, values)) + '}'
+
+    def to_json(self):
+        return '[' + ', '.join(self.iter_json()) + ']'
+
+    def iter_json_chunks(self, size=JSON_CHUNK_REVIEWS):
+        """to_json() text in pieces of up to `size` reviews, for streamed responses"""
+        reviews = self.iter_json()
+        yield '['
+        separator = ''
+        while True:
+            chunk = ', '.join(itertools.islice(reviews, size))
+            if not chunk:
+                break
+            yield separator + chunk
+            separator = ', '
+        yield ']'
+
+
+def reviews_json(reviews):
+    """JSON text of a ReviewBatch or a list of review dicts"""
+    if isinstance(reviews, ReviewBatch):
+        return reviews.to_json()
+    return json.dumps(reviews, default=str)
@@ -1,130 +1,215 @@
-from bs4 import BeautifulSoup
-import requests
-import re
-import time
-
-def get_soup(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
+from contextlib import aclosing
+
+from circuit import CircuitOpenError
+from fetcher import browser_headers, fetch, fetch_pages, iter_sync, run_sync
+from metrics import FAILED_PAGES, PARSE_SECONDS, SCRAPED_REVIEWS, SCRAPE_SECONDS
+from parsers import run_parser
+from reviews import ReviewBatch
+from sites import REVIEW_ROW_FIELDS, SITES, get_site, parse_listing, worker_site
+
+async def get_page_async(url):
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return BeautifulSoup(response.content, 'html.parser')
+        return await fetch(url, headers=browser_headers(), detect_block=True)
     except Exception as e:
-        raise Exception(f"Error fetching page: {str(e)}")
-
-def scrape_flipkart_reviews(product_url, max_reviews=10):
-    reviews = []
-    page = 1
-    
-    # Extract product ID from URL
-    match = re.search(r'pid=([A-Z0-9]+)', product_url)
-    if not match:
-        raise Exception("Invalid Flipkart product URL")
-    
-    product_id = match.group(1)
-    base_url = f"https://www.flipkart.com/api/3/product/reviews?productId={product_id}"
-    
-    while len(reviews) < max_reviews:
-        url = f"{base_url}&page={page}&limit=10"
-        
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'X-User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 FKUA/website/41/website/Desktop'
-            }
-            
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            if not data or 'RESPONSE' not in data:
-                break
-                
-            for review_data in data['RESPONSE']['data']:
-                if len(reviews) >= max_reviews:
+        raise Exception(f"Error fetching page: {str(e)}") from e
+
+async def parse_page(response, parse, *args):
+    """Run `parse` on a fetched page, reusing the result if this body was parsed before"""
+    key = (parse.__name__,) + args
+    if key not in response.parsed:
+        response.parsed[key] = await run_parser(parse, response.content, *args)
+    return response.parsed[key]
+
+def make_reviews(product_name, rows, website, product_id=None):
+    return ReviewBatch.from_rows(rows, REVIEW_ROW_FIELDS, product=product_name, product_id=product_id, website=website)
+
+# A scrape gives up after this many pages in a row fail (each already retried by fetch)
+MAX_CONSECUTIVE_FAILED_PAGES = 3
+
+def record_failure(failures, page, url, error):
+    """Note a page that could not be scraped, so the scrape returns partial results"""
+    print(f"Failed to scrape page {page} ({url}): {str(error)}")
+    failures.append({'page': page, 'url': url, 'error': str(error)})
+
+async def iter_api_reviews(site, product_id, max_reviews, concurrency, newest_first, failures, start_page, on_page):
+    """Page through a JSON reviews API, several pages in flight at a time"""
+    api = site.api
+    collected = 0
+    failed_in_a_row = 0
+
+    # Never keep more pages in flight than max_reviews can use
+    pages_needed = -(-max_reviews // api.page_size)
+    concurrency = max(1, min(concurrency, pages_needed))
+
+    def page_url(page):
+        return site.page_url(api, product_id, page, newest_first)
+
+    pages = fetch_pages(page_url, concurrency=concurrency, headers=api.headers, return_exceptions=True, start_page=start_page)
+    async with aclosing(pages):
+        async for page, response in pages:
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                with PARSE_SECONDS.time(site=site.name):
+                    data = response.json()
+            except Exception as e:
+                record_failure(failures, page, page_url(page), e)
+                failed_in_a_row += 1
+                # A site that is down fails every page the same way; stop instead of walking them all
+                if isinstance(e, CircuitOpenError) or failed_in_a_row >= MAX_CONSECUTIVE_FAILED_PAGES:
                     break
-                    
-                review = {
-                    'product': review_data.get('product', {}).get('product_name', 'N/A'),
-                    'user': review_data.get('author', {}).get('name', 'Anonymous'),
-                    'rating': review_data.get('rating', 0),
-                    'title': review_data.get('title', 'No Title'),
-                    'comment': review_data.get('text', 'No Comment'),
-                    'date': review_data.get('created', 'N/A'),
-                    'website': 'flipkart'
-                }
-                reviews.append(review)
-                
-            if not data['RESPONSE'].get('next_page', False):
+                continue
+            failed_in_a_row = 0
+
+            if not data or not api.has_items(data):
                 break
-                
-            page += 1
-            time.sleep(1)  # Be polite to the server
-            
+
+            batch = ReviewBatch.from_columns(api.columns(data, max_reviews - collected), product_id=product_id, website=site.name)
+
+            collected += len(batch)
+            if on_page:
+                on_page(page, batch)
+            yield batch
+
+            if collected >= max_reviews or not api.has_next(data):
+                break
+
+async def iter_listing_reviews(site, product_id, max_reviews, newest_first, failures, start_page, on_page):
+    """Page through HTML review pages in order until the site says there are no more"""
+    collected = 0
+    failed_in_a_row = 0
+
+    page = start_page
+    while collected < max_reviews:
+        url = site.page_url(site.listing, product_id, page, newest_first)
+        try:
+            response = await get_page_async(url)
+            with PARSE_SECONDS.time(site=site.name):
+                product_name, rows, has_next = await parse_page(response, parse_listing, worker_site(site), 'listing', max_reviews - collected)
         except Exception as e:
-            print(f"Error scraping Flipkart reviews: {str(e)}")
+            record_failure(failures, page, url, e)
+            failed_in_a_row += 1
+            if isinstance(e.__cause__, CircuitOpenError) or failed_in_a_row >= MAX_CONSECUTIVE_FAILED_PAGES:
+                break
+            # Whether there is a next page is unknown; try it
+            page += 1
+            continue
+        failed_in_a_row = 0
+        batch = make_reviews(product_name, rows, site.name, product_id)
+
+        collected += len(batch)
+        if on_page:
+            on_page(page, batch)
+        yield batch
+
+        if not batch or not has_next:
             break
-    
+
+        # Pacing between pages comes from the per-host rate budget in fetcher
+        page += 1
+
+async def scrape_product_page_async(site, product_url, max_reviews=10):
+    """Reviews shown on the product page itself, for URLs without a product ID"""
+    response = await get_page_async(product_url)
+    with PARSE_SECONDS.time(site=site.name):
+        product_name, rows, _ = await parse_page(response, parse_listing, worker_site(site), 'product_page', max_reviews)
+    return make_reviews(product_name, rows, site.name)
+
+async def iter_product_page_reviews(site, product_url, max_reviews, failures):
+    # Product pages without an ID can only be scraped from their HTML
+    try:
+        yield await scrape_product_page_async(site, product_url, max_reviews)
+    except Exception as e:
+        record_failure(failures, 1, product_url, e)
+
+async def iter_site_reviews(site, product_url, max_reviews=10, concurrency=4, newest_first=False, failures=None, start_page=1, on_page=None):
+    """Yield reviews of a product on `site` (a SiteAdapter) one page (a ReviewBatch) at a time.
+
+    Pages that fail are skipped and appended to `failures`. Paging starts at
+    `start_page`, and `on_page(page, batch)` is called for every page scraped.
+    """
+    failures = [] if failures is None else failures
+
+    product_id = site.product_id(product_url)
+    if product_id is None and site.product_page is None:
+        raise Exception(f"Invalid {site.name.capitalize()} product URL")
+
+    if product_id is None:
+        batches = iter_product_page_reviews(site, product_url, max_reviews, failures)
+    elif site.api is not None:
+        batches = iter_api_reviews(site, product_id, max_reviews, concurrency, newest_first, failures, start_page, on_page)
+    else:
+        batches = iter_listing_reviews(site, product_id, max_reviews, newest_first, failures, start_page, on_page)
+
+    failed_before = len(failures)
+    try:
+        with SCRAPE_SECONDS.time(site=site.name):
+            async with aclosing(batches):
+                async for batch in batches:
+                    SCRAPED_REVIEWS.inc(len(batch), site=site.name)
+                    yield batch
+    finally:
+        FAILED_PAGES.inc(len(failures) - failed_before, site=site.name)
+
+def iter_flipkart_reviews(product_url, max_reviews=10, concurrency=4, newest_first=False, failures=None, start_page=1, on_page=None):
+    return iter_site_reviews(SITES['flipkart'], product_url, max_reviews, concurrency, newest_first, failures, start_page, on_page)
+
+def iter_amazon_reviews(product_url, max_reviews=10, newest_first=False, failures=None, start_page=1, on_page=None):
+    return iter_site_reviews(SITES['amazon'], product_url, max_reviews, 1, newest_first, failures, start_page, on_page)
+
+def site_name(website):
+    """Normalise a website name to a registered site such as 'flipkart'; raises ValueError if unsupported"""
+    return get_site(website).name
+
+def iter_reviews(website, product_url, max_reviews=10, newest_first=False, concurrency=4, failures=None, start_page=1, on_page=None):
+    """Page-by-page review generator for `website`; raises ValueError if unsupported.
+
+    Pages that cannot be scraped are skipped and recorded in `failures`.
+    """
+    return iter_site_reviews(get_site(website), product_url, max_reviews, concurrency, newest_first, failures, start_page, on_page)
+
+def site_host(website):
+    """Host the paginated review requests for `website` go to"""
+    return get_site(website).host
+
+def product_id_from_url(website, product_url):
+    """Product ID (Flipkart pid, Amazon ASIN, ...) of a product URL, or None if it has none"""
+    return get_site(website).product_id(product_url)
+
+async def collect_reviews(batches, progress=None):
+    """Drain a page generator into one ReviewBatch.
+
+    `progress(pages_done, reviews_collected)` is called after every page.
+    """
+    reviews = ReviewBatch()
+    pages_done = 0
+    async with aclosing(batches):
+        async for batch in batches:
+            pages_done += 1
+            reviews.extend(batch)
+            if progress:
+                progress(pages_done, len(reviews))
     return reviews
 
+async def scrape_flipkart_reviews_async(product_url, max_reviews=10, concurrency=4, progress=None):
+    return await collect_reviews(iter_flipkart_reviews(product_url, max_reviews, concurrency), progress)
+
+async def scrape_amazon_reviews_async(product_url, max_reviews=10, progress=None):
+    return await collect_reviews(iter_amazon_reviews(product_url, max_reviews), progress)
+
+async def scrape_reviews_async(website, product_url, max_reviews=10, progress=None):
+    return await collect_reviews(iter_reviews(website, product_url, max_reviews), progress)
+
+# Blocking wrappers for callers that are not running an event loop
+def scrape_flipkart_reviews(product_url, max_reviews=10, concurrency=4):
+    return run_sync(scrape_flipkart_reviews_async(product_url, max_reviews, concurrency))
+
 def scrape_amazon_reviews(product_url, max_reviews=10):
-    reviews = []
-    
-    # Extract product ASIN from URL
-    match = re.search(r'/dp/([A-Z0-9]{10})', product_url)
-    if not match:
-        raise Exception("Invalid Amazon product URL")
-    
-    asin = match.group(1)
-    base_url = f"https://www.amazon.in/product-reviews/{asin}"
-    
-    page = 1
-    while len(reviews) < max_reviews:
-        url = f"{base_url}/?pageNumber={page}"
-        soup = get_soup(url)
-        
-        if not soup:
-            break
-            
-        review_elements = soup.find_all('div', {'data-hook': 'review'})
-        
-        if not review_elements:
-            break
-            
-        for review_element in review_elements:
-            if len(reviews) >= max_reviews:
-                break
-                
-            try:
-                user_element = review_element.find('span', class_='a-profile-name')
-                rating_element = review_element.find('i', {'data-hook': 'review-star-rating'})
-                title_element = review_element.find('a', {'data-hook': 'review-title'})
-                comment_element = review_element.find('span', {'data-hook': 'review-body'})
-                date_element = review_element.find('span', {'data-hook': 'review-date'})
-                
-                review = {
-                    'product': soup.title.text.replace('Amazon.in:Customer reviews:', '').strip() if soup.title else 'N/A',
-                    'user': user_element.text.strip() if user_element else 'Anonymous',
-                    'rating': float(rating_element.text.split()[0]) if rating_element else 0,
-                    'title': title_element.text.strip() if title_element else 'No Title',
-                    'comment': comment_element.text.strip() if comment_element else 'No Comment',
-                    'date': date_element.text.split('on')[-1].strip() if date_element else 'N/A',
-                    'website': 'amazon'
-                }
-                reviews.append(review)
-            except Exception as e:
-                print(f"Error parsing Amazon review: {str(e)}")
-                continue
-                
-        # Check if there's a next page
-        next_button = soup.find('li', class_='a-last')
-        if not next_button or 'a-disabled' in next_button.get('class', []):
-            break
-            
-        page += 1
-        time.sleep(2)  # Be polite to the server
-    
-    return reviews
\ No newline at end of file
+    return run_sync(scrape_amazon_reviews_async(product_url, max_reviews))
+
+def scrape_reviews(website, product_url, max_reviews=10):
+    return run_sync(scrape_reviews_async(website, product_url, max_reviews))
+
+def iter_reviews_sync(website, product_url, max_reviews=10):
+    """Blocking page-by-page generator, e.g. for streaming HTTP responses"""
+    return iter_sync(iter_reviews(website, product_url, max_reviews))
@@ -0,0 +1,365 @@
+"""Site adapters.
+
+Every supported site is described by one declarative spec, which gives:
+
+* the hosts the site serves
+* how to find the product ID in a product URL
+* how to build the URL of each page of reviews, and how paging ends
+* where each review field lives: CSS selectors for HTML pages, key paths
+  for JSON APIs
+
+A spec can describe three sources. `api` is a paginated JSON endpoint,
+fetched several pages at a time. `listing` is paginated HTML review pages,
+fetched in order until there is no next page. `product_page` is the HTML of
+the product URL itself, used when the URL has no product ID. Specs are
+compiled once at import into the SiteAdapter objects in SITES. The fetch
+pipeline in scrapper.py drives every adapter the same way, so adding a site
+means adding a spec and calling register().
+
+Parse workers are spawned processes that only know the sites this module
+registers on import. Pages of a site registered anywhere else carry its
+spec to the worker (see worker_site), which compiles it once.
+
+Sites change their markup, so a field can list several candidate
+selectors. Each compiled field remembers which candidate matched last and
+tries it first. A page then usually costs one probe per field instead of a
+walk down the list.
+"""
+import itertools
+import re
+from urllib.parse import urlsplit
+
+from bs4 import SoupStrainer
+
+from parsers import AnyOf, Selector, attr, class_strainer, parse_html, text
+
+# Parsers return compact (user, rating, title, comment, date) rows so that
+# results coming back from the parse worker processes are cheap to pickle
+REVIEW_ROW_FIELDS = ('user', 'rating', 'title', 'comment', 'date')
+
+
+def leading_number(value):
+    """First number in a rating text such as '4.0 out of 5 stars'"""
+    match = re.search(r'\d+(?:\.\d+)?', value)
+    if not match:
+        raise ValueError(f"No number in {value!r}")
+    return float(match.group())
+
+
+def after_on(value):
+    """The date part of 'Reviewed in India on 1 March 2023'"""
+    return value.rsplit(' on ', 1)[-1].strip()
+
+
+def amazon_product_name(value):
+    return value.replace('Amazon.in:Customer reviews:', '').strip()
+
+
+FLIPKART = {
+    'name': 'flipkart',
+    'hosts': r'(^|\.)flipkart\.com$',
+    'product_id': r'pid=([A-Z0-9]+)',
+    'base_url': 'https://www.flipkart.com/api/3/product/reviews',
+    'api': {
+        'page_url': '{base_url}?productId={product_id}{sort}&page={page}&limit={page_size}',
+        'newest_first': '&sortOrder=MOST_RECENT',
+        'page_size': 10,
+        'headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'X-User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 FKUA/website/41/website/Desktop'
+        },
+        'items': 'RESPONSE.data',
+        'has_next': 'RESPONSE.next_page',
+        'fields': {
+            'product': ('product.product_name', 'N/A'),
+            'user': ('author.name', 'Anonymous'),
+            'rating': ('rating', 0),
+            'title': ('title', 'No Title'),
+            'comment': ('text', 'No Comment'),
+            'date': ('created', 'N/A'),
+        },
+    },
+    'product_page': {
+        'reviews': [
+            'div._1AtVbE',  # New Flipkart selector
+            'div._27M-vq',  # Alternative selector
+            'div.t-ZTKy',   # Comment text
+            'div._1PBCrt',  # Review card
+        ],
+        'product': {'css': ['span.VU-ZEz', 'span.B_NuCI', 'h1._2NKhZn', 'span._35KyD6'], 'default': 'Unknown Product'},
+        'fields': {
+            'user': {'css': ['p._2sc7ZR'], 'default': 'Anonymous'},
+            'rating': {'css': ['div._3LWZlK'], 'clean': leading_number, 'default': 0},
+            'title': {'css': ['p._2-N8zT'], 'default': 'No title'},
+            'comment': {'css': ['div.t-ZTKy'], 'default': 'No comment'},
+            'date': {'default': 'N/A'},
+        },
+        # Only the review cards and product name are built into the tree
+        'strainer': class_strainer('_1AtVbE', '_27M-vq', 't-ZTKy', '_1PBCrt', 'VU-ZEz', 'B_NuCI', '_2NKhZn', '_35KyD6'),
+    },
+}
+
+AMAZON = {
+    'name': 'amazon',
+    'hosts': r'(^|\.)amazon\.[a-z.]+$',
+    'product_id': r'/dp/([A-Z0-9]{10})',
+    'base_url': 'https://www.amazon.in/product-reviews',
+    'listing': {
+        'page_url': '{base_url}/{product_id}/?pageNumber={page}{sort}',
+        'newest_first': '&sortBy=recent',
+        'reviews': ['div[data-hook="review"]'],
+        'product': {'css': ['title'], 'clean': amazon_product_name, 'default': 'N/A'},
+        'fields': {
+            'user': {'css': ['span.a-profile-name'], 'default': 'Anonymous'},
+            'rating': {'css': ['i[data-hook="review-star-rating"]'], 'clean': leading_number, 'default': 0},
+            # The title anchor also holds the star rating text in a classed span
+            'title': {'css': ['a[data-hook="review-title"] span:not([class])', 'a[data-hook="review-title"]'], 'default': 'No Title'},
+            'comment': {'css': ['span[data-hook="review-body"]'], 'default': 'No Comment'},
+            'date': {'css': ['span[data-hook="review-date"]'], 'clean': after_on, 'default': 'N/A'},
+        },
+        'next': {'css': 'li.a-last', 'disabled_class': 'a-disabled'},
+        'strainer': AnyOf(
+            SoupStrainer('title'),
+            SoupStrainer(attrs={'data-hook': 'review'}),
+            class_strainer('a-last', name='li'),
+        ),
+    },
+}
+
+
+class FallbackSelector:
+    """Candidate selectors for one field, tried starting with the one that matched last"""
+
+    def __init__(self, candidates):
+        self.selectors = [Selector(css) for css in candidates]
+        self.preferred = 0
+
+    def _ordered(self):
+        yield self.preferred, self.selectors[self.preferred]
+        for i, selector in enumerate(self.selectors):
+            if i != self.preferred:
+                yield i, selector
+
+    def select(self, node):
+        for i, selector in self._ordered():
+            found = selector.select(node)
+            if found:
+                self.preferred = i
+                return found
+        return []
+
+    def first(self, node):
+        for i, selector in self._ordered():
+            found = selector.first(node)
+            if found is not None:
+                self.preferred = i
+                return found
+        return None
+
+
+class HtmlField:
+    def __init__(self, spec):
+        self.selector = FallbackSelector(spec['css']) if spec.get('css') else None
+        self.clean = spec.get('clean')
+        self.default = spec.get('default')
+
+    def extract(self, node):
+        element = self.selector.first(node) if self.selector else None
+        if element is None:
+            return self.default
+        value = text(element).strip()
+        if self.clean:
+            try:
+                return self.clean(value)
+            except ValueError:
+                return self.default
+        return value
+
+
+class HtmlExtractor:
+    """Compiled `listing` or `product_page` spec"""
+
+    def __init__(self, spec):
+        self.page_url = spec.get('page_url')
+        self.newest_first = spec.get('newest_first', '')
+        self.reviews = FallbackSelector(spec['reviews'])
+        self.product = HtmlField(spec['product'])
+        self.fields = [HtmlField(spec['fields'][name]) for name in REVIEW_ROW_FIELDS]
+        self.next = Selector(spec['next']['css']) if spec.get('next') else None
+        self.next_disabled = spec['next'].get('disabled_class') if spec.get('next') else None
+        self.strainer = spec.get('strainer')
+
+    def parse(self, content, max_reviews=10, backend=None):
+        """Extract reviews from a page; returns (product_name, rows, has_next_page)"""
+        root = parse_html(content, self.strainer, backend)
+
+        review_elements = self.reviews.select(root)
+        if not review_elements:
+            print("No review elements found with any selector")
+            return None, [], False
+
+        rows = []
+        for review_element in review_elements[:max_reviews]:
+            try:
+                rows.append(tuple(field.extract(review_element) for field in self.fields))
+            except Exception as e:
+                print(f"Error parsing review: {str(e)}")
+                continue
+
+        has_next = False
+        if self.next is not None:
+            next_button = self.next.first(root)
+            has_next = next_button is not None and self.next_disabled not in (attr(next_button, 'class') or '').split()
+
+        return self.product.extract(root), rows, has_next
+
+
+def get_keys(data, keys, default=None):
+    for key in keys:
+        if not isinstance(data, dict) or key not in data:
+            return default
+        data = data[key]
+    return data
+
+
+def get_path(data, path, default=None):
+    return get_keys(data, path.split('.'), default)
+
+
+class ApiExtractor:
+    """Compiled `api` spec"""
+
+    def __init__(self, spec):
+        self.page_url = spec['page_url']
+        self.newest_first = spec.get('newest_first', '')
+        self.page_size = spec['page_size']
+        self.headers = spec.get('headers')
+        self.items = spec['items']
+        self.has_next_path = spec['has_next']
+        self.fields = [(name, path.split('.'), default) for name, (path, default) in spec['fields'].items()]
+
+    def has_items(self, data):
+        return get_path(data, self.items) is not None
+
+    def columns(self, data, limit):
+        """Review fields (without product ID and website) of one API response, as one list per field"""
+        items = (get_path(data, self.items) or [])[:limit]
+        return {name: [get_keys(item, keys, default) for item in items] for name, keys, default in self.fields}
+
+    def has_next(self, data):
+        return bool(get_path(data, self.has_next_path, False))
+
+
+class SiteAdapter:
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec['name']
+        self.hosts = re.compile(spec['hosts'])
+        self.product_id_pattern = re.compile(spec['product_id'])
+        self.base_url = spec['base_url']
+        self.api = ApiExtractor(spec['api']) if spec.get('api') else None
+        self.listing = HtmlExtractor(spec['listing']) if spec.get('listing') else None
+        self.product_page = HtmlExtractor(spec['product_page']) if spec.get('product_page') else None
+
+    @property
+    def host(self):
+        """Host the paginated review requests go to"""
+        return urlsplit(self.base_url).netloc
+
+    def matches(self, product_url):
+        return bool(self.hosts.search((urlsplit(product_url).hostname or '').lower()))
+
+    def product_id(self, product_url):
+        match = self.product_id_pattern.search(product_url)
+        return match.group(1) if match else None
+
+    def page_url(self, source, product_id, page, newest_first=False):
+        return source.page_url.format(
+            base_url=self.base_url,
+            product_id=product_id,
+            page=page,
+            page_size=getattr(source, 'page_size', ''),
+            sort=source.newest_first if newest_first else '',
+        )
+
+    def extractor(self, part):
+        return self.listing if part == 'listing' else self.product_page
+
+
+SITES = {}
+
+_registrations = itertools.count()
+
+
+class PortableSite:
+    """A site registered outside this module, as sent to the parse workers.
+
+    It pickles as its spec, and each process compiles it once. Equal for the
+    same registration, so parsed pages can be cached per site.
+    """
+
+    _compiled = {}
+
+    def __init__(self, adapter, registration):
+        self.key = (adapter.name, registration)
+        self.spec = adapter.spec
+
+    def __eq__(self, other):
+        return isinstance(other, PortableSite) and other.key == self.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def adapter(self):
+        if self.key not in self._compiled:
+            self._compiled[self.key] = SiteAdapter(self.spec)
+        return self._compiled[self.key]
+
+
+def register(spec):
+    """Compile a site spec and add it to the registry.
+
+    A spec registered outside this module is pickled to the parse workers
+    with every page, so its `clean` functions and strainers must be
+    module-level objects, not lambdas.
+    """
+    adapter = SiteAdapter(spec)
+    adapter.portable = PortableSite(adapter, next(_registrations))
+    SITES[adapter.name] = adapter
+    return adapter
+
+
+register(FLIPKART)
+register(AMAZON)
+
+# What the parse workers get when they import this module
+BUILTIN_SITES = dict(SITES)
+
+
+def worker_site(adapter):
+    """How parse_listing in a parse worker finds `adapter`: its name, or its spec for other sites"""
+    if BUILTIN_SITES.get(adapter.name) is adapter:
+        return adapter.name
+    return adapter.portable
+
+
+def get_site(website):
+    """Adapter for a website name such as 'Flipkart'; raises ValueError if unsupported"""
+    for name, adapter in SITES.items():
+        if name in website.lower():
+            return adapter
+    raise ValueError('Unsupported website')
+
+
+def site_for_url(product_url):
+    """Name of the site serving a product URL, or None for other sites"""
+    for name, adapter in SITES.items():
+        if adapter.matches(product_url):
+            return name
+    return None
+
+
+def parse_listing(content, site, part='listing', max_reviews=10, backend=None):
+    """Parse an HTML review page of `site`, a name or a worker_site() (module level, so the parse pool can run it)"""
+    adapter = site.adapter() if isinstance(site, PortableSite) else SITES[site]
+    return adapter.extractor(part).parse(content, max_reviews, backend)
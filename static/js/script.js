@@ -27,7 +27,7 @@ document.addEventListener('DOMContentLoaded', function() {
         errorElement.style.display = 'none';
         
         try {
-            const response = await fetch('/scrape', {
+            const response = await fetch('/scrape/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -35,21 +35,39 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({
                     url: productUrl,
                     website: website,
-                    max_reviews: maxReviews
+                    max_reviews: maxReviews,
+                    format: 'ndjson'
                 })
             });
             
-            const data = await response.json();
-            
-            if (data.error) {
-                showError(data.error);
+            if (!response.ok) {
+                const errorData = await response.json();
+                showError(errorData.error || 'Scraping failed');
                 return;
             }
             
-            currentReviews = data.reviews;
-            displayReviews(currentReviews);
-            reviewCount.textContent = `(${data.count} reviews)`;
-            resultsSection.style.display = 'block';
+            // Render each page of reviews as soon as the server sends it
+            currentReviews = [];
+            reviewsList.innerHTML = '';
+            reviewCount.textContent = '(0 reviews)';
+            
+            await readNdjson(response, function(message) {
+                if (message.error) {
+                    showError(message.error);
+                } else if (message.reviews) {
+                    currentReviews = currentReviews.concat(message.reviews);
+                    appendReviews(message.reviews);
+                    reviewCount.textContent = `(${currentReviews.length} reviews)`;
+                    resultsSection.style.display = 'block';
+                } else if (message.done && message.partial) {
+                    // Some pages could not be fetched; show what the others gave
+                    if (message.count === 0) {
+                        showError(message.failed_pages[0].error);
+                    } else {
+                        reviewCount.textContent = `(${currentReviews.length} reviews, ${message.failed_pages.length} pages failed)`;
+                    }
+                }
+            });
             
         } catch (error) {
             showError('An error occurred while scraping: ' + error.message);
@@ -58,6 +76,26 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
+    async function readNdjson(response, onMessage) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => onMessage(JSON.parse(line)));
+        }
+        
+        if (buffer.trim()) {
+            onMessage(JSON.parse(buffer));
+        }
+    }
+    
     exportBtn.addEventListener('click', async function() {
         const website = document.getElementById('websiteSelect').value;
         
@@ -92,9 +130,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
-    function displayReviews(reviews) {
-        reviewsList.innerHTML = '';
-        
+    function appendReviews(reviews) {
         reviews.forEach(review => {
             const row = document.createElement('tr');
             
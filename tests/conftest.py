@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import mongomock
+    from mongomock.collection import BulkOperationBuilder
+except ImportError:
+    mongomock = None
+
+
+def _ignore_sort(method):
+    def wrapper(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+# pymongo 4.9+ passes a `sort` argument to bulk updates, which mongomock 4.3 does not accept
+if mongomock is not None:
+    for name in ('add_update', 'add_replace'):
+        setattr(BulkOperationBuilder, name, _ignore_sort(getattr(BulkOperationBuilder, name)))
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    if mongomock is None:
+        pytest.skip('mongomock is not installed')
+    import database
+    # Every test gets a fresh server, so indexes are created again
+    monkeypatch.setattr(database, '_indexed', set())
+    return mongomock.MongoClient().db.reviews
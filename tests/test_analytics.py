@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+
+from analytics import TextAnalyzer
+
+
+def test_finish_without_any_signature():
+    analyzer = TextAnalyzer()
+    analyzer.add_batch(['', ''], ['x', 'x'])
+
+    earliest, spam, keywords = analyzer.finish()
+
+    assert earliest.tolist() == [0, 1]
+    assert spam.tolist() == [False, False]
+    assert keywords == {'x': []}
+
+
+def test_finish_groups_near_duplicates():
+    analyzer = TextAnalyzer()
+    text = 'Great phone with a bright screen and a battery that lasts all day'
+    analyzer.add_batch([text, 'Terrible camera, returned it after a week', text], ['x', 'x', 'x'])
+
+    earliest, _, _ = analyzer.finish()
+
+    assert earliest.tolist() == [0, 1, 0]
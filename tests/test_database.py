@@ -0,0 +1,146 @@
+import pytest
+from pymongo.errors import BulkWriteError
+
+import database
+from review_stats import stats_collection
+
+
+def make_reviews(count, rating=4):
+    return [{
+        'product': 'Mock Phone',
+        'product_id': 'B0MOCK0001',
+        'user': f'Customer {i}',
+        'rating': rating,
+        'title': 'Good phone',
+        'comment': f'Review number {i}',
+        'date': '1 March 2023',
+        'website': 'amazon',
+    } for i in range(count)]
+
+
+def test_first_save_inserts_every_review(collection):
+    counts = database.save_to_mongodb(make_reviews(600), 'amazon', collection=collection)
+
+    assert counts == {'inserted': 600, 'updated': 0, 'skipped': 0}
+    assert collection.count_documents({}) == 600
+    assert 'review_identity' in collection.index_information()
+
+
+def test_saving_again_skips_stored_and_repeated_reviews(collection):
+    reviews = make_reviews(10)
+    database.save_to_mongodb(reviews, 'amazon', collection=collection)
+
+    counts = database.save_to_mongodb(reviews + reviews[:3], 'Amazon', collection=collection)
+
+    assert counts == {'inserted': 0, 'updated': 0, 'skipped': 13}
+    assert collection.count_documents({}) == 10
+
+
+def test_changed_rating_updates_the_stored_review(collection):
+    reviews = make_reviews(10)
+    database.save_to_mongodb(reviews, 'amazon', collection=collection)
+    reviews[0]['rating'] = 1
+
+    counts = database.save_to_mongodb(reviews, 'amazon', collection=collection)
+
+    assert counts == {'inserted': 0, 'updated': 1, 'skipped': 9}
+    assert collection.count_documents({'rating': 1}) == 1
+    stats = stats_collection(collection).find_one({'_id': 'amazon:B0MOCK0001'})
+    assert stats['count'] == 10
+    assert stats['stars'] == {'1': 1, '4': 9}
+
+
+def test_duplicate_key_race_counts_as_skipped(collection):
+    reviews = make_reviews(10)
+    bulk_write = collection.bulk_write
+
+    def losing_bulk_write(operations, ordered=True):
+        # A concurrent save inserts the first three reviews just before this write, so their upserts hit the unique index
+        bulk_write(operations[:3], ordered=ordered)
+        result = bulk_write(operations[3:], ordered=ordered).bulk_api_result
+        raise BulkWriteError({
+            'writeErrors': [{'index': i, 'code': 11000, 'errmsg': 'E11000 duplicate key error'} for i in range(3)],
+            'nUpserted': result['nUpserted'],
+            'nMatched': result['nMatched'],
+            'nModified': result['nModified'],
+            'upserted': [dict(item, index=item['index'] + 3) for item in result['upserted']],
+        })
+
+    collection.bulk_write = losing_bulk_write
+    counts = database.save_to_mongodb(reviews, 'amazon', collection=collection)
+
+    assert counts == {'inserted': 7, 'updated': 0, 'skipped': 3}
+    assert collection.count_documents({}) == 10
+    # The concurrent save counts its own reviews in the stats
+    assert stats_collection(collection).find_one({'_id': 'amazon:B0MOCK0001'})['count'] == 7
+
+
+def test_rejected_reviews_are_raised_for_the_writer(collection):
+    reviews = make_reviews(10)
+    bulk_write = collection.bulk_write
+
+    def rejecting_bulk_write(operations, ordered=True):
+        # The first two reviews fail validation; the rest are stored
+        result = bulk_write(operations[2:], ordered=ordered).bulk_api_result
+        raise BulkWriteError({
+            'writeErrors': [{'index': i, 'code': 121, 'errmsg': 'Document failed validation'} for i in range(2)],
+            'nUpserted': result['nUpserted'],
+            'nMatched': result['nMatched'],
+            'nModified': result['nModified'],
+            'upserted': [dict(item, index=item['index'] + 2) for item in result['upserted']],
+        })
+
+    collection.bulk_write = rejecting_bulk_write
+    with pytest.raises(Exception, match='2 reviews not stored'):
+        database.save_to_mongodb(reviews, 'amazon', collection=collection, raise_errors=True)
+    assert collection.count_documents({}) == 8
+
+    # The writer spills and retries them; saving again stores only the missing two
+    collection.bulk_write = bulk_write
+    counts = database.save_to_mongodb(reviews, 'amazon', collection=collection)
+    assert counts == {'inserted': 2, 'updated': 0, 'skipped': 8}
+
+
+def read_all_pages(collection, query, limit):
+    reviews, cursor = database.find_reviews(query, limit=limit, collection=collection)
+    pages = 1
+    while cursor:
+        page, cursor = database.find_reviews(query, after=cursor, limit=limit, collection=collection)
+        reviews += page
+        pages += 1
+    return reviews, pages
+
+
+def test_pages_follow_the_index_that_serves_the_filter(collection):
+    reviews = make_reviews(25)
+    for i, review in enumerate(reviews):
+        review['rating'] = i % 5 + 1
+        # Some dates cannot be parsed and are stored as null
+        review['date'] = f'{i % 9 + 1} March 2023' if i % 4 else 'N/A'
+    database.save_to_mongodb(reviews, 'amazon', collection=collection)
+
+    for query, field in [
+        (database.review_query(product='B0MOCK0001'), 'date'),
+        (database.review_query(website='amazon', min_rating=2), 'rating'),
+        (database.review_query(website='amazon', date_from='2023-03-03'), 'date'),
+        (database.review_query(min_rating=1), None),
+    ]:
+        expected = list(collection.find(query))
+        found, pages = read_all_pages(collection, query, 4)
+        assert len(found) == len(expected)
+        assert len({review['user'] for review in found}) == len(found)
+        assert pages == len(found) // 4 + 1
+        if field == 'rating':
+            assert [review['rating'] for review in found] == sorted(review['rating'] for review in found)
+        # The internal sort field is not exposed
+        assert all('review_date' not in review for review in found)
+
+
+def test_cursor_from_another_filter_is_rejected(collection):
+    database.save_to_mongodb(make_reviews(5), 'amazon', collection=collection)
+    _, cursor = database.find_reviews(database.review_query(product='B0MOCK0001'), limit=2, collection=collection)
+
+    with pytest.raises(ValueError):
+        database.find_reviews(database.review_query(website='amazon'), after=cursor, collection=collection)
+    with pytest.raises(ValueError):
+        database.find_reviews(after='not-a-cursor', collection=collection)
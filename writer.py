@@ -0,0 +1,310 @@
+"""Background persistence of scraped reviews.
+
+Scrapes hand their reviews to `ReviewWriter.submit`, which queues them and
+returns at once. A writer thread saves the queue to MongoDB in batches of up
+to `batch_size`, as soon as a batch is full or the oldest queued review has
+waited `flush_interval` seconds. The queue is bounded: when it is full,
+submit blocks for up to `max_wait` seconds for room (backpressure), and
+whatever still does not fit goes to the spill file.
+
+When a save fails, for example because MongoDB is down, the batch is
+appended to a local JSON Lines spill file. Later batches are spilled
+directly instead of each waiting out a timeout. Every `retry_interval`
+seconds the writer replays the spill file into MongoDB. Saves are
+idempotent upserts, so a replay that fails part-way can simply run again.
+
+SCRAPER_SPILL_PATH sets the spill file (default .cache/spill.jsonl) and
+SCRAPER_WRITER_QUEUE the queue size in reviews. The queue holds submitted
+ReviewBatches whole, splitting one only where a save batch ends.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from database import SAVE_BATCH_SIZE, save_to_mongodb
+from metrics import Counter, Gauge
+from reviews import ReviewBatch
+
+WRITER_QUEUE_SIZE = int(os.environ.get('SCRAPER_WRITER_QUEUE', 50000))
+SPILL_PATH = os.environ.get('SCRAPER_SPILL_PATH', os.path.join('.cache', 'spill.jsonl'))
+
+# Seconds a queued review waits at most before its batch is flushed
+FLUSH_INTERVAL = 1.0
+
+# Seconds submit waits for room in a full queue before spilling
+MAX_SUBMIT_WAIT = 2.0
+
+# Seconds between attempts to replay the spill file after a failed save
+RETRY_INTERVAL = 30.0
+
+# Seconds a closing writer gets to flush what is still queued
+CLOSE_TIMEOUT = 10.0
+
+
+def group_by_website(chunks):
+    groups = {}
+    for website, reviews in chunks:
+        groups.setdefault(website, ReviewBatch()).extend(reviews)
+    return groups
+
+
+class ReviewWriter:
+    def __init__(self, save=save_to_mongodb, max_queue=WRITER_QUEUE_SIZE, batch_size=SAVE_BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_wait=MAX_SUBMIT_WAIT, spill_path=SPILL_PATH,
+                 retry_interval=RETRY_INTERVAL):
+        # save(reviews, website, raise_errors=True) must raise when the reviews were not stored
+        self.save = save
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_wait = max_wait
+        self.spill_path = spill_path
+        self.retry_interval = retry_interval
+        self.counters = {'queued': 0, 'saved': 0, 'spilled': 0, 'replayed': 0, 'failed_saves': 0}
+        # (queued_at, website, ReviewBatch), and the number of reviews in them
+        self._queue = deque()
+        self._queued = 0
+        self._condition = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self._closing = False
+        # While set, saves are not attempted until the next replay is due
+        self._retry_at = 0.0
+        self._failing = False
+
+    @property
+    def replaying_path(self):
+        return self.spill_path + '.replaying'
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='review-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def submit(self, reviews, website):
+        """Queue reviews to be saved; returns counts of reviews queued and spilled"""
+        self.start()
+        pending = reviews if isinstance(reviews, ReviewBatch) else ReviewBatch(reviews)
+        queued = 0
+        deadline = time.monotonic() + self.max_wait
+        with self._condition:
+            while pending and not self._closing:
+                room = self.max_queue - self._queued
+                if room <= 0:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                    continue
+                chunk = pending if len(pending) <= room else pending[:room]
+                self._queue.append((time.monotonic(), website, chunk))
+                self._queued += len(chunk)
+                queued += len(chunk)
+                pending = pending[len(chunk):] if len(chunk) < len(pending) else ()
+                self._condition.notify_all()
+            self.counters['queued'] += queued
+
+        if pending:
+            print(f"Review queue full, spilling {len(pending)} reviews to {self.spill_path}")
+            self._spill([(website, pending)])
+        return {'queued': queued, 'spilled': len(pending)}
+
+    def _spill_pending(self):
+        return os.path.exists(self.spill_path) or os.path.exists(self.replaying_path)
+
+    def _next_batch(self):
+        """Wait for a batch to flush, as (website, reviews) chunks; [] when only a replay is due, None once closed and drained"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self._queued >= self.batch_size or (self._closing and self._queue):
+                    break
+                if self._queue and now - self._queue[0][0] >= self.flush_interval:
+                    break
+                if self._closing:
+                    return None
+                replay_due = self._retry_at if self._spill_pending() else None
+                if replay_due is not None and now >= replay_due:
+                    return []
+
+                timeouts = []
+                if self._queue:
+                    timeouts.append(self._queue[0][0] + self.flush_interval - now)
+                if replay_due is not None:
+                    timeouts.append(replay_due - now)
+                self._condition.wait(min(timeouts) if timeouts else None)
+
+            batch = []
+            size = 0
+            while self._queue and size < self.batch_size:
+                queued_at, website, reviews = self._queue.popleft()
+                need = self.batch_size - size
+                if len(reviews) > need:
+                    # The rest keeps its place, and its age, at the front of the queue
+                    self._queue.appendleft((queued_at, website, reviews[need:]))
+                    reviews = reviews[:need]
+                batch.append((website, reviews))
+                size += len(reviews)
+            self._queued -= size
+            # Submitters may be waiting for room
+            self._condition.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._write(batch)
+            if self._spill_pending() and time.monotonic() >= self._retry_at:
+                self._replay()
+
+    def _save_all(self, chunks):
+        for website, reviews in group_by_website(chunks).items():
+            self.save(reviews, website, raise_errors=True)
+
+    def _failed(self, error, what):
+        print(f"Saving {what} to MongoDB failed, retrying in {self.retry_interval:.0f}s: {str(error)}")
+        self.counters['failed_saves'] += 1
+        self._failing = True
+        self._retry_at = time.monotonic() + self.retry_interval
+
+    def _write(self, batch):
+        if self._failing and time.monotonic() < self._retry_at:
+            self._spill(batch)
+            return
+        try:
+            self._save_all(batch)
+        except Exception as e:
+            self._failed(e, f"{sum(len(reviews) for _, reviews in batch)} reviews")
+            self._spill(batch)
+            return
+        self._failing = False
+        self.counters['saved'] += sum(len(reviews) for _, reviews in batch)
+
+    def _spill(self, chunks):
+        count = 0
+        with self._spill_lock:
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for website, reviews in chunks:
+                    prefix = '{"website": ' + json.dumps(website) + ', "review": '
+                    for review in reviews.iter_json():
+                        f.write(prefix + review + '}\n')
+                    count += len(reviews)
+                f.flush()
+                os.fsync(f.fileno())
+            self.counters['spilled'] += count
+        with self._condition:
+            # A replay of what was just spilled waits for the retry interval, unless one is already scheduled
+            now = time.monotonic()
+            if self._retry_at <= now:
+                self._retry_at = now + self.retry_interval
+
+    def _read_spill(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash while spilling
+                    print(f"Skipping unreadable line in {path}")
+                    continue
+                yield record['website'], ReviewBatch([record['review']])
+
+    def _replay(self):
+        """Save the spill file to MongoDB, removing it once everything in it is stored"""
+        with self._spill_lock:
+            # New spills go to a fresh file while this one is replayed
+            if not os.path.exists(self.replaying_path) and os.path.exists(self.spill_path):
+                os.replace(self.spill_path, self.replaying_path)
+        if not os.path.exists(self.replaying_path):
+            return
+
+        replayed = 0
+        batch = []
+        try:
+            for chunk in self._read_spill(self.replaying_path):
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    self._save_all(batch)
+                    replayed += len(batch)
+                    batch = []
+            if batch:
+                self._save_all(batch)
+                replayed += len(batch)
+        except Exception as e:
+            self._failed(e, f"spilled reviews from {self.replaying_path}")
+            return
+
+        os.remove(self.replaying_path)
+        self._failing = False
+        self.counters['replayed'] += replayed
+        print(f"Replayed {replayed} spilled reviews into MongoDB")
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """Flush the queue and stop the writer; what cannot be saved in time is spilled"""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._condition:
+            left = [item[1:] for item in self._queue]
+            self._queue.clear()
+            self._queued = 0
+        if left:
+            self._spill(left)
+
+    def stats(self):
+        with self._condition:
+            queue_length = self._queued
+        return dict(self.counters, queue_length=queue_length, failing=self._failing, spill_pending=self._spill_pending())
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the process-wide review writer, starting it on first use"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ReviewWriter()
+            _writer.start()
+    return _writer
+
+
+def writer_failing():
+    """True while the background writer's saves are failing, e.g. because MongoDB is down"""
+    return _writer is not None and _writer.stats()['failing']
+
+
+def writer_counters():
+    if _writer is None:
+        return {}
+    return {(name,): count for name, count in _writer.counters.items() if name != 'failed_saves'}
+
+
+def writer_failed_saves():
+    if _writer is None:
+        return {}
+    return {(): _writer.counters['failed_saves']}
+
+
+def writer_queue_length():
+    if _writer is None:
+        return {}
+    return {(): _writer.stats()['queue_length']}
+
+
+Counter('scraper_writer_reviews_total', 'Reviews handled by the background writer, per outcome', ['outcome'], function=writer_counters)
+Counter('scraper_writer_failed_saves_total', 'Batches or replays the background writer could not save', function=writer_failed_saves)
+Gauge('scraper_writer_queue_length', 'Reviews queued for the background writer', function=writer_queue_length)